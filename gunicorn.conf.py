@@ -0,0 +1,50 @@
+# Gunicorn configuration for serving restaurant_system.asgi:application with Uvicorn workers.
+#
+#   gunicorn -c gunicorn.conf.py restaurant_system.asgi:application
+#
+# Each worker runs an event loop, so one process holds thousands of mostly idle connections;
+# set ASYNC_READ_VIEWS=True so the hot read endpoints run as coroutines.
+
+import multiprocessing
+import os
+
+bind = os.getenv('GUNICORN_BIND', '0.0.0.0:8000')
+worker_class = 'uvicorn.workers.UvicornWorker'
+# Several workers need a cache they all share (REDIS_URL): the menu cache and rate limits live in Django's
+# cache, and so does the user cache once REDIS_URL is set (see AUTH_USER_CACHE); with a per-process cache a
+# change only invalidates the worker that made it. Without one, run a single worker unless GUNICORN_WORKERS
+# says otherwise (the user cache then keeps entries for a few seconds only).
+default_workers = multiprocessing.cpu_count() * 2 + 1 if os.getenv('REDIS_URL') else 1
+workers = int(os.getenv('GUNICORN_WORKERS', default_workers))
+# Restart workers now and then to contain slow leaks, staggered so they don't all restart at once
+max_requests = int(os.getenv('GUNICORN_MAX_REQUESTS', 10000))
+max_requests_jitter = 1000
+timeout = int(os.getenv('GUNICORN_TIMEOUT', 60))
+graceful_timeout = 30
+keepalive = 5
+accesslog = '-'
+
+
+def on_starting(server):
+    # Workers add up their request metrics through files in METRICS_DIR (see restaurant/metrics.py);
+    # start every server from zero rather than from the previous run's counts
+    metrics_dir = os.getenv('METRICS_DIR')
+    if metrics_dir and os.path.isdir(metrics_dir):
+        for filename in os.listdir(metrics_dir):
+            os.remove(os.path.join(metrics_dir, filename))
+
+
+def child_exit(server, worker):
+    # Add the exited worker's metrics to the running totals, so a restarted worker (max_requests)
+    # neither loses them nor leaves its file behind
+    metrics_dir = os.getenv('METRICS_DIR')
+    if metrics_dir:
+        os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'restaurant_system.settings')
+        from restaurant.metrics import fold_process_metrics
+        fold_process_metrics(metrics_dir, worker.pid)
+
+
+def post_worker_init(worker):
+    # Load the recommendation counts in the background rather than in the first request that needs them
+    from restaurant.recommendations import recommendation_engine
+    recommendation_engine.start_warming()
@@ -1,9 +1,57 @@
-from django.contrib import admin
-from .models import Order,CustomUser,FoodItem
+from django.contrib import admin, messages
+from .models import Order,OrderItem,CustomUser,FoodItem
+from .orders import StatusConflict, delete_order, transition_order_status
 
 # Register your models here.
 
 
+class OrderItemInline(admin.TabularInline):
+    """Line items are fixed once the order is placed: the total and the sales rollups are derived from them."""
+    model = OrderItem
+    extra = 0
+    can_delete = False
+    readonly_fields = ('food_item', 'quantity', 'unit_price')
+
+    def has_add_permission(self, request, obj=None):
+        return False
+
+
+class OrderAdmin(admin.ModelAdmin):
+    """
+    Status changes and deletions go through orders.py, like the API's, so transitions are checked, the version
+    moves on and the sales rollups stay current; the fields they maintain are read-only here.
+    """
+    list_display = ('id', 'customer', 'status', 'total_price')
+    list_select_related = ('customer',)
+    readonly_fields = ('status', 'total_price', 'version', 'created_at')
+    inlines = [OrderItemInline]
+    actions = ['mark_completed', 'mark_cancelled']
+
+    def change_status(self, request, queryset, status):
+        changed = 0
+        for order_id in queryset.values_list('pk', flat=True):
+            try:
+                changed += transition_order_status(order_id, status)[1]
+            except (StatusConflict, Order.DoesNotExist) as e:
+                self.message_user(request, f"Order {order_id}: {e}", messages.WARNING)
+        self.message_user(request, f"{changed} order(s) marked {status}.")
+
+    @admin.action(description="Mark selected orders as completed")
+    def mark_completed(self, request, queryset):
+        self.change_status(request, queryset, 'completed')
+
+    @admin.action(description="Mark selected orders as cancelled")
+    def mark_cancelled(self, request, queryset):
+        self.change_status(request, queryset, 'cancelled')
+
+    def delete_model(self, request, obj):
+        delete_order(obj)
+
+    def delete_queryset(self, request, queryset):
+        for order in queryset:
+            delete_order(order)
+
+
 admin.site.register(CustomUser)
-admin.site.register(Order)
-admin.site.register(FoodItem)
\ No newline at end of file
+admin.site.register(Order, OrderAdmin)
+admin.site.register(FoodItem)
@@ -0,0 +1,206 @@
+"""
+Sales rollups for the admin analytics endpoints.
+
+DailyStatusSales (orders and revenue per day and status) and DailyItemSales (units, revenue and orders per
+day and food item) are updated in the same transaction as the order writes that change them: placing
+orders, changing an order's status and deleting an order (see restaurant/orders.py). Each update is one
+INSERT ... ON CONFLICT DO UPDATE that adds to the existing counts, so reports read a handful of small rows
+instead of aggregating over every order.
+
+A day is the date of the order's created_at in TIME_ZONE. Item sales leave out cancelled orders. Writes
+that skip those paths (bulk-created seed data, deleting a customer with orders) are reconciled by
+rebuild_rollups(), which the backfill_sales_rollups command runs over history in chunks of days. A rebuild
+locks the rollup tables against the live upserts for the length of its chunk, so it is safe to run while
+orders come in; order writes that need the rollups wait for the chunk to commit.
+"""
+import datetime
+from decimal import Decimal
+
+from django.db import connections, router, transaction
+from django.db.models import Count, DecimalField, F, Sum
+from django.db.models.functions import Lower, TruncDate
+from django.conf import settings
+from django.utils import timezone
+from django.utils.dateparse import parse_date
+
+from .models import DailyItemSales, DailyStatusSales, Order, OrderItem
+
+# Orders in these statuses are not counted as items sold
+UNSOLD_STATUSES = {'cancelled'}
+# Days reported when no start is given, and the longest range one request may cover
+ANALYTICS_DEFAULT_DAYS = getattr(settings, 'ANALYTICS_DEFAULT_DAYS', 30)
+ANALYTICS_MAX_DAYS = getattr(settings, 'ANALYTICS_MAX_DAYS', 366)
+
+
+def order_day(order):
+    return timezone.localdate(order.created_at)
+
+
+def _increment(model, key_fields, value_fields, deltas):
+    """ Add deltas ({key tuple: value tuple}) to model's rows, creating missing ones, with a single upsert """
+    if not deltas:
+        return
+    connection = connections[router.db_for_write(model)]
+    quote = connection.ops.quote_name
+    fields = [model._meta.get_field(name) for name in key_fields + value_fields]
+    table = quote(model._meta.db_table)
+    columns = ', '.join(quote(field.column) for field in fields)
+    keys = ', '.join(quote(field.column) for field in fields[:len(key_fields)])
+    updates = ', '.join(
+        f'{quote(field.column)} = {table}.{quote(field.column)} + EXCLUDED.{quote(field.column)}'
+        for field in fields[len(key_fields):]
+    )
+    row = '(' + ', '.join(['%s'] * len(fields)) + ')'
+    params = []
+    # Rows are locked in key order, so concurrent writers touching the same rows can't deadlock
+    for key in sorted(deltas):
+        params.extend(field.get_db_prep_save(value, connection) for field, value in zip(fields, key + deltas[key]))
+    with connection.cursor() as cursor:
+        cursor.execute(
+            f'INSERT INTO {table} ({columns}) VALUES {", ".join([row] * len(deltas))} '
+            f'ON CONFLICT ({keys}) DO UPDATE SET {updates}',
+            params,
+        )
+
+
+def _add(deltas, key, values):
+    current = deltas.get(key)
+    deltas[key] = values if current is None else tuple(a + b for a, b in zip(current, values))
+
+
+def _item_deltas(deltas, day, order_items, sign):
+    for line in order_items:
+        _add(deltas, (day, line.food_item_id), (sign * line.quantity, sign * line.unit_price * line.quantity, sign))
+
+
+def record_orders(orders, order_items, sign=1):
+    """ Count new orders (with their OrderItems) in the rollups, or take deleted ones out with sign=-1 """
+    status_deltas, item_deltas = {}, {}
+    days = {order.pk: order_day(order) for order in orders}
+    unsold = {order.pk for order in orders if order.status.lower() in UNSOLD_STATUSES}
+    for order in orders:
+        _add(status_deltas, (days[order.pk], order.status.lower()), (sign, sign * Decimal(order.total_price)))
+    for line in order_items:
+        if line.order_id not in unsold:
+            _item_deltas(item_deltas, days[line.order_id], [line], sign)
+    _increment(DailyStatusSales, ['day', 'status'], ['order_count', 'revenue'], status_deltas)
+    _increment(DailyItemSales, ['day', 'food_item'], ['quantity', 'revenue', 'order_count'], item_deltas)
+
+
+def record_status_change(order, previous_status):
+    """ Move order from previous_status to its current status; order.order_items is read only if sales change """
+    day, status, previous_status = order_day(order), order.status.lower(), previous_status.lower()
+    total = Decimal(order.total_price)
+    status_deltas = {}
+    _add(status_deltas, (day, previous_status), (-1, -total))
+    _add(status_deltas, (day, status), (1, total))
+    _increment(DailyStatusSales, ['day', 'status'], ['order_count', 'revenue'], status_deltas)
+
+    was_sold, is_sold = previous_status not in UNSOLD_STATUSES, status not in UNSOLD_STATUSES
+    if was_sold != is_sold:
+        item_deltas = {}
+        _item_deltas(item_deltas, day, order.order_items.all(), 1 if is_sold else -1)
+        _increment(DailyItemSales, ['day', 'food_item'], ['quantity', 'revenue', 'order_count'], item_deltas)
+
+
+def parse_day_range(start=None, end=None):
+    """ (start, end) dates from ISO date strings; end defaults to today and start to ANALYTICS_DEFAULT_DAYS before """
+    days = []
+    for value in (start, end):
+        day = parse_date(value) if value else None
+        if value and day is None:
+            raise ValueError(f"Invalid date: {value!r}")
+        days.append(day)
+    start, end = days
+    end = end or timezone.localdate()
+    start = start or end - datetime.timedelta(days=ANALYTICS_DEFAULT_DAYS - 1)
+    if start > end:
+        raise ValueError("start must not be after end.")
+    if (end - start).days >= ANALYTICS_MAX_DAYS:
+        raise ValueError(f"At most {ANALYTICS_MAX_DAYS} days per request.")
+    return start, end
+
+
+def day_bounds(start, end):
+    """ The [from, to) datetimes covering days start..end in the current time zone """
+    return (
+        timezone.make_aware(datetime.datetime.combine(start, datetime.time.min)),
+        timezone.make_aware(datetime.datetime.combine(end + datetime.timedelta(days=1), datetime.time.min)),
+    )
+
+
+def _lock_rollups():
+    """
+    Keep the live upserts out of the rollup tables until the current transaction ends.
+
+    SHARE ROW EXCLUSIVE conflicts with the ROW EXCLUSIVE lock every INSERT ... ON CONFLICT takes, but not with
+    reads. Order writes that already upserted have committed once this returns, so the rebuild counts their
+    orders; the ones still to come wait, and add their deltas on top of the rebuilt rows.
+    """
+    connection = connections[router.db_for_write(DailyStatusSales)]
+    if connection.vendor != 'postgresql':
+        return  # SQLite runs one write transaction at a time; the rebuild's DELETE takes that lock
+    tables = ', '.join(connection.ops.quote_name(model._meta.db_table) for model in (DailyStatusSales, DailyItemSales))
+    with connection.cursor() as cursor:
+        cursor.execute(f'LOCK TABLE {tables} IN SHARE ROW EXCLUSIVE MODE')
+
+
+def rebuild_rollups(start, end):
+    """ Recompute the rollups for days start..end (inclusive) from the orders; returns the orders counted """
+    lower, upper = day_bounds(start, end)
+    with transaction.atomic():
+        _lock_rollups()
+        DailyStatusSales.objects.filter(day__range=(start, end)).delete()
+        DailyItemSales.objects.filter(day__range=(start, end)).delete()
+
+        statuses = list(Order.objects.filter(created_at__gte=lower, created_at__lt=upper).annotate(
+            day=TruncDate('created_at'), status_key=Lower('status'),
+        ).values('day', 'status_key').annotate(order_count=Count('id'), revenue=Sum('total_price')).order_by())
+        DailyStatusSales.objects.bulk_create([
+            DailyStatusSales(day=row['day'], status=row['status_key'], order_count=row['order_count'], revenue=row['revenue'])
+            for row in statuses
+        ])
+
+        items = OrderItem.objects.filter(order__created_at__gte=lower, order__created_at__lt=upper)
+        for status in UNSOLD_STATUSES:
+            items = items.exclude(order__status__iexact=status)
+        items = items.annotate(day=TruncDate('order__created_at')).values('day', 'food_item_id').annotate(
+            units=Sum('quantity'),
+            sales=Sum(F('unit_price') * F('quantity'), output_field=DecimalField(max_digits=14, decimal_places=2)),
+            orders=Count('order_id'),  # One line per order and item
+        ).order_by()
+        DailyItemSales.objects.bulk_create([
+            DailyItemSales(day=row['day'], food_item_id=row['food_item_id'], quantity=row['units'],
+                           revenue=row['sales'], order_count=row['orders'])
+            for row in items
+        ])
+    return sum(row['order_count'] for row in statuses)
+
+
+def daily_sales(start, end):
+    """ Per day: orders and revenue of orders that aren't cancelled, and orders and revenue by status """
+    days = {}
+    rows = DailyStatusSales.objects.filter(day__range=(start, end), order_count__gt=0).order_by('day', 'status')
+    for row in rows:
+        day = days.setdefault(row.day, {'day': row.day, 'orders': 0, 'revenue': Decimal('0.00'), 'statuses': {}})
+        day['statuses'][row.status] = {'orders': row.order_count, 'revenue': row.revenue}
+        if row.status not in UNSOLD_STATUSES:
+            day['orders'] += row.order_count
+            day['revenue'] += row.revenue
+    return list(days.values())
+
+
+def top_items(start, end, limit=10, by='quantity'):
+    """ The food items with the most units sold (or revenue, with by='revenue') over days start..end """
+    rows = (
+        DailyItemSales.objects.filter(day__range=(start, end))
+        .values('food_item_id', 'food_item__name')
+        .annotate(units=Sum('quantity'), sales=Sum('revenue'), orders=Sum('order_count'))
+        .filter(units__gt=0)
+        .order_by('-sales' if by == 'revenue' else '-units', 'food_item_id')[:limit]
+    )
+    return [
+        {'food_item': row['food_item_id'], 'name': row['food_item__name'], 'quantity': row['units'],
+         'revenue': row['sales'], 'orders': row['orders']}
+        for row in rows
+    ]
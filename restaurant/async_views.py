@@ -0,0 +1,256 @@
+"""
+Async versions of the hot read endpoints, login and sign-up, and the order events stream, for deployments
+served over ASGI.
+
+GET requests are handled natively: authentication, cache lookups and queries use the async cache and ORM
+APIs, so a slow query parks a coroutine instead of a worker thread. Other methods are passed on to the
+regular DRF views. Responses are rendered by the renderer the Accept header picks from
+REST_FRAMEWORK['DEFAULT_RENDERER_CLASSES'], as DRF would, so cache entries and ETags are shared with the sync views.
+
+Login and sign-up run the DRF views on a small pool of their own threads. Under ASGI, Django runs every sync
+view of a worker on one shared thread, so a password hash there would hold up all the others, and the thread
+semaphore in limit_password_hashing would never see more than one holder.
+"""
+import asyncio
+import json
+import time
+import weakref
+from concurrent.futures import ThreadPoolExecutor
+from functools import wraps
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.db import close_old_connections
+from django.http import HttpResponse, StreamingHttpResponse
+from django.utils.cache import patch_cache_control, patch_vary_headers
+from rest_framework import status
+from rest_framework.exceptions import APIException, AuthenticationFailed, NotAcceptable
+from rest_framework.request import Request
+from rest_framework.settings import api_settings
+
+from . import views
+from .authentication import CookieJWTAuthentication, afull_user
+from .events import event_visible_to, get_broker
+from .menu_cache import acached_menu_data, is_not_modified
+from .models import FoodItem
+from .recommendations import get_recommendations
+from .search import MenuSearchFilter
+from .serializers import FoodItemSerializer, UserSerializer
+from .throttling import PASSWORD_HASH_CONCURRENCY, PASSWORD_HASH_WAIT_SECONDS, PasswordHashingBusy
+
+ORDER_EVENTS_HEARTBEAT = getattr(settings, 'ORDER_EVENTS_HEARTBEAT', 15)
+ORDER_EVENTS_MAX_STREAM = getattr(settings, 'ORDER_EVENTS_MAX_STREAM', 300)
+ORDER_EVENTS_RETRY_MS = 3000
+
+_hashing_executor = ThreadPoolExecutor(PASSWORD_HASH_CONCURRENCY, thread_name_prefix='password-hashing')
+_hashing_slots = weakref.WeakKeyDictionary()  # One semaphore per event loop
+
+
+def data_renderers():
+    """ The configured renderers except the browsable API, which needs a DRF view to render with """
+    return [renderer() for renderer in api_settings.DEFAULT_RENDERER_CLASSES if renderer.format != 'api']
+
+
+def render_response(data, status=status.HTTP_200_OK, request=None):
+    """ Render data with request's negotiated renderer (the first configured one without a request) """
+    if request is None:
+        renderer = data_renderers()[0]
+        accepted_media_type = renderer.media_type
+    else:
+        renderer, accepted_media_type = request.accepted_renderer, request.accepted_media_type
+    content_type = renderer.media_type
+    if renderer.charset:
+        content_type = f'{content_type}; charset={renderer.charset}'
+    return HttpResponse(renderer.render(data, accepted_media_type), content_type=content_type, status=status)
+
+
+def menu_response(request, etag, data):
+    if data is None:
+        response = HttpResponse(status=status.HTTP_304_NOT_MODIFIED)
+    else:
+        response = render_response(data, request=request)
+    response['ETag'] = etag
+    patch_vary_headers(response, ['Accept'])
+    patch_cache_control(response, private=True, no_cache=True)
+    return response
+
+
+async def aauthenticated_request(request):
+    """ Return (DRF Request with the cookie-authenticated user and negotiated renderer, None), or (None, 403/406 response) """
+    drf_request = Request(request)
+    try:
+        drf_request.accepted_renderer, drf_request.accepted_media_type = (
+            api_settings.DEFAULT_CONTENT_NEGOTIATION_CLASS().select_renderer(drf_request, data_renderers())
+        )
+    except NotAcceptable as e:
+        return None, render_response({"detail": e.detail}, status=e.status_code)
+    try:
+        result = await CookieJWTAuthentication().aauthenticate(request)
+    except AuthenticationFailed as e:
+        return None, render_response({"detail": e.detail}, status=status.HTTP_403_FORBIDDEN, request=drf_request)
+    if result is None:
+        return None, render_response({"detail": "Authentication credentials were not provided."},
+                                     status=status.HTTP_403_FORBIDDEN, request=drf_request)
+    drf_request.user = result[0]
+    return drf_request, None
+
+
+def async_read_view(sync_view):
+    """ Handle GET with the decorated coroutine (given an authenticated DRF Request) and defer other methods to sync_view """
+    sync_handler = sync_to_async(sync_view)
+
+    def decorator(handler):
+        @wraps(handler)
+        async def view(request, *args, **kwargs):
+            if request.method != 'GET':
+                return await sync_handler(request, *args, **kwargs)
+
+            drf_request, error_response = await aauthenticated_request(request)
+            if error_response is not None:
+                return error_response
+            try:
+                return await handler(drf_request, *args, **kwargs)
+            except APIException as e:  # e.g. an invalid cursor, answered the way DRF's handler would
+                return render_response({"detail": e.detail}, status=e.status_code, request=drf_request)
+
+        view.csrf_exempt = True  # Like DRF views; the wrapped sync views apply their own checks
+        return view
+
+    return decorator
+
+
+def hashing_slots():
+    loop = asyncio.get_running_loop()
+    slots = _hashing_slots.get(loop)
+    if slots is None:
+        slots = _hashing_slots[loop] = asyncio.Semaphore(PASSWORD_HASH_CONCURRENCY)
+    return slots
+
+
+def password_hashing_view(sync_view):
+    """ Run sync_view on the password-hashing threads, at most PASSWORD_HASH_CONCURRENCY at once, else 503 """
+
+    def run(request, *args, **kwargs):
+        try:
+            return sync_view(request, *args, **kwargs)
+        finally:
+            close_old_connections()  # Request-end cleanup only runs on the thread that handled the request
+
+    handler = sync_to_async(run, thread_sensitive=False, executor=_hashing_executor)
+
+    @wraps(sync_view)
+    async def view(request, *args, **kwargs):
+        slots = hashing_slots()
+        try:
+            await asyncio.wait_for(slots.acquire(), PASSWORD_HASH_WAIT_SECONDS)
+        except asyncio.TimeoutError:
+            response = render_response({"detail": PasswordHashingBusy.default_detail},
+                                       status=PasswordHashingBusy.status_code)
+            response['Retry-After'] = str(PasswordHashingBusy.wait)
+            return response
+        try:
+            return await handler(request, *args, **kwargs)
+        finally:
+            slots.release()
+
+    view.csrf_exempt = True
+    return view
+
+
+register = password_hashing_view(views.register)
+login_view = password_hashing_view(views.login_view)
+
+
+@async_read_view(views.FoodItemViewSet.as_view({'get': 'list', 'post': 'create'}))
+async def food_item_list(request):
+    """ Menu listing with the same filters, search, ordering, pagination and caching as FoodItemViewSet.list """
+
+    async def build():
+        view = views.FoodItemViewSet(request=request, format_kwarg=None, action='list', args=(), kwargs={})
+        queryset = view.get_queryset()
+        if MenuSearchFilter().get_search_term(request):
+            # The in-process search index (non-PostgreSQL backends) is built with the sync ORM
+            queryset = await sync_to_async(view.filter_queryset)(queryset)
+        else:
+            queryset = view.filter_queryset(queryset)
+
+        paginator = view.paginator
+        paginator.count = await queryset.acount() if paginator.include_count(request) else None
+        rows = paginator.finish_page([item async for item in paginator.page_queryset(queryset, request)])
+        return paginator.get_paginated_data(view.get_serializer(rows, many=True).data)
+
+    return menu_response(request, *await acached_menu_data(request, build))
+
+
+@async_read_view(views.FoodItemViewSet.as_view({
+    'get': 'retrieve', 'put': 'update', 'patch': 'partial_update', 'delete': 'destroy',
+}))
+async def food_item_detail(request, pk):
+    """ Single menu item, cached like FoodItemViewSet.retrieve """
+
+    async def build():
+        view = views.FoodItemViewSet(request=request, format_kwarg=None, action='retrieve', args=(), kwargs={'pk': pk})
+        try:
+            item = await view.load_rendered_fields(FoodItem.objects.all()).aget(pk=pk)
+        except FoodItem.DoesNotExist:
+            return None
+        return view.get_serializer(item).data
+
+    etag, data = await acached_menu_data(request, build)
+    if data is None and not is_not_modified(request, etag):
+        return render_response({"detail": "Not found."}, status=status.HTTP_404_NOT_FOUND, request=request)
+    return menu_response(request, etag, data)
+
+
+@async_read_view(views.user_profile)
+async def user_profile(request):
+    return render_response(UserSerializer(await afull_user(request.user)).data, request=request)
+
+
+@async_read_view(views.recommendations)
+async def recommendations(request):
+    try:
+        item_id = request.query_params.get('item')  # "Customers who ordered this also ordered..."
+        if item_id is not None:
+            if not item_id.isdigit():
+                return render_response({"error": "item must be a food item id."}, status=400, request=request)
+            item_id = int(item_id)
+        # Answered from the in-memory engine; the thread hop only matters when it has to sync
+        recommended_items = await sync_to_async(get_recommendations)(request.user, item_id=item_id)
+        return render_response(FoodItemSerializer(recommended_items, many=True).data, request=request)
+
+    except Exception as e:
+        return render_response({"error": f"An error occurred while fetching recommendations: {str(e)}"}, status=500,
+                               request=request)
+
+
+async def order_events(request):
+    """
+    Server-sent events stream of order creation and status changes: every order for admins, a customer's own
+    orders for customers. The stream ends after ORDER_EVENTS_MAX_STREAM seconds; EventSource reconnects.
+    """
+    if request.method != 'GET':
+        return render_response({"detail": f'Method "{request.method}" not allowed.'}, status=status.HTTP_405_METHOD_NOT_ALLOWED)
+    drf_request, error_response = await aauthenticated_request(request)
+    if error_response is not None:
+        return error_response
+    user = drf_request.user
+
+    async def stream():
+        subscription = get_broker().subscribe()
+        try:
+            yield f'retry: {ORDER_EVENTS_RETRY_MS}\n\n'
+            deadline = time.monotonic() + ORDER_EVENTS_MAX_STREAM
+            while time.monotonic() < deadline:
+                event = await subscription.get(timeout=min(ORDER_EVENTS_HEARTBEAT, deadline - time.monotonic()))
+                if event is None:
+                    yield ': keep-alive\n\n'  # Stops proxies from closing an idle connection
+                elif event_visible_to(event, user):
+                    yield f'event: {event["type"]}\ndata: {json.dumps(event)}\n\n'
+        finally:
+            subscription.close()
+
+    response = StreamingHttpResponse(stream(), content_type='text/event-stream')
+    response['Cache-Control'] = 'no-cache'
+    response['X-Accel-Buffering'] = 'no'  # Don't let nginx buffer the stream
+    return response
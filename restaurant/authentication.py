@@ -1,34 +1,194 @@
+import copy
 import logging
+import threading
+import time
+from collections import OrderedDict
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.core.cache import caches
 from rest_framework.authentication import BaseAuthentication
 from rest_framework.exceptions import AuthenticationFailed
-from rest_framework_simplejwt.tokens import AccessToken
+from rest_framework_simplejwt.tokens import AccessToken, RefreshToken
 from datetime import datetime
 
+from .models import ClaimsUser
+from .revocation import revocation_list
+
+logger = logging.getLogger(__name__)
+
+
+class UserCache:
+    """ Per-process TTL/LRU cache of users keyed by id, optionally backed by a shared Django cache """
+
+    def __init__(self, ttl=300, max_size=1024, cache_alias=None, local_ttl=5):
+        self.ttl = ttl
+        self.max_size = max_size
+        self.cache_alias = cache_alias
+        # With a shared cache, keep local copies short-lived so invalidations from other processes show up quickly
+        self.local_ttl = min(ttl, local_ttl) if cache_alias else ttl
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    @classmethod
+    def from_settings(cls):
+        options = getattr(settings, 'AUTH_USER_CACHE', {})
+        return cls(
+            ttl=options.get('TTL', 300),
+            max_size=options.get('MAX_SIZE', 1024),
+            cache_alias=options.get('CACHE_ALIAS'),
+            local_ttl=options.get('LOCAL_TTL', 5),
+        )
+
+    def _shared_key(self, user_id):
+        return f'auth:user:{user_id}'
+
+    def _store(self, user_id, user):
+        with self._lock:
+            self._entries[user_id] = (time.monotonic() + self.local_ttl, user)
+            self._entries.move_to_end(user_id)
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+
+    def get(self, user_id):
+        """ Return a private copy of the user, loading it from the database only on a miss """
+        if self.ttl <= 0:
+            return get_user_model().objects.get(id=user_id)
+
+        with self._lock:
+            entry = self._entries.get(user_id)
+            if entry is not None:
+                if entry[0] > time.monotonic():
+                    self._entries.move_to_end(user_id)
+                    return copy.copy(entry[1])
+                del self._entries[user_id]
+
+        user = None
+        if self.cache_alias:
+            user = caches[self.cache_alias].get(self._shared_key(user_id))
+        if user is None:
+            user = get_user_model().objects.get(id=user_id)
+            if self.cache_alias:
+                caches[self.cache_alias].set(self._shared_key(user_id), user, self.ttl)
+
+        self._store(user_id, user)
+        return copy.copy(user)
+
+    async def aget(self, user_id):
+        """ Async counterpart of get(), using the async ORM and cache APIs on a miss """
+        if self.ttl <= 0:
+            return await get_user_model().objects.aget(id=user_id)
+
+        with self._lock:
+            entry = self._entries.get(user_id)
+            if entry is not None and entry[0] > time.monotonic():
+                self._entries.move_to_end(user_id)
+                return copy.copy(entry[1])
+
+        user = None
+        if self.cache_alias:
+            user = await caches[self.cache_alias].aget(self._shared_key(user_id))
+        if user is None:
+            user = await get_user_model().objects.aget(id=user_id)
+            if self.cache_alias:
+                await caches[self.cache_alias].aset(self._shared_key(user_id), user, self.ttl)
+
+        self._store(user_id, user)
+        return copy.copy(user)
+
+    def invalidate(self, user_id):
+        with self._lock:
+            self._entries.pop(user_id, None)
+        if self.cache_alias:
+            caches[self.cache_alias].delete(self._shared_key(user_id))
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+
+user_cache = UserCache.from_settings()
+
+
+def user_from_claims_enabled():
+    return getattr(settings, 'AUTH_USER_FROM_CLAIMS', False)
+
+
+def set_role_claims(token, user):
+    for field in ClaimsUser.CLAIM_FIELDS:
+        token[field] = getattr(user, field)
+
+
+def refresh_token_for(user):
+    """ A refresh token for user, carrying its role claims when AUTH_USER_FROM_CLAIMS is on """
+    refresh = RefreshToken.for_user(user)
+    if user_from_claims_enabled():
+        set_role_claims(refresh, user)  # Copied into every access token made from it
+    return refresh
+
+
+def user_for_token(access_token):
+    """ A ClaimsUser for tokens with role claims when AUTH_USER_FROM_CLAIMS is on, else the cached user """
+    if user_from_claims_enabled() and all(field in access_token for field in ClaimsUser.CLAIM_FIELDS):
+        return ClaimsUser.from_claims(access_token)
+    return None
+
+
+def full_user(user):
+    """ The complete user for views that use more than the role claims, from the user cache """
+    return user_cache.get(user.pk) if isinstance(user, ClaimsUser) else user
+
+
+async def afull_user(user):
+    return await user_cache.aget(user.pk) if isinstance(user, ClaimsUser) else user
+
+
 class CookieJWTAuthentication(BaseAuthentication):
-    def authenticate(self, request):
+    def decode_token(self, request):
+        """ Return the validated access token from the cookie, or None when there is no cookie """
         token = request.COOKIES.get('access_token')
 
         if not token:
             return None  # No token, let DRF handle it as unauthenticated
 
-        try:
-            access_token = AccessToken(token)
-            exp_timestamp = access_token['exp']
-            current_timestamp = datetime.utcnow().timestamp()
+        access_token = AccessToken(token)
+        exp_timestamp = access_token['exp']
+        current_timestamp = datetime.utcnow().timestamp()
+
+        if current_timestamp > exp_timestamp:
+            raise AuthenticationFailed("Token has expired.")
+        return access_token
 
-            if current_timestamp > exp_timestamp:
-                raise AuthenticationFailed("Token has expired.")
+    def authenticate(self, request):
+        try:
+            access_token = self.decode_token(request)
+            if access_token is None:
+                return None
+            # Answered from this process's revocation filter; only a hit is checked in the database
+            if revocation_list.is_revoked(access_token['jti']):
+                raise AuthenticationFailed("Token has been revoked.")
 
-            # ✅ Ensure user is retrieved correctly
-            user_id = access_token['user_id']
-            from django.contrib.auth import get_user_model
-            User = get_user_model()
-            user = User.objects.get(id=user_id)
+            # ✅ Resolve the user from the token's claims or the cache; the database is only hit on a miss
+            user = user_for_token(access_token) or user_cache.get(access_token['user_id'])
 
-            logging.debug(f"Authenticated user: {user}")
+            logger.debug("Authenticated user: %s", user)
             return (user, None)
         except Exception as e:
-            logging.error(f"Authentication failed: {str(e)}")
+            logger.error("Authentication failed: %s", e)
             raise AuthenticationFailed(f"Invalid token: {str(e)}")
 
-        return None
+    async def aauthenticate(self, request):
+        """ Same as authenticate(), for async views: the user lookup never blocks the event loop """
+        try:
+            access_token = self.decode_token(request)
+            if access_token is None:
+                return None
+            if await revocation_list.ais_revoked(access_token['jti']):
+                raise AuthenticationFailed("Token has been revoked.")
+
+            user = user_for_token(access_token) or await user_cache.aget(access_token['user_id'])
+
+            logger.debug("Authenticated user: %s", user)
+            return (user, None)
+        except Exception as e:
+            logger.error("Authentication failed: %s", e)
+            raise AuthenticationFailed(f"Invalid token: {str(e)}")
@@ -0,0 +1,275 @@
+"""
+Latency and query-count benchmarks for every API endpoint, driven through the test client.
+
+Each scenario is run a few times to warm caches, then timed; requests that write are rolled back so every
+iteration sees the same data. A scenario fails outright when it issues more queries than its budget, and
+a run regresses when p50/p99 latency or the query count grows past the recorded baseline.
+"""
+import json
+import math
+import time
+from contextlib import nullcontext
+from datetime import timedelta
+
+from asgiref.sync import async_to_sync
+from django.conf import settings
+from django.core.cache import cache
+from django.db import connection, transaction
+from django.test import override_settings
+from django.test.utils import CaptureQueriesContext
+from django.urls import path
+from django.utils import timezone
+from rest_framework.settings import api_settings
+from rest_framework.test import APIClient
+
+from .async_views import order_events
+from .authentication import user_cache
+from .menu_cache import bump_menu_version
+from .models import CustomUser, FoodItem, Order, OrderItem
+from .recommendations import recommendation_engine
+from .revocation import revocation_list
+
+BENCHMARK_PASSWORD = 'benchpass'
+
+# The order events stream is only routed with ASYNC_READ_VIEWS (under ASGI); its scenario uses this URLconf
+urlpatterns = [path('api/orders/events/', order_events, name='order-events')]
+
+
+class Scenario:
+    """
+    One request to measure. path and data may contain {food_item}, {order} and {refresh} placeholders;
+    data is sent as form data unless json is set.
+
+    before runs ahead of every iteration without being timed (e.g. to make the request miss the cache).
+    stream reads only the first chunk of a streaming response and closes it, for streams that don't end on
+    their own; urlconf routes the request through another URLconf.
+    """
+
+    def __init__(self, name, method, path, user='customer', data=None, expected_status=200,
+                 max_queries=None, write=False, before=None, json=False, stream=False, urlconf=None):
+        self.name = name
+        self.method = method
+        self.path = path
+        self.user = user
+        self.data = data
+        self.expected_status = expected_status
+        self.max_queries = max_queries
+        self.write = write
+        self.before = before
+        self.json = json
+        self.stream = stream
+        self.urlconf = urlconf
+
+
+SCENARIOS = [
+    Scenario('register', 'post', '/api/register/', user=None, expected_status=201, max_queries=2, write=True,
+             data={'username': 'bench_new_user', 'email': 'bench_new@example.com', 'password': 'bench-new-pass'}),
+    Scenario('login', 'post', '/api/login/', user=None, max_queries=1, write=True,
+             data={'username': 'bench_customer', 'password': BENCHMARK_PASSWORD}),
+    Scenario('token_refresh', 'post', '/api/token/refresh/', data={'refresh': '{refresh}'}, max_queries=2, write=True),
+    Scenario('logout', 'post', '/api/logout/', max_queries=1, write=True),
+    Scenario('profile', 'get', '/api/users/me/', max_queries=0),
+    Scenario('profile_update', 'patch', '/api/users/me/', data={'first_name': 'Bench'}, max_queries=2, write=True),
+    Scenario('menu_list_cached', 'get', '/api/food-items/', max_queries=0),
+    Scenario('menu_list', 'get', '/api/food-items/?count=1', max_queries=2, before=bump_menu_version),
+    Scenario('menu_list_compact', 'get', '/api/food-items/?view=compact&count=1', max_queries=2,
+             before=bump_menu_version),
+    Scenario('menu_search', 'get', '/api/food-items/?search=spicy', max_queries=3, before=bump_menu_version),
+    Scenario('menu_filter', 'get', '/api/food-items/?category=italian&min_price=5&max_price=20&ordering=-price',
+             max_queries=2, before=bump_menu_version),
+    Scenario('menu_facets', 'get', '/api/food-items/facets/?category=italian&max_price=20', max_queries=1,
+             before=bump_menu_version),
+    Scenario('menu_detail', 'get', '/api/food-items/{food_item}/', max_queries=1, before=bump_menu_version),
+    Scenario('menu_create', 'post', '/api/food-items/', user='admin', expected_status=201, max_queries=1, write=True,
+             data={'name': 'Bench Special', 'price': '12.50', 'category': 'Specials'}),
+    Scenario('menu_update', 'patch', '/api/food-items/{food_item}/', user='admin', max_queries=2, write=True,
+             data={'price': '13.50'}),
+    Scenario('menu_delete', 'delete', '/api/food-items/{food_item}/', user='admin', expected_status=204,
+             max_queries=4, write=True),
+    Scenario('menu_import', 'post', '/api/food-items/import/', user='admin', max_queries=5, write=True, json=True,
+             data=[{'name': f'Bench Import {n}', 'price': '4.50', 'category': 'Specials'} for n in range(50)]
+             + [{'name': 'Bench Burger', 'price': '10.99', 'category': 'Fast Food'}]),
+    Scenario('orders_list', 'get', '/api/orders/', max_queries=4),
+    Scenario('orders_list_compact', 'get', '/api/orders/?view=compact', max_queries=2),
+    Scenario('orders_list_msgpack', 'get', '/api/orders/?format=msgpack', max_queries=4),
+    Scenario('orders_list_admin', 'get', '/api/orders/?count=1', user='admin', max_queries=4),
+    Scenario('order_detail', 'get', '/api/orders/{order}/', max_queries=3),
+    Scenario('order_create', 'post', '/api/orders/', expected_status=201, max_queries=10, write=True, json=True,
+             data={'items': ['{food_item}'], 'line_items': [{'food_item': '{food_item}', 'quantity': 2}]}),
+    Scenario('order_bulk', 'post', '/api/orders/bulk/', expected_status=201, max_queries=9, write=True, json=True,
+             data={'orders': [{'items': ['{food_item}']}] * 10}),
+    Scenario('order_delete', 'delete', '/api/orders/{order}/', expected_status=204, max_queries=9, write=True),
+    Scenario('order_events', 'get', '/api/orders/events/', max_queries=0, stream=True, urlconf=__name__),
+    Scenario('order_status_update', 'patch', '/api/orders/{order}/', user='admin', max_queries=11, write=True, json=True,
+             data={'status': 'completed'}),
+    Scenario('sales_daily', 'get', '/api/orders/analytics/daily/', user='admin', max_queries=1),
+    Scenario('sales_top_items', 'get', '/api/orders/analytics/top-items/?by=revenue', user='admin', max_queries=1),
+    Scenario('order_export', 'get', '/api/orders/export/?export_format=ndjson&status=pending&start={week_ago}',
+             user='admin', max_queries=2),
+    Scenario('recommendations', 'get', '/api/recommendations/', max_queries=0),
+    Scenario('recommendations_for_item', 'get', '/api/recommendations/?item={food_item}', max_queries=0),
+    Scenario('metrics', 'get', '/metrics', user='admin', max_queries=0),
+]
+
+
+class _Rollback(Exception):
+    pass
+
+
+def percentile(sorted_values, percent):
+    """ Nearest-rank percentile of an already sorted list """
+    rank = max(1, math.ceil(percent / 100 * len(sorted_values)))
+    return sorted_values[rank - 1]
+
+
+def _fill(value, context):
+    if isinstance(value, str):
+        filled = value.format(**context)
+        return int(filled) if value.startswith('{') and filled.isdigit() else filled
+    if isinstance(value, list):
+        return [_fill(item, context) for item in value]
+    if isinstance(value, dict):
+        return {key: _fill(item, context) for key, item in value.items()}
+    return value
+
+
+def prepare():
+    """ Create the benchmark accounts and log them in; returns (cookies per user, path context) """
+    customer = CustomUser.objects.create_user(
+        username='bench_customer', email='bench_customer@example.com', password=BENCHMARK_PASSWORD, is_customer=True,
+    )
+    CustomUser.objects.create_superuser(
+        username='bench_admin', email='bench_admin@example.com', password=BENCHMARK_PASSWORD,
+        is_admin=True, is_customer=False,
+    )
+    food_item = FoodItem.objects.create(name='Bench Burger', price='9.99', category='Fast Food')
+    order = Order.objects.create(customer=customer, total_price='19.98')
+    OrderItem.objects.create(order=order, food_item=food_item, quantity=2, unit_price=food_item.price)
+
+    cookies = {None: {}}
+    for role, username in (('customer', 'bench_customer'), ('admin', 'bench_admin')):
+        response = APIClient().post('/api/login/', {'username': username, 'password': BENCHMARK_PASSWORD})
+        cookies[role] = {name: morsel.value for name, morsel in response.cookies.items()}
+
+    context = {
+        'food_item': food_item.id,
+        'order': order.id,
+        'refresh': cookies['customer']['refresh_token'],
+        'week_ago': (timezone.now() - timedelta(days=7)).date().isoformat(),
+    }
+    return cookies, context
+
+
+def _request(client, scenario, cookies, context):
+    client.cookies.clear()
+    for name, value in cookies[scenario.user].items():
+        client.cookies[name] = value
+    data = _fill(scenario.data, context)
+    kwargs = {'format': 'json'} if scenario.json else {}
+    response = getattr(client, scenario.method)(_fill(scenario.path, context), data, **kwargs)
+    if response.streaming and scenario.stream:
+        _first_chunk(response.streaming_content)
+    elif response.streaming:
+        b''.join(response.streaming_content)
+    return response
+
+
+@async_to_sync
+async def _first_chunk(content):
+    """ Read an async streaming body's first chunk, then close it (which also ends the stream's generator) """
+    try:
+        async for chunk in content:
+            return chunk
+    finally:
+        await content.aclose()
+
+
+def measure(scenario, cookies, context, iterations=30, warmup=3):
+    """ Time one scenario; returns p50/p99 in milliseconds and the most queries any iteration issued """
+    client = APIClient()
+    timings, queries = [], 0
+    with override_settings(ROOT_URLCONF=scenario.urlconf) if scenario.urlconf else nullcontext():
+        for iteration in range(warmup + iterations):
+            # Keep the periodic revocation sync, and tokens revoked by rolled-back iterations, out of the timings
+            revocation_list.sync(rebuild=True)
+            if scenario.before is not None:
+                scenario.before()
+            try:
+                with transaction.atomic():
+                    with CaptureQueriesContext(connection) as captured:
+                        started = time.perf_counter()
+                        response = _request(client, scenario, cookies, context)
+                        elapsed = time.perf_counter() - started
+                    if scenario.write:
+                        raise _Rollback
+            except _Rollback:
+                pass
+            if response.status_code != scenario.expected_status:
+                raise AssertionError(
+                    f"{scenario.name}: expected HTTP {scenario.expected_status}, got {response.status_code}"
+                )
+            if iteration >= warmup:
+                timings.append(elapsed * 1000)
+                queries = max(queries, len(captured))
+
+    timings.sort()
+    return {
+        'p50_ms': round(percentile(timings, 50), 3),
+        'p99_ms': round(percentile(timings, 99), 3),
+        'queries': queries,
+        'max_queries': scenario.max_queries,
+    }
+
+
+def run_benchmarks(iterations=30, warmup=3, only=None):
+    """ Measure every scenario (or those named in only) against the current database """
+    cache.clear()
+    user_cache.clear()
+    recommendation_engine.reset()
+    # Rate limits still run (and are timed), but with buckets the repeated requests can't drain
+    rates = {scope: '1000000/s' for scope in api_settings.DEFAULT_THROTTLE_RATES}
+    with override_settings(REST_FRAMEWORK={**settings.REST_FRAMEWORK, 'DEFAULT_THROTTLE_RATES': rates}):
+        cookies, context = prepare()
+        return {
+            scenario.name: measure(scenario, cookies, context, iterations=iterations, warmup=warmup)
+            for scenario in SCENARIOS
+            if not only or scenario.name in only
+        }
+
+
+def budget_violations(results):
+    return [
+        f"{name}: {result['queries']} queries (budget {result['max_queries']})"
+        for name, result in results.items()
+        if result['max_queries'] is not None and result['queries'] > result['max_queries']
+    ]
+
+
+def regressions(results, baseline, threshold=0.25, min_delta_ms=1.0):
+    """
+    Scenarios slower than the baseline by more than threshold (a fraction) and min_delta_ms, or that now
+    issue more queries. The absolute slack keeps sub-millisecond noise from failing runs.
+    """
+    found = []
+    for name, result in results.items():
+        previous = baseline.get('results', {}).get(name)
+        if previous is None:
+            continue
+        for metric in ('p50_ms', 'p99_ms'):
+            limit = max(previous[metric] * (1 + threshold), previous[metric] + min_delta_ms)
+            if result[metric] > limit:
+                found.append(f"{name}: {metric} {result[metric]:.2f} > {limit:.2f} (baseline {previous[metric]:.2f})")
+        if result['queries'] > previous['queries']:
+            found.append(f"{name}: {result['queries']} queries (baseline {previous['queries']})")
+    return found
+
+
+def load_baseline(path):
+    with open(path) as baseline_file:
+        return json.load(baseline_file)
+
+
+def save_baseline(path, results, meta):
+    with open(path, 'w') as baseline_file:
+        json.dump({'meta': meta, 'results': results}, baseline_file, indent=2, sort_keys=True)
+        baseline_file.write('\n')
@@ -0,0 +1,49 @@
+"""
+Primary/replica routing.
+
+Writes always go to the primary ('default'). Reads go to the replica alias named by REPLICA_DATABASE only
+inside a replica_reads() block, which ReplicaRoutingMiddleware opens for safe (GET/HEAD/OPTIONS) requests.
+Everything else - unsafe requests, management commands, the outbox and image workers - reads from the
+primary, so locking reads and read-your-writes flows never see a lagging copy.
+"""
+import contextvars
+from contextlib import contextmanager
+
+from django.conf import settings
+from django.db import DEFAULT_DB_ALIAS
+
+_replica_reads = contextvars.ContextVar('replica_reads', default=False)
+
+
+def replica_alias():
+    return getattr(settings, 'REPLICA_DATABASE', None)
+
+
+@contextmanager
+def replica_reads(enabled=True):
+    """ Allow (or, with enabled=False, forbid) reads from the replica for the duration of the block """
+    token = _replica_reads.set(enabled)
+    try:
+        yield
+    finally:
+        _replica_reads.reset(token)
+
+
+def reading_from_replica():
+    return _replica_reads.get() and bool(replica_alias())
+
+
+class PrimaryReplicaRouter:
+    def db_for_read(self, model, **hints):
+        return replica_alias() if reading_from_replica() else DEFAULT_DB_ALIAS
+
+    def db_for_write(self, model, **hints):
+        return DEFAULT_DB_ALIAS
+
+    def allow_relation(self, obj1, obj2, **hints):
+        # Both aliases hold the same data
+        return True
+
+    def allow_migrate(self, db, app_label, model_name=None, **hints):
+        # The replica gets its schema through replication
+        return db != replica_alias()
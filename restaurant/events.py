@@ -0,0 +1,176 @@
+"""
+Order events (creation and status changes) for the server-sent events stream.
+
+Publishers call publish_order_event() inside their transaction; the event goes out once it commits. The
+broker fans events out to the coroutines streaming them. InMemoryBroker only reaches subscribers in the
+same process, which is enough for a single worker and for tests; PostgresNotifyBroker sends events through
+NOTIFY so every worker process (each LISTENing on one connection of its own) sees every event.
+"""
+import asyncio
+import json
+import logging
+import select
+import threading
+import time
+from decimal import Decimal
+
+from django.conf import settings
+from django.db import DEFAULT_DB_ALIAS, connections, transaction
+from django.utils import timezone
+
+logger = logging.getLogger(__name__)
+
+NOTIFY_CHANNEL = 'order_events'
+SUBSCRIBER_QUEUE_SIZE = 100
+RESYNC = {'type': 'resync'}  # Sent when a subscriber may have missed events; clients should refetch
+
+
+class Subscription:
+    def __init__(self, broker, loop, maxsize=SUBSCRIBER_QUEUE_SIZE):
+        self.broker = broker
+        self.loop = loop
+        self.queue = asyncio.Queue(maxsize=maxsize)
+        self.overflowed = False
+
+    def deliver(self, event):
+        """ Runs on the subscriber's event loop """
+        if self.overflowed:
+            return
+        try:
+            self.queue.put_nowait(event)
+        except asyncio.QueueFull:
+            # A client this far behind has lost track; tell it to refetch once it catches up
+            self.overflowed = True
+
+    async def get(self, timeout=None):
+        """ The next event, RESYNC after an overflow, or None if nothing arrives within timeout seconds """
+        if self.overflowed and self.queue.empty():
+            self.overflowed = False
+            return RESYNC
+        try:
+            return await asyncio.wait_for(self.queue.get(), timeout)
+        except asyncio.TimeoutError:
+            return None
+
+    def close(self):
+        self.broker.unsubscribe(self)
+
+
+class InMemoryBroker:
+    def __init__(self):
+        self._subscribers = set()
+        self._lock = threading.Lock()
+
+    def subscribe(self):
+        """ Call from a coroutine; events are delivered on its event loop """
+        subscription = Subscription(self, asyncio.get_running_loop())
+        with self._lock:
+            self._subscribers.add(subscription)
+        return subscription
+
+    def unsubscribe(self, subscription):
+        with self._lock:
+            self._subscribers.discard(subscription)
+
+    def dispatch(self, event):
+        """ Hand an event to every subscriber in this process; safe to call from any thread """
+        with self._lock:
+            subscribers = list(self._subscribers)
+        for subscription in subscribers:
+            try:
+                subscription.loop.call_soon_threadsafe(subscription.deliver, event)
+            except RuntimeError:  # Its event loop has shut down
+                self.unsubscribe(subscription)
+
+    def publish(self, event):
+        self.dispatch(event)
+
+
+class PostgresNotifyBroker(InMemoryBroker):
+    """ Publishes with pg_notify(); a background thread LISTENs and dispatches to this process's subscribers """
+
+    def __init__(self, using=DEFAULT_DB_ALIAS, channel=NOTIFY_CHANNEL):
+        super().__init__()
+        self.using = using
+        self.channel = channel
+        self._listener = None
+
+    def subscribe(self):
+        subscription = super().subscribe()
+        with self._lock:
+            if self._listener is None:
+                self._listener = threading.Thread(target=self._listen, name='order-events-listener', daemon=True)
+                self._listener.start()
+        return subscription
+
+    def publish(self, event):
+        with connections[self.using].cursor() as cursor:
+            cursor.execute('SELECT pg_notify(%s, %s)', [self.channel, json.dumps(event)])
+
+    def _listen(self):
+        import psycopg2
+        import psycopg2.extensions
+
+        backoff = 1
+        while True:
+            listener = None
+            try:
+                listener = psycopg2.connect(**connections[self.using].get_connection_params())
+                listener.set_isolation_level(psycopg2.extensions.ISOLATION_LEVEL_AUTOCOMMIT)
+                with listener.cursor() as cursor:
+                    cursor.execute(f'LISTEN {self.channel}')
+                # Anything published while we weren't listening is lost
+                self.dispatch(RESYNC)
+                backoff = 1
+                while True:
+                    if select.select([listener], [], [], 5) == ([], [], []):
+                        continue
+                    listener.poll()
+                    while listener.notifies:
+                        notification = listener.notifies.pop(0)
+                        self.dispatch(json.loads(notification.payload))
+            except Exception as e:
+                logger.warning("Order event listener lost its connection, retrying in %ss: %s", backoff, e)
+                if listener is not None:
+                    listener.close()
+                time.sleep(backoff)
+                backoff = min(backoff * 2, 60)
+
+
+_broker = None
+_broker_lock = threading.Lock()
+
+
+def get_broker():
+    """ The process-wide broker chosen by ORDER_EVENTS_BROKER ('memory' or 'postgres'; default: by database) """
+    global _broker
+    with _broker_lock:
+        if _broker is None:
+            kind = getattr(settings, 'ORDER_EVENTS_BROKER', None)
+            if kind is None:
+                kind = 'postgres' if connections[DEFAULT_DB_ALIAS].vendor == 'postgresql' else 'memory'
+            _broker = PostgresNotifyBroker() if kind == 'postgres' else InMemoryBroker()
+        return _broker
+
+
+def order_event(order, event_type):
+    return {
+        'type': event_type,
+        'order': order.id,
+        'customer': order.customer_id,
+        'status': order.status,
+        'total_price': str(Decimal(order.total_price).quantize(Decimal('0.01'))),
+        'at': timezone.now().isoformat(),
+    }
+
+
+def publish_order_event(order, event_type):
+    """ Publish order.created / order.status once the current transaction commits """
+    event = order_event(order, event_type)
+    # robust: the order is already committed, so a broker hiccup must not turn the request into an error
+    transaction.on_commit(lambda: get_broker().publish(event), robust=True)
+
+
+def event_visible_to(event, user):
+    """ Admins see every order's events, customers only their own (and resync notices) """
+    return 'order' not in event or user.is_admin or event['customer'] == user.id
@@ -0,0 +1,112 @@
+import csv
+import datetime
+import json
+
+from django.core.serializers.json import DjangoJSONEncoder
+from django.db.models import Prefetch
+from django.utils import timezone
+from django.utils.dateparse import parse_date, parse_datetime
+from rest_framework.negotiation import BaseContentNegotiation
+
+from .models import Order, OrderItem
+
+EXPORT_FORMATS = {
+    'csv': 'text/csv',
+    'ndjson': 'application/x-ndjson',
+}
+
+CSV_COLUMNS = [
+    'order_id', 'created_at', 'status', 'customer_id', 'customer_username', 'order_total',
+    'food_item_id', 'food_item_name', 'quantity', 'unit_price', 'line_total',
+]
+
+
+class ExportContentNegotiation(BaseContentNegotiation):
+    """ Exports pick their own content type, so never answer an Accept: text/csv client with 406 """
+
+    def select_parser(self, request, parsers):
+        return parsers[0] if parsers else None
+
+    def select_renderer(self, request, renderers, format_suffix=None):
+        return (renderers[0], renderers[0].media_type)
+
+
+def parse_bound(value, end=False):
+    """ Parse an ISO date or datetime; a bare date used as an end bound covers that whole day """
+    if not value:
+        return None
+    moment = parse_datetime(value)
+    if moment is None:
+        day = parse_date(value)
+        if day is None:
+            raise ValueError(f"Invalid date: {value!r}")
+        moment = datetime.datetime.combine(day + datetime.timedelta(days=1 if end else 0), datetime.time.min)
+    if timezone.is_naive(moment):
+        moment = timezone.make_aware(moment, datetime.timezone.utc)
+    return moment
+
+
+def export_queryset(start=None, end=None, status=None):
+    """ Orders in id order with their customer and line items, filtered by created_at range and status """
+    orders = Order.objects.select_related('customer').only(
+        'id', 'created_at', 'status', 'total_price', 'customer__id', 'customer__username'
+    ).prefetch_related(
+        Prefetch('order_items', queryset=OrderItem.objects.select_related('food_item').only(
+            'order_id', 'quantity', 'unit_price', 'food_item__id', 'food_item__name'
+        ).order_by('id'))
+    ).order_by('id')
+    if start is not None:
+        orders = orders.filter(created_at__gte=start)
+    if end is not None:
+        orders = orders.filter(created_at__lt=end)
+    if status:
+        orders = orders.filter(status=status)
+    return orders
+
+
+class _Echo:
+    """ File-like object whose write() hands the formatted line straight back """
+
+    def write(self, value):
+        return value
+
+
+def iter_csv(orders, chunk_size=2000):
+    """ Yield a CSV header and one line per order item, reading orders through a server-side cursor """
+    writer = csv.writer(_Echo())
+    yield writer.writerow(CSV_COLUMNS)
+    for order in orders.iterator(chunk_size=chunk_size):
+        head = [order.id, order.created_at.isoformat(), order.status, order.customer.id, order.customer.username, order.total_price]
+        lines = order.order_items.all()
+        if not lines:
+            yield writer.writerow(head + [''] * 5)
+        for line in lines:
+            yield writer.writerow(head + [line.food_item.id, line.food_item.name, line.quantity, line.unit_price, line.line_total])
+
+
+def iter_ndjson(orders, chunk_size=2000):
+    """ Yield one JSON document per order, reading orders through a server-side cursor """
+    for order in orders.iterator(chunk_size=chunk_size):
+        yield json.dumps({
+            'id': order.id,
+            'created_at': order.created_at,
+            'status': order.status,
+            'customer': {'id': order.customer.id, 'username': order.customer.username},
+            'total_price': order.total_price,
+            'items': [
+                {
+                    'food_item': line.food_item.id,
+                    'name': line.food_item.name,
+                    'quantity': line.quantity,
+                    'unit_price': line.unit_price,
+                    'line_total': line.line_total,
+                }
+                for line in order.order_items.all()
+            ],
+        }, cls=DjangoJSONEncoder) + '\n'
+
+
+def iter_export(export_format, orders, chunk_size=2000):
+    if export_format == 'ndjson':
+        return iter_ndjson(orders, chunk_size)
+    return iter_csv(orders, chunk_size)
@@ -0,0 +1,80 @@
+from decimal import Decimal
+
+from django.conf import settings
+from django.db.models import Case, Count, IntegerField, Max, Min, Q, Value, When
+
+from .models import FoodItem
+
+# Upper edges of the price histogram's buckets; the last bucket is open-ended
+MENU_PRICE_BUCKETS = getattr(settings, 'MENU_PRICE_BUCKETS', [5, 10, 15, 20, 30, 50])
+
+CENTS = Decimal('0.01')
+
+
+def _money(value):
+    return None if value is None else str(Decimal(value).quantize(CENTS))
+
+
+def price_bucket(edges):
+    """ Index of the histogram bucket an item's price falls into """
+    return Case(
+        *[When(price__lt=edge, then=Value(index)) for index, edge in enumerate(edges)],
+        default=Value(len(edges)),
+        output_field=IntegerField(),
+    )
+
+
+def menu_facets(queryset, category=None, min_price=None, max_price=None, edges=MENU_PRICE_BUCKETS):
+    """
+    Counts for category tabs, an availability toggle and a price slider, from one GROUP BY query.
+
+    Each facet ignores its own filter, as a facet UI expects: category counts apply the price range but not
+    the category, and the price histogram applies the category but not the price range. queryset should
+    already carry any search.
+    """
+    category = FoodItem.normalize_category(category) if category else None
+    price_filter = Q()
+    if min_price is not None:
+        price_filter &= Q(price__gte=min_price)
+    if max_price is not None:
+        price_filter &= Q(price__lte=max_price)
+
+    groups = queryset.order_by().annotate(bucket=price_bucket(edges)).values(
+        'category_normalized', 'availability', 'bucket'
+    ).annotate(
+        items=Count('id'),
+        in_price_range=Count('id', filter=price_filter) if price_filter else Count('id'),
+        label=Min('category'),
+        lowest=Min('price'),
+        highest=Max('price'),
+    )
+
+    categories, availability = {}, {'available': 0, 'unavailable': 0}
+    buckets = [0] * (len(edges) + 1)
+    lowest = highest = None
+    for group in groups:
+        key = group['category_normalized']
+        entry = categories.setdefault(key, {'category': group['label'], 'key': key, 'count': 0})
+        entry['category'] = min(entry['category'], group['label'])
+        entry['count'] += group['in_price_range']
+        if category is not None and key != category:
+            continue
+        availability['available' if group['availability'] else 'unavailable'] += group['in_price_range']
+        buckets[group['bucket']] += group['items']
+        lowest = group['lowest'] if lowest is None else min(lowest, group['lowest'])
+        highest = group['highest'] if highest is None else max(highest, group['highest'])
+
+    bounds = [0] + list(edges) + [None]
+    return {
+        'total': availability['available'] + availability['unavailable'],
+        'categories': sorted(categories.values(), key=lambda entry: (-entry['count'], entry['key'])),
+        'availability': availability,
+        'price': {
+            'min': _money(lowest),
+            'max': _money(highest),
+            'buckets': [
+                {'min': _money(bounds[index]), 'max': _money(bounds[index + 1]), 'count': count}
+                for index, count in enumerate(buckets)
+            ],
+        },
+    }
@@ -0,0 +1,100 @@
+"""
+Sparse fieldsets for read endpoints: ?fields=id,name,price renders only those fields, ?exclude=description
+drops some, and ?view=compact switches to the view's compact serializer. The columns the rendered fields
+don't need are left out of the SELECT (.only()), and prefetches for relations that aren't rendered are
+skipped, so a narrow request is cheaper to query as well as to serialize.
+"""
+from django.core.exceptions import FieldDoesNotExist
+from rest_framework.exceptions import ValidationError
+from rest_framework.permissions import SAFE_METHODS
+
+COMPACT_VIEW = 'compact'
+
+
+def _names(value):
+    return [name.strip() for name in (value or '').split(',') if name.strip()]
+
+
+def requested_fields(query_params, available):
+    """ The field names (in serializer order) chosen by ?fields= and ?exclude=, or None for all of them """
+    fields, exclude = _names(query_params.get('fields')), _names(query_params.get('exclude'))
+    if not fields and not exclude:
+        return None
+    unknown = [name for name in fields + exclude if name not in available]
+    if unknown:
+        raise ValidationError({"fields": f"Unknown field(s): {', '.join(unknown)}. Choose from: {', '.join(available)}."})
+    return [name for name in available if (not fields or name in fields) and name not in exclude]
+
+
+class SparseFieldsetSerializerMixin:
+    """ Lets a serializer be created with fields=[...] to render only those of its fields """
+
+    def __init__(self, *args, fields=None, **kwargs):
+        super().__init__(*args, **kwargs)
+        if fields is not None:
+            for name in set(self.fields) - set(fields):
+                self.fields.pop(name)
+
+
+def _model_field(model, source):
+    try:
+        return model._meta.get_field(source.split('.')[0])
+    except FieldDoesNotExist:
+        return None
+
+
+class SparseFieldsetMixin:
+    """
+    For ViewSets: applies ?fields=, ?exclude= and ?view=compact to list and retrieve.
+
+    Call load_rendered_fields() on the queryset to load only what the rendered fields read. Fields the view
+    needs whatever is rendered (e.g. for cursor pagination) go in always_loaded_fields.
+    """
+    compact_serializer_class = None
+    always_loaded_fields = ()
+    sparse_actions = ('list', 'retrieve')
+
+    def sparse_fieldset_applies(self):
+        return self.action in self.sparse_actions and self.request.method in SAFE_METHODS
+
+    def get_serializer_class(self):
+        if (self.compact_serializer_class is not None and self.sparse_fieldset_applies()
+                and self.request.query_params.get('view') == COMPACT_VIEW):
+            return self.compact_serializer_class
+        return super().get_serializer_class()
+
+    def rendered_fields(self):
+        """ Field names to render, or None for all """
+        if not self.sparse_fieldset_applies():
+            return None
+        if not hasattr(self, '_rendered_fields'):
+            available = list(self.get_serializer_class()(context=self.get_serializer_context()).fields)
+            self._rendered_fields = requested_fields(self.request.query_params, available)
+        return self._rendered_fields
+
+    def get_serializer(self, *args, **kwargs):
+        fields = self.rendered_fields()
+        if fields is not None:
+            kwargs.setdefault('fields', fields)
+        return super().get_serializer(*args, **kwargs)
+
+    def load_rendered_fields(self, queryset):
+        """ Narrow queryset to the columns and prefetches the rendered serializer fields use """
+        if not self.sparse_fieldset_applies():
+            return queryset
+        fields = self.get_serializer().fields
+        model = queryset.model
+        columns, relations = {model._meta.pk.name, *self.always_loaded_fields}, set()
+        for name, field in fields.items():
+            model_field = _model_field(model, name if field.source == '*' else field.source)
+            if model_field is None:
+                continue
+            if model_field.concrete and not model_field.many_to_many:
+                columns.add(model_field.name)
+            else:
+                relations.add(model_field.name if model_field.concrete else model_field.get_accessor_name())
+        prefetches = [
+            lookup for lookup in queryset._prefetch_related_lookups
+            if str(getattr(lookup, 'prefetch_through', lookup)).split('__')[0] in relations
+        ]
+        return queryset.prefetch_related(None).prefetch_related(*prefetches).only(*columns)
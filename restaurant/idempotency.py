@@ -0,0 +1,111 @@
+"""
+Idempotency-Key support for endpoints that create things (order placement).
+
+The key is claimed with an INSERT in the same transaction as the work it guards, and the response is stored
+on it before commit, so the two commit or roll back together. A concurrent duplicate waits on the unique
+index until the first request finishes, then replays its response; if the first request failed, the duplicate
+runs instead. Keys expire after IDEMPOTENCY_KEY_TTL seconds; `manage.py purge_idempotency_keys` deletes them.
+"""
+import hashlib
+import json
+from datetime import timedelta
+
+from django.conf import settings
+from django.db import IntegrityError, transaction
+from django.utils import timezone
+from rest_framework import status
+from rest_framework.exceptions import APIException, ValidationError
+from rest_framework.response import Response
+
+from .models import IdempotencyKey
+
+IDEMPOTENCY_HEADER = 'Idempotency-Key'
+IDEMPOTENCY_KEY_TTL = getattr(settings, 'IDEMPOTENCY_KEY_TTL', 24 * 60 * 60)
+MAX_KEY_LENGTH = 255
+
+
+class IdempotencyKeyReused(APIException):
+    status_code = status.HTTP_422_UNPROCESSABLE_ENTITY
+    default_detail = "This Idempotency-Key was already used with a different request."
+    default_code = 'idempotency_key_reused'
+
+
+class IdempotencyKeyBusy(APIException):
+    status_code = status.HTTP_409_CONFLICT
+    default_detail = "Another request with this Idempotency-Key is being processed; retry shortly."
+    default_code = 'idempotency_key_busy'
+
+
+def request_fingerprint(data):
+    """ Hash of the request body, to tell a retry from a different request reusing the key """
+    if hasattr(data, 'lists'):  # Form data
+        data = dict(data.lists())
+    payload = json.dumps(data, sort_keys=True, separators=(',', ':'), default=str)
+    return hashlib.sha256(payload.encode()).hexdigest()
+
+
+def _claim(user, scope, key, fingerprint, now):
+    """ (new key row, True), or (stored row, False) when the key was used before and hasn't expired """
+    for _ in range(3):
+        try:
+            with transaction.atomic():
+                record = IdempotencyKey.objects.create(
+                    user=user, scope=scope, key=key, request_fingerprint=fingerprint,
+                    expires_at=now + timedelta(seconds=IDEMPOTENCY_KEY_TTL),
+                )
+            return record, True
+        except IntegrityError:
+            pass
+        record = IdempotencyKey.objects.filter(user=user, scope=scope, key=key).first()
+        if record is not None and record.expires_at > now:
+            return record, False
+        # Expired but not purged yet: free the key and try again
+        IdempotencyKey.objects.filter(user=user, scope=scope, key=key, expires_at__lte=now).delete()
+    raise IdempotencyKeyBusy()
+
+
+def idempotent_response(request, scope, handler):
+    """
+    Run handler() (which returns a Response) at most once per Idempotency-Key, user and scope.
+
+    Repeats of a successful response are answered from the stored copy with an Idempotent-Replayed header.
+    Errors are not stored: DRF exceptions (validation errors, 403s, ...) roll the key back with the rest of
+    the transaction, and 5xx responses delete it, so the client can fix the request and retry with the same
+    key. Without the header, handler() simply runs.
+    """
+    key = request.headers.get(IDEMPOTENCY_HEADER)
+    if key is None:
+        return handler()
+    key = key.strip()
+    if not key or len(key) > MAX_KEY_LENGTH:
+        raise ValidationError({IDEMPOTENCY_HEADER: f"Send a key of 1 to {MAX_KEY_LENGTH} characters."})
+
+    fingerprint = request_fingerprint(request.data)
+    with transaction.atomic():
+        record, created = _claim(request.user, scope, key, fingerprint, timezone.now())
+        if not created:
+            if record.request_fingerprint != fingerprint:
+                raise IdempotencyKeyReused()
+            return Response(record.response_body, status=record.response_status, headers={'Idempotent-Replayed': 'true'})
+
+        # An exception raised by handler() rolls the key back with everything else, so the client can retry
+        response = handler()
+        if response.status_code >= 500:
+            record.delete()
+            return response
+        record.response_status = response.status_code
+        record.response_body = response.data
+        record.save(update_fields=['response_status', 'response_body'])
+    return response
+
+
+def purge_expired_keys(batch_size=1000, now=None):
+    """ Delete expired keys in batches, keeping each DELETE short; returns how many were removed """
+    now = now or timezone.now()
+    deleted = 0
+    while True:
+        ids = list(IdempotencyKey.objects.filter(expires_at__lte=now).values_list('id', flat=True)[:batch_size])
+        if ids:
+            deleted += IdempotencyKey.objects.filter(id__in=ids).delete()[0]
+        if len(ids) < batch_size:
+            return deleted
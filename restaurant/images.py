@@ -0,0 +1,149 @@
+import hashlib
+import io
+import logging
+import os
+import posixpath
+import re
+
+from django.conf import settings
+from django.core.files.base import ContentFile, File
+from django.core.files.storage import FileSystemStorage, default_storage
+from django.db.models import F, Q
+from django.views.static import serve
+from PIL import Image, ImageOps, UnidentifiedImageError
+
+logger = logging.getLogger(__name__)
+
+# Longest side in pixels for each generated size
+IMAGE_VARIANT_SIZES = getattr(settings, 'IMAGE_VARIANT_SIZES', {'thumb': 160, 'medium': 480, 'large': 1024})
+WEBP_QUALITY = 80
+JPEG_QUALITY = 85
+
+# Content-hashed originals and everything derived from them never change under the same name
+HASHED_PATH_RE = re.compile(r'(^|/)[0-9a-f]{64}(/|\.|$)')
+IMMUTABLE_MAX_AGE = 365 * 24 * 60 * 60
+
+
+class ContentHashedStorage(FileSystemStorage):
+    """ Stores each upload as <upload dir>/<sha256 of content><ext>; identical uploads share one file """
+
+    def save(self, name, content, max_length=None):
+        if not hasattr(content, 'chunks'):
+            content = File(content, name)
+        digest = hashlib.sha256()
+        for chunk in content.chunks():
+            digest.update(chunk)
+        content.seek(0)
+        directory, filename = posixpath.split(name.replace('\\', '/'))
+        name = posixpath.join(directory, digest.hexdigest() + os.path.splitext(filename)[1].lower())
+        if self.exists(name):
+            return name
+        return super().save(name, content, max_length=max_length)
+
+
+content_hashed_storage = ContentHashedStorage()
+
+
+def variant_path(source_name, label, extension, content):
+    """
+    Where a variant of source_name lives, e.g. food_images/variants/<source hash>/thumb.<content hash>.webp.
+
+    The name includes a hash of the variant's own bytes, so different sizes or encoder settings produce a
+    new path instead of rewriting one that has been served as immutable.
+    """
+    directory, filename = posixpath.split(source_name)
+    digest = hashlib.sha256(content.read()).hexdigest()[:16]
+    content.seek(0)
+    return posixpath.join(directory, 'variants', os.path.splitext(filename)[0], f'{label}.{digest}.{extension}')
+
+
+def _encode(image, image_format, **options):
+    buffer = io.BytesIO()
+    image.save(buffer, image_format, **options)
+    return ContentFile(buffer.getvalue())
+
+
+def _store(source_name, label, extension, content):
+    path = variant_path(source_name, label, extension, content)
+    if default_storage.exists(path):  # Same bytes already stored
+        return path
+    return default_storage.save(path, content)
+
+
+def generate_variants(field_file):
+    """ Write resized JPEG/PNG and WebP copies of an image; returns {label: {format: path}} """
+    with field_file.storage.open(field_file.name, 'rb') as source:
+        original = Image.open(source)
+        original.load()
+    original = ImageOps.exif_transpose(original)
+    has_alpha = original.mode in ('RGBA', 'LA') or (original.mode == 'P' and 'transparency' in original.info)
+    fallback_format, fallback_ext = ('PNG', 'png') if has_alpha else ('JPEG', 'jpg')
+
+    variants = {}
+    sizes = dict(IMAGE_VARIANT_SIZES, original=None)
+    for label, size in sizes.items():
+        image = original.copy()
+        if size:
+            image.thumbnail((size, size), Image.LANCZOS)
+        image = image.convert('RGBA' if has_alpha else 'RGB')
+        variant = {'width': image.width, 'height': image.height}
+        variant['webp'] = _store(field_file.name, label, 'webp', _encode(image, 'WEBP', quality=WEBP_QUALITY, method=4))
+        if size:  # The original is already there in its own format
+            options = {'optimize': True} if has_alpha else {'quality': JPEG_QUALITY, 'optimize': True, 'progressive': True}
+            variant[fallback_ext] = _store(field_file.name, label, fallback_ext, _encode(image, fallback_format, **options))
+        variants[label] = variant
+    return variants
+
+
+def pending_images(model, field_name, limit):
+    """ Rows whose image has no variants yet (or whose variants belong to a previous image) """
+    return model.objects.exclude(Q(**{field_name: ''}) | Q(**{f'{field_name}__isnull': True}))\
+                        .exclude(image_variants_source=F(field_name))\
+                        .order_by('pk')[:limit]
+
+
+def process_instance(instance, field_name):
+    field_file = getattr(instance, field_name)
+    try:
+        instance.image_variants = generate_variants(field_file)
+    except (OSError, UnidentifiedImageError, Image.DecompressionBombError) as e:
+        # Record the failure against this original so the worker doesn't retry it forever
+        logger.warning("Could not process %s for %s #%s: %s", field_file.name, instance._meta.label, instance.pk, e)
+        instance.image_variants = {}
+    instance.image_variants_source = field_file.name
+    # Saving fires the usual signals, which refresh the menu and user caches
+    instance.save(update_fields=['image_variants', 'image_variants_source'])
+
+
+def process_pending_images(batch_size=20):
+    """ Generate variants for one batch of new images; returns how many images were processed """
+    from .models import CustomUser, FoodItem
+
+    processed = 0
+    for model, field_name in ((FoodItem, 'image'), (CustomUser, 'profile_image')):
+        for instance in pending_images(model, field_name, batch_size):
+            process_instance(instance, field_name)
+            processed += 1
+    return processed
+
+
+def variant_urls(variants, request=None):
+    """ Public URLs for a stored variants mapping """
+    urls = {}
+    for label, variant in (variants or {}).items():
+        urls[label] = {key: value for key, value in variant.items() if key in ('width', 'height')}
+        for key, path in variant.items():
+            if key not in ('width', 'height'):
+                url = default_storage.url(path)
+                urls[label][key] = request.build_absolute_uri(url) if request is not None else url
+    return urls
+
+
+def serve_media(request, path):
+    """ Serve MEDIA_ROOT, marking content-hashed files as immutable for a year """
+    response = serve(request, path, document_root=settings.MEDIA_ROOT)
+    if HASHED_PATH_RE.search(path):
+        response['Cache-Control'] = f'public, max-age={IMMUTABLE_MAX_AGE}, immutable'
+    else:
+        response['Cache-Control'] = 'public, max-age=300'
+    return response
@@ -0,0 +1,50 @@
+import datetime
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+from django.utils import timezone
+from django.utils.dateparse import parse_date
+
+from restaurant.analytics import rebuild_rollups
+from restaurant.models import Order
+
+
+class Command(BaseCommand):
+    help = ("Rebuild the daily sales rollups from the order history, a few days per transaction; order writes "
+            "wait for each chunk, so keep --chunk-days small on a busy database")
+
+    def add_arguments(self, parser):
+        parser.add_argument('--start', help="First day to rebuild, ISO date (default: the day of the first order)")
+        parser.add_argument('--end', help="Last day to rebuild, ISO date (default: today)")
+        parser.add_argument('--chunk-days', type=int, default=7, help="Days rebuilt per transaction")
+        parser.add_argument('--pause', type=float, default=0.0, help="Seconds to sleep between chunks, to go easy on the database")
+
+    def parse_day(self, value):
+        day = parse_date(value)
+        if day is None:
+            raise CommandError(f"Invalid date: {value!r}")
+        return day
+
+    def handle(self, *args, **options):
+        end = self.parse_day(options['end']) if options['end'] else timezone.localdate()
+        if options['start']:
+            start = self.parse_day(options['start'])
+        else:
+            first = Order.objects.order_by('created_at').values_list('created_at', flat=True).first()
+            if first is None:
+                self.stdout.write("No orders to roll up")
+                return
+            start = timezone.localdate(first)
+        if options['chunk_days'] < 1:
+            raise CommandError("--chunk-days must be at least 1")
+
+        total = 0
+        while start <= end:
+            chunk_end = min(end, start + datetime.timedelta(days=options['chunk_days'] - 1))
+            counted = rebuild_rollups(start, chunk_end)
+            total += counted
+            self.stdout.write(f"{start}..{chunk_end}: {counted} orders")
+            start = chunk_end + datetime.timedelta(days=1)
+            if options['pause'] and start <= end:
+                time.sleep(options['pause'])
+        self.stdout.write(f"Rolled up {total} orders")
@@ -0,0 +1,60 @@
+import os
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.test.utils import setup_databases, setup_test_environment, teardown_databases, teardown_test_environment
+
+from restaurant.benchmarks import budget_violations, load_baseline, regressions, run_benchmarks, save_baseline
+from restaurant.seeding import seed
+
+
+class Command(BaseCommand):
+    help = (
+        "Seed a throwaway test database, time every API endpoint and compare p50/p99 latency and query "
+        "counts with a JSON baseline; exits non-zero on a query budget overrun or a regression"
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--iterations', type=int, default=30, help="Timed requests per endpoint")
+        parser.add_argument('--warmup', type=int, default=3, help="Untimed requests per endpoint first")
+        parser.add_argument('--users', type=int, default=200, help="Customers to seed")
+        parser.add_argument('--food-items', type=int, default=100, help="Menu items to seed")
+        parser.add_argument('--orders', type=int, default=5000, help="Orders to seed")
+        parser.add_argument('--seed', type=int, default=0, help="Random seed for the data")
+        parser.add_argument('--only', nargs='+', help="Only run these scenarios")
+        parser.add_argument('--baseline', default=os.path.join(settings.BASE_DIR, 'benchmark_baseline.json'),
+                            help="Baseline JSON file (written on the first run)")
+        parser.add_argument('--save-baseline', action='store_true', help="Record this run as the new baseline")
+        parser.add_argument('--threshold', type=float, default=0.25,
+                            help="Allowed slowdown over the baseline as a fraction (0.25 = 25%%)")
+        parser.add_argument('--min-delta-ms', type=float, default=1.0,
+                            help="Ignore slowdowns smaller than this many milliseconds")
+
+    def handle(self, *args, **options):
+        volumes = {'users': options['users'], 'food_items': options['food_items'], 'orders': options['orders']}
+        setup_test_environment()
+        old_config = setup_databases(verbosity=0, interactive=False)
+        try:
+            seed(random_seed=options['seed'], **volumes)
+            results = run_benchmarks(iterations=options['iterations'], warmup=options['warmup'], only=options['only'])
+        finally:
+            teardown_databases(old_config, verbosity=0)
+            teardown_test_environment()
+
+        self.stdout.write(f"{'scenario':<28}{'p50 ms':>10}{'p99 ms':>10}{'queries':>10}")
+        for name, result in results.items():
+            self.stdout.write(f"{name:<28}{result['p50_ms']:>10.2f}{result['p99_ms']:>10.2f}{result['queries']:>10}")
+
+        failures = budget_violations(results)
+        baseline_path = options['baseline']
+        if options['save_baseline'] or not os.path.exists(baseline_path):
+            meta = dict(volumes, seed=options['seed'], iterations=options['iterations'])
+            save_baseline(baseline_path, results, meta)
+            self.stdout.write(f"Baseline written to {baseline_path}")
+        else:
+            failures += regressions(results, load_baseline(baseline_path),
+                                    threshold=options['threshold'], min_delta_ms=options['min_delta_ms'])
+
+        if failures:
+            raise CommandError("Benchmark failed:\n  " + "\n  ".join(failures))
+        self.stdout.write(self.style.SUCCESS("No query budget overruns or regressions"))
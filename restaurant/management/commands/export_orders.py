@@ -0,0 +1,31 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from restaurant.exports import EXPORT_FORMATS, export_queryset, iter_export, parse_bound
+
+
+class Command(BaseCommand):
+    help = "Stream orders with their items to CSV or NDJSON using a server-side cursor"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--format', choices=list(EXPORT_FORMATS), default='csv', dest='export_format')
+        parser.add_argument('--start', help="Only orders created on or after this ISO date/datetime")
+        parser.add_argument('--end', help="Only orders created before this ISO datetime (or on/before this date)")
+        parser.add_argument('--status', help="Only orders with this status")
+        parser.add_argument('--output', help="File to write to (default: stdout)")
+        parser.add_argument('--chunk-size', type=int, default=2000, help="Orders fetched per round trip")
+
+    def handle(self, *args, **options):
+        try:
+            start = parse_bound(options['start'])
+            end = parse_bound(options['end'], end=True)
+        except ValueError as e:
+            raise CommandError(str(e))
+
+        orders = export_queryset(start=start, end=end, status=options['status'])
+        rows = iter_export(options['export_format'], orders, options['chunk_size'])
+        if options['output']:
+            with open(options['output'], 'w', newline='') as output:
+                output.writelines(rows)
+        else:
+            for row in rows:
+                self.stdout.write(row, ending='')
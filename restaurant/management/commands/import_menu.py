@@ -0,0 +1,40 @@
+import json
+
+from django.core.management.base import BaseCommand, CommandError
+from django.core.serializers.json import DjangoJSONEncoder
+
+from restaurant.menu_import import IMPORT_FORMATS, MenuImportError, detect_format, import_menu, parse_menu
+
+
+class Command(BaseCommand):
+    help = "Create or update menu items (matched by name) from a CSV or JSON file in one transaction"
+
+    def add_arguments(self, parser):
+        parser.add_argument('path', help="CSV with a name,description,price,category,availability header, or JSON")
+        parser.add_argument('--format', choices=IMPORT_FORMATS, dest='import_format',
+                            help="Default: from the file extension")
+        parser.add_argument('--dry-run', action='store_true', help="Report what would change without writing")
+        parser.add_argument('--deactivate-missing', action='store_true',
+                            help="Mark available items that aren't in the file as unavailable")
+        parser.add_argument('--batch-size', type=int, default=500, help="Rows per bulk INSERT/UPDATE")
+
+    def handle(self, *args, **options):
+        import_format = options['import_format'] or detect_format(options['path'])
+        try:
+            with open(options['path'], 'rb') as menu_file:
+                rows = parse_menu(menu_file.read(), import_format)
+        except (OSError, MenuImportError) as e:
+            raise CommandError(str(e))
+
+        report = import_menu(
+            rows, dry_run=options['dry_run'], batch_size=options['batch_size'],
+            deactivate_missing=options['deactivate_missing'],
+        )
+        self.stdout.write(json.dumps(report, cls=DjangoJSONEncoder, indent=2))
+        if report['errors']:
+            raise CommandError(f"{len(report['errors'])} invalid rows; nothing was imported")
+        self.stdout.write(
+            f"{'Would create' if options['dry_run'] else 'Created'} {len(report['created'])}, "
+            f"updated {len(report['updated'])}, deactivated {len(report['deactivated'])}, "
+            f"unchanged {report['unchanged']}"
+        )
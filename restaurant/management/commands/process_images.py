@@ -0,0 +1,24 @@
+import time
+
+from django.core.management.base import BaseCommand
+
+from restaurant.images import process_pending_images
+
+
+class Command(BaseCommand):
+    help = "Generate resized and WebP variants for newly uploaded food and profile images"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=20, help="Images per model handled in one pass")
+        parser.add_argument('--loop', action='store_true', help="Keep polling instead of exiting when nothing is pending")
+        parser.add_argument('--interval', type=float, default=5.0, help="Seconds to sleep between polls in --loop mode")
+
+    def handle(self, *args, **options):
+        while True:
+            processed = process_pending_images(options['batch_size'])
+            if processed:
+                self.stdout.write(f"Processed {processed} image(s)")
+                continue  # Drain the backlog before sleeping
+            if not options['loop']:
+                break
+            time.sleep(options['interval'])
@@ -0,0 +1,23 @@
+import time
+
+from django.core.management.base import BaseCommand
+
+from restaurant.idempotency import purge_expired_keys
+
+
+class Command(BaseCommand):
+    help = "Delete expired idempotency keys"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=1000, help="Keys deleted per statement")
+        parser.add_argument('--loop', action='store_true', help="Keep sweeping instead of exiting after one pass")
+        parser.add_argument('--interval', type=float, default=600.0, help="Seconds to sleep between sweeps in --loop mode")
+
+    def handle(self, *args, **options):
+        while True:
+            deleted = purge_expired_keys(options['batch_size'])
+            if deleted:
+                self.stdout.write(f"Deleted {deleted} expired idempotency key(s)")
+            if not options['loop']:
+                break
+            time.sleep(options['interval'])
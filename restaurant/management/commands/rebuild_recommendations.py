@@ -0,0 +1,26 @@
+import time
+
+from django.core.management.base import BaseCommand
+
+from restaurant.recommendations import recommendation_engine, request_rebuild
+
+
+class Command(BaseCommand):
+    help = ("Rebuild the recommendation counts from the full order history in every running process "
+            "(processes are reached through the shared cache, so this needs REDIS_URL)")
+
+    def add_arguments(self, parser):
+        parser.add_argument('--loop', action='store_true', help="Keep rebuilding instead of exiting after one pass")
+        parser.add_argument('--interval', type=float, default=24 * 60 * 60, help="Seconds to sleep between rebuilds in --loop mode")
+
+    def handle(self, *args, **options):
+        while True:
+            request_rebuild()
+            recommendation_engine.sync(force=True)  # Also rebuilds here, to report what the servers will load
+            self.stdout.write(
+                f"Rebuilt from orders up to #{recommendation_engine.last_order_id}: "
+                f"{len(recommendation_engine.popularity)} items, {len(recommendation_engine.user_items)} customers"
+            )
+            if not options['loop']:
+                break
+            time.sleep(options['interval'])
@@ -0,0 +1,27 @@
+from django.core.management.base import BaseCommand
+
+from restaurant.seeding import seed
+
+
+class Command(BaseCommand):
+    help = "Bulk-insert synthetic customers, food items and orders for load testing and benchmarks"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--users', type=int, default=100, help="Customers to create")
+        parser.add_argument('--food-items', type=int, default=50, help="Menu items to create")
+        parser.add_argument('--orders', type=int, default=1000, help="Orders to create")
+        parser.add_argument('--max-lines', type=int, default=4, help="Most distinct items per order")
+        parser.add_argument('--days', type=int, default=90, help="Spread order dates over this many past days")
+        parser.add_argument('--batch-size', type=int, default=1000, help="Rows per INSERT")
+        parser.add_argument('--seed', type=int, default=0, help="Random seed; the same seed gives the same data")
+
+    def handle(self, *args, **options):
+        created = seed(
+            users=options['users'], food_items=options['food_items'], orders=options['orders'],
+            max_lines=options['max_lines'], days=options['days'], batch_size=options['batch_size'],
+            random_seed=options['seed'], stdout=self.stdout if options['verbosity'] > 1 else None,
+        )
+        self.stdout.write(
+            f"Created {created['users']} customers, {created['food_items']} food items, "
+            f"{created['orders']} orders with {created['order_items']} order items"
+        )
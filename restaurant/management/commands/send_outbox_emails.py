@@ -0,0 +1,24 @@
+import time
+
+from django.core.management.base import BaseCommand
+
+from restaurant.outbox import deliver_batch
+
+
+class Command(BaseCommand):
+    help = "Deliver queued outbox emails, reusing one mail connection per batch"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=50, help="Messages sent per connection")
+        parser.add_argument('--loop', action='store_true', help="Keep polling instead of exiting when the outbox is empty")
+        parser.add_argument('--interval', type=float, default=5.0, help="Seconds to sleep between polls in --loop mode")
+
+    def handle(self, *args, **options):
+        while True:
+            sent, failed = deliver_batch(options['batch_size'])
+            if sent or failed:
+                self.stdout.write(f"Sent {sent} email(s), {failed} failed")
+                continue  # Drain the backlog before sleeping
+            if not options['loop']:
+                break
+            time.sleep(options['interval'])
@@ -0,0 +1,124 @@
+import hashlib
+import time
+
+from django.conf import settings
+from django.core.cache import cache
+from django.utils.cache import patch_cache_control, patch_vary_headers
+from django.utils.http import parse_etags
+from rest_framework import status
+from rest_framework.response import Response
+
+from .db_router import replica_reads
+
+MENU_VERSION_KEY = 'menu:version'
+MENU_CACHE_TIMEOUT = getattr(settings, 'MENU_CACHE_TIMEOUT', 300)
+
+# Query parameters that change what a menu response contains; everything else is ignored
+MENU_QUERY_PARAMS = (
+    'category', 'min_price', 'max_price', 'search', 'ordering', 'cursor', 'page_size', 'count',
+    'fields', 'exclude', 'view',
+)
+
+
+def get_menu_version():
+    """ Current menu version; any change to a FoodItem moves it forward """
+    version = cache.get(MENU_VERSION_KEY)
+    if version is None:
+        # Seed from the clock so a lost counter can never come back as a version that was already used
+        cache.add(MENU_VERSION_KEY, time.time_ns() // 1000, None)
+        version = cache.get(MENU_VERSION_KEY)
+    return version
+
+
+async def aget_menu_version():
+    """ Async counterpart of get_menu_version() """
+    version = await cache.aget(MENU_VERSION_KEY)
+    if version is None:
+        await cache.aadd(MENU_VERSION_KEY, time.time_ns() // 1000, None)
+        version = await cache.aget(MENU_VERSION_KEY)
+    return version
+
+
+def bump_menu_version():
+    """ Invalidate every cached menu response at once """
+    try:
+        cache.incr(MENU_VERSION_KEY)
+    except ValueError:
+        cache.set(MENU_VERSION_KEY, time.time_ns() // 1000, None)
+
+
+def normalize_menu_params(query_params):
+    """ Sorted (name, value) pairs of the parameters that affect the menu, with case-insensitive ones lowered """
+    normalized = []
+    for name in MENU_QUERY_PARAMS:
+        value = query_params.get(name, '').strip()
+        if not value:
+            continue
+        if name in ('category', 'search'):
+            value = ' '.join(value.lower().split())
+        normalized.append((name, value))
+    return normalized
+
+
+def menu_cache_key(request, version=None):
+    """ Return (cache_key, etag) for a menu request at the given (or current) menu version """
+    if version is None:
+        version = get_menu_version()
+    renderer = getattr(request, 'accepted_renderer', None)
+    parts = [
+        str(version),
+        request.build_absolute_uri(request.path),
+        getattr(renderer, 'format', ''),
+        '&'.join(f'{name}={value}' for name, value in normalize_menu_params(request.query_params)),
+    ]
+    digest = hashlib.sha1('|'.join(parts).encode()).hexdigest()
+    return f'menu:response:{digest}', f'"{digest}"'
+
+
+def is_not_modified(request, etag):
+    return etag in parse_etags(request.headers.get('If-None-Match', ''))
+
+
+def cached_menu_response(request, build_response):
+    """ Serve a menu read from the cache, answering If-None-Match with 304 before any database work """
+    key, etag = menu_cache_key(request)
+
+    if is_not_modified(request, etag):
+        response = Response(status=status.HTTP_304_NOT_MODIFIED)
+    else:
+        data = cache.get(key)
+        if data is None:
+            # Cached under the current version for everyone, so read the rows that version was bumped for:
+            # a lagging replica would store the old menu under the new version (and ETag)
+            with replica_reads(False):
+                response = build_response()
+            if response.status_code != status.HTTP_200_OK:
+                return response
+            cache.set(key, response.data, MENU_CACHE_TIMEOUT)
+        else:
+            response = Response(data)
+
+    response['ETag'] = etag
+    patch_vary_headers(response, ['Accept'])  # JSON and MessagePack bodies have different ETags
+    patch_cache_control(response, private=True, no_cache=True)
+    return response
+
+
+async def acached_menu_data(request, build_data):
+    """
+    Async counterpart of cached_menu_response(); returns (etag, data).
+
+    data is None when the client's copy is current (send a 304). build_data is awaited on a cache miss and
+    may return None for "not found", which is not cached.
+    """
+    key, etag = menu_cache_key(request, version=await aget_menu_version())
+    if is_not_modified(request, etag):
+        return etag, None
+
+    data = await cache.aget(key)
+    if data is None:
+        with replica_reads(False):  # See cached_menu_response()
+            data = await build_data()
+        if data is not None:
+            await cache.aset(key, data, MENU_CACHE_TIMEOUT)
+    return etag, data
@@ -0,0 +1,140 @@
+import csv
+import io
+import json
+
+from django.db import transaction
+
+from .menu_cache import bump_menu_version
+from .models import FoodItem
+from .serializers import MenuImportRowSerializer
+
+IMPORT_FORMATS = ('csv', 'json')
+IMPORT_FIELDS = ['name', 'description', 'price', 'category', 'availability']
+
+
+class MenuImportError(ValueError):
+    pass
+
+
+def detect_format(filename, content_type=None):
+    """ 'csv' or 'json' from a file name or content type, or None when neither says """
+    if filename and filename.lower().endswith(('.csv', '.json')):
+        return filename.lower().rsplit('.', 1)[1]
+    if content_type:
+        if 'csv' in content_type:
+            return 'csv'
+        if 'json' in content_type:
+            return 'json'
+    return None
+
+
+def menu_rows(payload):
+    """ The rows of already-decoded JSON: a list of items or {"items": [...]} """
+    rows = payload.get('items') if isinstance(payload, dict) else payload
+    if not isinstance(rows, list) or not all(isinstance(row, dict) for row in rows):
+        raise MenuImportError('Send a list of items or {"items": [...]}.')
+    return rows
+
+
+def parse_menu(data, import_format):
+    """ Rows (dicts) from CSV with a header line, or JSON as a list of items or {"items": [...]} """
+    if isinstance(data, bytes):
+        data = data.decode('utf-8-sig')
+    if import_format == 'csv':
+        reader = csv.DictReader(io.StringIO(data))
+        if not reader.fieldnames or 'name' not in reader.fieldnames:
+            raise MenuImportError("The CSV needs a header row with at least name, price and category.")
+        # Empty cells in optional columns mean "leave as is"
+        return [
+            {key: value for key, value in row.items() if key in IMPORT_FIELDS and (value != '' or key == 'name')}
+            for row in reader
+        ]
+    if import_format == 'json':
+        try:
+            payload = json.loads(data)
+        except ValueError as e:
+            raise MenuImportError(f"Invalid JSON: {e}")
+        return menu_rows(payload)
+    raise MenuImportError(f"Choose one of: {', '.join(IMPORT_FORMATS)}.")
+
+
+def _existing_by_name(names, batch_size):
+    existing, duplicates = {}, set()
+    names = list(names)
+    for offset in range(0, len(names), batch_size):
+        for item in FoodItem.objects.filter(name__in=names[offset:offset + batch_size]).order_by('id'):
+            if item.name in existing:
+                duplicates.add(item.name)
+            existing.setdefault(item.name, item)
+    return existing, duplicates
+
+
+def import_menu(rows, dry_run=False, batch_size=500, deactivate_missing=False):
+    """
+    Upsert menu items by name with batched bulk_create/bulk_update in one transaction.
+
+    Nothing is written when any row is invalid or with dry_run. With deactivate_missing, available items
+    that aren't in the import are marked unavailable (a new season's menu replaces the old one).
+    Returns the diff: {'created': [...], 'updated': [...], 'deactivated': [...], 'unchanged': n, 'errors': [...]}.
+    """
+    report = {'created': [], 'updated': [], 'deactivated': [], 'unchanged': 0, 'errors': []}
+    valid, seen = [], set()
+    for index, row in enumerate(rows):
+        serializer = MenuImportRowSerializer(data=row)
+        if not serializer.is_valid():
+            report['errors'].append({'row': index + 1, 'errors': serializer.errors})
+            continue
+        data = serializer.validated_data
+        if data['name'] in seen:
+            report['errors'].append({'row': index + 1, 'errors': {'name': [f"{data['name']!r} appears more than once."]}})
+            continue
+        seen.add(data['name'])
+        valid.append(data)
+
+    with transaction.atomic():
+        existing, duplicates = _existing_by_name(seen, batch_size)
+        for name in sorted(duplicates):
+            report['errors'].append({'row': None, 'errors': {'name': [f"Several menu items are named {name!r}."]}})
+        if report['errors']:
+            return report
+
+        to_create, to_update = [], []
+        for data in valid:
+            item = existing.get(data['name'])
+            if item is None:
+                item = FoodItem(**{'availability': True, **data})
+                # bulk_create skips save(), which normally fills this in
+                item.category_normalized = FoodItem.normalize_category(item.category)
+                to_create.append(item)
+                report['created'].append(item.name)
+                continue
+            changes = {}
+            for field, value in data.items():
+                if getattr(item, field) != value:
+                    changes[field] = [getattr(item, field), value]
+                    setattr(item, field, value)
+            if changes:
+                item.category_normalized = FoodItem.normalize_category(item.category)
+                to_update.append(item)
+                report['updated'].append({'name': item.name, 'changes': changes})
+            else:
+                report['unchanged'] += 1
+
+        to_deactivate = []
+        if deactivate_missing:
+            to_deactivate = list(FoodItem.objects.filter(availability=True).exclude(name__in=seen).only('id', 'name'))
+            report['deactivated'] = [item.name for item in to_deactivate]
+
+        if dry_run:
+            return report
+
+        FoodItem.objects.bulk_create(to_create, batch_size=batch_size)
+        FoodItem.objects.bulk_update(
+            to_update, ['description', 'price', 'category', 'category_normalized', 'availability'],
+            batch_size=batch_size,
+        )
+        FoodItem.objects.filter(id__in=[item.id for item in to_deactivate]).update(availability=False)
+        if to_create or to_update or to_deactivate:
+            # bulk writes send no signals; drop every cached menu page once the import is visible
+            transaction.on_commit(bump_menu_version)
+    return report
@@ -0,0 +1,318 @@
+"""
+Per-view request metrics in Prometheus text format.
+
+MetricsMiddleware (see middleware.py) records latency, response size, SQL query count/time and errors for
+every request under the resolved view name. SQL is measured by an execute wrapper that every database
+connection gets when it opens, so nothing depends on DEBUG's query log.
+
+Each process keeps its own counts. With METRICS_DIR set, a background thread in each process also writes
+them to <METRICS_DIR>/worker-<uuid>.json every few seconds (off the request path, so async views never wait
+on file I/O), and /metrics adds up all the files, so any worker can answer for all of them. Files are keyed
+on a per-process id rather than the pid, so a reused pid never overwrites another process's counts.
+
+When a worker exits, fold_process_metrics() (called from gunicorn's child_exit hook) adds its file to
+totals.json and removes it, so recycled workers don't pile up files and counters never go backwards.
+Clear the directory when the server starts (gunicorn.conf.py does).
+"""
+import atexit
+import contextvars
+import hmac
+import json
+import logging
+import os
+import tempfile
+import threading
+import time
+import uuid
+
+from django.conf import settings
+from rest_framework.permissions import BasePermission
+
+logger = logging.getLogger(__name__)
+
+PROMETHEUS_CONTENT_TYPE = 'text/plain; version=0.0.4; charset=utf-8'
+
+DURATION_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+SIZE_BUCKETS = (256, 1024, 4096, 16384, 65536, 262144, 1048576)
+QUERY_COUNT_BUCKETS = (0, 1, 2, 5, 10, 20, 50, 100)
+
+# name: (type, help, labels, buckets)
+METRICS = {
+    'restaurant_http_requests_total': (
+        'counter', "Requests by view, method and status code", ('view', 'method', 'status'), None),
+    'restaurant_http_request_errors_total': (
+        'counter', "Requests that ended in a 5xx response", ('view', 'method'), None),
+    'restaurant_http_request_duration_seconds': (
+        'histogram', "Time spent handling the request", ('view', 'method'), DURATION_BUCKETS),
+    'restaurant_http_response_size_bytes': (
+        'histogram', "Response body size (streaming responses excluded)", ('view', 'method'), SIZE_BUCKETS),
+    'restaurant_http_request_db_queries': (
+        'histogram', "SQL queries issued per request", ('view', 'method'), QUERY_COUNT_BUCKETS),
+    'restaurant_db_query_duration_seconds_total': (
+        'counter', "Time spent in SQL queries", ('view', 'method'), None),
+}
+
+
+class QueryStats:
+    __slots__ = ('count', 'duration')
+
+    def __init__(self):
+        self.count = 0
+        self.duration = 0.0
+
+
+_query_stats = contextvars.ContextVar('query_stats', default=None)
+
+
+def track_queries():
+    """ Start counting this request's queries; returns (stats, token for stop_tracking_queries) """
+    stats = QueryStats()
+    return stats, _query_stats.set(stats)
+
+
+def stop_tracking_queries(token):
+    _query_stats.reset(token)
+
+
+def query_timer(execute, sql, params, many, context):
+    """ Execute wrapper installed on every connection; a no-op outside tracked requests """
+    stats = _query_stats.get()
+    if stats is None:
+        return execute(sql, params, many, context)
+    started = time.perf_counter()
+    try:
+        return execute(sql, params, many, context)
+    finally:
+        stats.count += 1
+        stats.duration += time.perf_counter() - started
+
+
+def install_query_timer(connection, **kwargs):
+    """ connection_created receiver """
+    if query_timer not in connection.execute_wrappers:
+        connection.execute_wrappers.append(query_timer)
+
+
+TOTALS_FILENAME = 'totals.json'
+PROCESS_FILE_PREFIX = 'worker-'
+
+
+def _read_json(path):
+    try:
+        with open(path) as json_file:
+            return json.load(json_file)
+    except (OSError, ValueError):
+        return None  # Being replaced right now, removed, or written by a process that died mid-write
+
+
+def _write_json(directory, filename, data):
+    """ Replace directory/filename atomically, so readers see the old or the new contents, never half """
+    fd, temp_path = tempfile.mkstemp(dir=directory, suffix='.tmp')
+    with os.fdopen(fd, 'w') as temp_file:
+        json.dump(data, temp_file)
+    os.replace(temp_path, os.path.join(directory, filename))
+
+
+def merge_snapshots(snapshots):
+    """ Add up snapshots ({name: [[labels, value], ...]}) into {name: {labels tuple: value}} """
+    merged = {name: {} for name in METRICS}
+    for snapshot in snapshots:
+        for name, entries in snapshot.items():
+            if name not in merged:
+                continue
+            for labels, value in entries:
+                labels = tuple(labels)
+                current = merged[name].get(labels)
+                if current is None:
+                    merged[name][labels] = dict(value, buckets=list(value['buckets'])) if isinstance(value, dict) else value
+                elif isinstance(value, dict):
+                    current['buckets'] = [a + b for a, b in zip(current['buckets'], value['buckets'])]
+                    current['sum'] += value['sum']
+                    current['count'] += value['count']
+                else:
+                    merged[name][labels] = current + value
+    return merged
+
+
+def _as_snapshot(merged):
+    return {name: [[list(labels), value] for labels, value in values.items()] for name, values in merged.items()}
+
+
+def read_totals(directory):
+    """ The counts folded in from exited processes, and the ids of the process files they include """
+    totals = _read_json(os.path.join(directory, TOTALS_FILENAME)) or {}
+    return totals.get('metrics', {}), set(totals.get('folded', []))
+
+
+def fold_process_metrics(directory, pid):
+    """
+    Add the files written by the exited process pid to totals.json and remove them. Call from one process
+    only (the gunicorn master). totals.json lists the folded files until they are gone, so a reader never
+    counts a process twice.
+    """
+    if not directory or not os.path.isdir(directory):
+        return
+    metrics, folded = read_totals(directory)
+    paths = [os.path.join(directory, filename) for filename in os.listdir(directory)
+             if filename.startswith(PROCESS_FILE_PREFIX) and filename.endswith('.json')]
+    exited = {}
+    for path in paths:
+        data = _read_json(path)
+        if data is not None and data.get('pid') == pid and data['id'] not in folded:
+            exited[path] = data
+    if not exited:
+        return
+    folded = {process_id for process_id in folded if os.path.exists(_process_path(directory, process_id))}
+    folded.update(data['id'] for data in exited.values())
+    metrics = _as_snapshot(merge_snapshots([metrics] + [data['metrics'] for data in exited.values()]))
+    _write_json(directory, TOTALS_FILENAME, {'metrics': metrics, 'folded': sorted(folded)})
+    for path in exited:
+        os.remove(path)
+
+
+def _process_path(directory, process_id):
+    return os.path.join(directory, f'{PROCESS_FILE_PREFIX}{process_id}.json')
+
+
+class MetricsRegistry:
+    def __init__(self, directory=None, flush_interval=5.0):
+        self.directory = directory
+        self.flush_interval = flush_interval
+        self._lock = threading.Lock()
+        self._values = {name: {} for name in METRICS}
+        self._pid = None  # Process the id and flusher thread below belong to
+        self.process_id = None
+
+    @classmethod
+    def from_settings(cls):
+        return cls(
+            directory=getattr(settings, 'METRICS_DIR', None),
+            flush_interval=getattr(settings, 'METRICS_FLUSH_INTERVAL', 5.0),
+        )
+
+    def _inc(self, name, labels, amount=1):
+        values = self._values[name]
+        values[labels] = values.get(labels, 0) + amount
+
+    def _observe(self, name, labels, value):
+        buckets = METRICS[name][3]
+        histogram = self._values[name].get(labels)
+        if histogram is None:
+            histogram = self._values[name][labels] = {'buckets': [0] * len(buckets), 'sum': 0, 'count': 0}
+        for index, bound in enumerate(buckets):
+            if value <= bound:
+                histogram['buckets'][index] += 1
+        histogram['sum'] += value
+        histogram['count'] += 1
+
+    def record_request(self, view, method, status, duration, size, queries, query_duration):
+        labels = (view, method)
+        with self._lock:
+            self._inc('restaurant_http_requests_total', (view, method, str(status)))
+            if status >= 500:
+                self._inc('restaurant_http_request_errors_total', labels)
+            self._observe('restaurant_http_request_duration_seconds', labels, duration)
+            if size is not None:
+                self._observe('restaurant_http_response_size_bytes', labels, size)
+            self._observe('restaurant_http_request_db_queries', labels, queries)
+            self._inc('restaurant_db_query_duration_seconds_total', labels, query_duration)
+        if self.directory and self._pid != os.getpid():
+            self._start_flusher()
+
+    def _start_flusher(self):
+        """ Give this process its own id and a thread that writes its values every flush interval """
+        with self._lock:
+            if self._pid == os.getpid():
+                return
+            # A forked child gets a new id, so it never writes over its parent's file
+            self._pid, self.process_id = os.getpid(), uuid.uuid4().hex
+        os.makedirs(self.directory, exist_ok=True)
+        threading.Thread(target=self._flush_loop, name='metrics-flusher', daemon=True).start()
+
+    def _flush_loop(self):
+        while True:
+            time.sleep(self.flush_interval)
+            try:
+                self.flush()
+            except OSError as e:
+                logger.warning("Could not write metrics to %s: %s", self.directory, e)
+
+    def snapshot(self):
+        """ JSON-friendly copy of this process's values: {name: [[labels, value], ...]} """
+        with self._lock:
+            return {
+                name: [
+                    [list(labels), dict(value, buckets=list(value['buckets'])) if isinstance(value, dict) else value]
+                    for labels, value in values.items()
+                ]
+                for name, values in self._values.items()
+            }
+
+    def flush(self):
+        """ Write this process's values to its file in METRICS_DIR (the flusher thread and exit do this) """
+        if not self.directory or self._pid != os.getpid():
+            return  # Nothing recorded in this process yet
+        _write_json(self.directory, os.path.basename(_process_path(self.directory, self.process_id)),
+                    {'pid': self._pid, 'id': self.process_id, 'metrics': self.snapshot()})
+
+    def collect(self):
+        """ Snapshots of this process, every other live process in METRICS_DIR and the exited ones' totals """
+        snapshots = [self.snapshot()]
+        if not self.directory or not os.path.isdir(self.directory):
+            return snapshots
+        totals, folded = read_totals(self.directory)
+        snapshots.append(totals)
+        for filename in os.listdir(self.directory):
+            if not (filename.startswith(PROCESS_FILE_PREFIX) and filename.endswith('.json')):
+                continue
+            data = _read_json(os.path.join(self.directory, filename))
+            if data is None or data['id'] in folded:
+                continue
+            if data['id'] == self.process_id and data['pid'] == self._pid:
+                continue  # This process; its current values are already in
+            snapshots.append(data['metrics'])
+        return snapshots
+
+    def render(self):
+        merged = merge_snapshots(self.collect())
+
+        lines = []
+        for name, (metric_type, help_text, label_names, buckets) in METRICS.items():
+            lines.append(f'# HELP {name} {help_text}')
+            lines.append(f'# TYPE {name} {metric_type}')
+            for labels, value in sorted(merged[name].items()):
+                label_text = ','.join(f'{key}="{_escape(label)}"' for key, label in zip(label_names, labels))
+                if metric_type == 'counter':
+                    lines.append(f'{name}{{{label_text}}} {_number(value)}')
+                    continue
+                for bound, count in zip(buckets, value['buckets']):
+                    lines.append(f'{name}_bucket{{{label_text},le="{_number(bound)}"}} {count}')
+                lines.append(f'{name}_bucket{{{label_text},le="+Inf"}} {value["count"]}')
+                lines.append(f'{name}_sum{{{label_text}}} {_number(value["sum"])}')
+                lines.append(f'{name}_count{{{label_text}}} {value["count"]}')
+        return '\n'.join(lines) + '\n'
+
+    def clear(self):
+        with self._lock:
+            self._values = {name: {} for name in METRICS}
+
+
+def _escape(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def _number(value):
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+metrics_registry = MetricsRegistry.from_settings()
+atexit.register(metrics_registry.flush)
+
+
+class HasMetricsToken(BasePermission):
+    """ Lets a scraper in with "Authorization: Bearer <METRICS_TOKEN>" when that setting is configured """
+
+    def has_permission(self, request, view):
+        token = getattr(settings, 'METRICS_TOKEN', None)
+        header = request.META.get('HTTP_AUTHORIZATION', '')
+        return bool(token) and hmac.compare_digest(header.encode(), f'Bearer {token}'.encode())
@@ -0,0 +1,82 @@
+import time
+
+from asgiref.sync import iscoroutinefunction
+from django.conf import settings
+from django.utils.decorators import sync_and_async_middleware
+
+from .db_router import replica_alias, replica_reads
+from .metrics import metrics_registry, stop_tracking_queries, track_queries
+
+SAFE_METHODS = ('GET', 'HEAD', 'OPTIONS')
+PRIMARY_PIN_COOKIE = 'primary_pin'
+
+
+def _use_replica(request):
+    return request.method in SAFE_METHODS and PRIMARY_PIN_COOKIE not in request.COOKIES
+
+
+def _pin_after_write(request, response):
+    """ After a write, keep this client's reads on the primary until the replica has caught up """
+    if request.method not in SAFE_METHODS and response.status_code < 400 and replica_alias():
+        response.set_cookie(
+            PRIMARY_PIN_COOKIE, '1',
+            max_age=getattr(settings, 'REPLICA_PIN_SECONDS', 5),
+            httponly=True, samesite='Lax',
+        )
+    return response
+
+
+@sync_and_async_middleware
+def ReplicaRoutingMiddleware(get_response):
+    """ Route the reads of safe requests to the replica, except for clients that have just written """
+    if iscoroutinefunction(get_response):
+        async def middleware(request):
+            with replica_reads(_use_replica(request)):
+                response = await get_response(request)
+            return _pin_after_write(request, response)
+    else:
+        def middleware(request):
+            with replica_reads(_use_replica(request)):
+                response = get_response(request)
+            return _pin_after_write(request, response)
+    return middleware
+
+
+def _record_metrics(request, response, started, stats):
+    match = getattr(request, 'resolver_match', None)
+    size = None if response.streaming else len(response.content)
+    metrics_registry.record_request(
+        view=match.view_name if match is not None else 'unmatched',
+        method=request.method,
+        status=response.status_code,
+        duration=time.perf_counter() - started,
+        size=size,
+        queries=stats.count,
+        query_duration=stats.duration,
+    )
+
+
+@sync_and_async_middleware
+def MetricsMiddleware(get_response):
+    """ Record latency, response size, SQL queries and errors per view (see metrics.py) """
+    if iscoroutinefunction(get_response):
+        async def middleware(request):
+            started = time.perf_counter()
+            stats, token = track_queries()
+            try:
+                response = await get_response(request)
+            finally:
+                stop_tracking_queries(token)
+            _record_metrics(request, response, started, stats)
+            return response
+    else:
+        def middleware(request):
+            started = time.perf_counter()
+            stats, token = track_queries()
+            try:
+                response = get_response(request)
+            finally:
+                stop_tracking_queries(token)
+            _record_metrics(request, response, started, stats)
+            return response
+    return middleware
@@ -1,15 +1,24 @@
 #models.py
 
+from decimal import Decimal
+
+from django.core.serializers.json import DjangoJSONEncoder
 from django.db import models
+from django.utils import timezone
 from django.contrib.auth.models import AbstractUser
 from django.contrib.auth.hashers import make_password
+from django.contrib.postgres.search import SearchVectorField
+from .images import content_hashed_storage
 
 
 # Custom user model
 class CustomUser(AbstractUser):
     is_customer = models.BooleanField(default=True)
     is_admin = models.BooleanField(default=False)
-    profile_image = models.ImageField(upload_to='profile_images/', null=True, blank=True)
+    profile_image = models.ImageField(upload_to='profile_images/', storage=content_hashed_storage, null=True, blank=True)
+    # Resized/WebP copies of profile_image, filled in by the image worker (see images.py)
+    image_variants = models.JSONField(default=dict, blank=True, editable=False)
+    image_variants_source = models.CharField(max_length=255, blank=True, editable=False)
 
     def save(self, *args, **kwargs):
         # Ensure the password is hashed before saving if it's set
@@ -21,14 +30,52 @@ class CustomUser(AbstractUser):
     def __str__(self):
         return self.username
 
+# The authenticated user as described by its access token's role claims (AUTH_USER_FROM_CLAIMS). Every
+# other field is deferred and loaded, all in one query, the first time one of them is read.
+class ClaimsUser(CustomUser):
+    CLAIM_FIELDS = ('is_admin', 'is_customer', 'is_staff')
+
+    class Meta:
+        proxy = True
+
+    @classmethod
+    def from_claims(cls, token):
+        values = {'id': token['user_id'], **{field: token[field] for field in cls.CLAIM_FIELDS}}
+        names = [field.attname for field in cls._meta.concrete_fields if field.attname in values]
+        return cls.from_db(None, names, [values[name] for name in names])
+
+    def refresh_from_db(self, using=None, fields=None):
+        deferred = self.get_deferred_fields()
+        if fields is not None and deferred and set(fields) <= deferred:
+            fields = deferred  # Load the whole row on first use, not one field per attribute
+        super().refresh_from_db(using=using, fields=fields)
+
 # Food Item model
 class FoodItem(models.Model):
     name = models.CharField(max_length=100)
     description = models.TextField(null=True, blank=True)
     price = models.DecimalField(max_digits=10, decimal_places=2)
     category = models.CharField(max_length=50)
+    # Lower-cased, whitespace-collapsed copy of category for indexed exact filtering
+    category_normalized = models.CharField(max_length=50, db_index=True, editable=False, default='')
     availability = models.BooleanField(default=True)
-    image = models.ImageField(upload_to='food_images/',null=True, blank=True)
+    image = models.ImageField(upload_to='food_images/', storage=content_hashed_storage, null=True, blank=True)
+    # Resized/WebP copies of image, filled in by the image worker (see images.py)
+    image_variants = models.JSONField(default=dict, blank=True, editable=False)
+    image_variants_source = models.CharField(max_length=255, blank=True, editable=False)
+    # Maintained by a database trigger on PostgreSQL (see search.py); unused on other backends
+    search_vector = SearchVectorField(null=True, editable=False)
+
+    @staticmethod
+    def normalize_category(value):
+        return ' '.join((value or '').lower().split())
+
+    def save(self, *args, **kwargs):
+        self.category_normalized = self.normalize_category(self.category)
+        update_fields = kwargs.get('update_fields')
+        if update_fields is not None and 'category' in update_fields:
+            kwargs['update_fields'] = set(update_fields) | {'category_normalized'}
+        super().save(*args, **kwargs)
 
     def __str__(self):
         return self.name
@@ -40,16 +87,134 @@ class Order(models.Model):
         ('completed', 'Completed'),
         ('cancelled', 'Cancelled'),
     ]
+    # Allowed status changes; completed and cancelled orders are final
+    STATUS_TRANSITIONS = {
+        'pending': {'completed', 'cancelled'},
+        'completed': set(),
+        'cancelled': set(),
+    }
     customer = models.ForeignKey(CustomUser, on_delete=models.CASCADE)
-    items = models.ManyToManyField(FoodItem)
-    total_price = models.DecimalField(max_digits=10, decimal_places=2, blank=True)
+    items = models.ManyToManyField(FoodItem, through='OrderItem')
+    total_price = models.DecimalField(max_digits=10, decimal_places=2, blank=True, default=0)
     status = models.CharField(choices=STATUS_CHOICES, default='pending', max_length=20)
+    created_at = models.DateTimeField(default=timezone.now, db_index=True)
+    # Bumped by every status change; clients send it back (If-Match) to detect concurrent edits
+    version = models.PositiveIntegerField(default=0)
 
-    def save(self, *args, **kwargs):
-        """ Override save to first create order, then calculate total_price """
-        super().save(*args, **kwargs)  # Save order first
-        self.total_price = sum(item.price for item in self.items.all())  # Now we can access items
-        super().save(update_fields=['total_price'])  # Save updated total_price
+    def recalculate_total(self):
+        """ Recompute total_price from the stored line items (one aggregate query) """
+        total = self.order_items.aggregate(
+            total=models.Sum(models.F('unit_price') * models.F('quantity'))
+        )['total']
+        self.total_price = Decimal(total or 0).quantize(Decimal('0.01'))
+        return self.total_price
+
+    def __str__(self):
+        return f"Order {self.id} for {self.customer.username}"
+
+# Order line item: quantity and the unit price captured when the order was placed
+class OrderItem(models.Model):
+    order = models.ForeignKey(Order, related_name='order_items', on_delete=models.CASCADE)
+    food_item = models.ForeignKey(FoodItem, on_delete=models.CASCADE)
+    quantity = models.PositiveIntegerField(default=1)
+    unit_price = models.DecimalField(max_digits=10, decimal_places=2)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['order', 'food_item'], name='unique_order_food_item'),
+        ]
+
+    @property
+    def line_total(self):
+        return self.unit_price * self.quantity
+
+    def __str__(self):
+        return f"{self.quantity} x {self.food_item_id} (order {self.order_id})"
+
+# Outgoing email, written in the same transaction as the change it reports and delivered by a worker
+class OutboundEmail(models.Model):
+    STATUS_CHOICES = [
+        ('pending', 'Pending'),
+        ('sent', 'Sent'),
+        ('failed', 'Failed'),
+    ]
+    dedupe_key = models.CharField(max_length=255, unique=True)
+    recipient = models.EmailField()
+    subject = models.CharField(max_length=255)
+    body = models.TextField()
+    status = models.CharField(choices=STATUS_CHOICES, default='pending', max_length=20)
+    attempts = models.PositiveIntegerField(default=0)
+    next_attempt_at = models.DateTimeField(default=timezone.now)
+    last_error = models.TextField(blank=True)
+    created_at = models.DateTimeField(auto_now_add=True)
+    sent_at = models.DateTimeField(null=True, blank=True)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['status', 'next_attempt_at'], name='outbox_due_idx'),
+        ]
+
+    def __str__(self):
+        return f"{self.subject} -> {self.recipient} ({self.status})"
+
+# A client-supplied Idempotency-Key and the response it produced, so a retried request is answered, not repeated
+class IdempotencyKey(models.Model):
+    user = models.ForeignKey(CustomUser, on_delete=models.CASCADE)
+    scope = models.CharField(max_length=50)  # The operation the key was used for, e.g. 'orders:create'
+    key = models.CharField(max_length=255)
+    request_fingerprint = models.CharField(max_length=64)
+    response_status = models.PositiveSmallIntegerField(null=True)
+    response_body = models.JSONField(null=True, encoder=DjangoJSONEncoder)
+    created_at = models.DateTimeField(auto_now_add=True)
+    expires_at = models.DateTimeField(db_index=True)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['user', 'scope', 'key'], name='unique_idempotency_key'),
+        ]
+
+    def __str__(self):
+        return f"{self.scope} {self.key} ({self.user_id})"
+
+# A JWT revoked before its expiry (logout, refresh rotation); kept until it would have expired anyway
+class RevokedToken(models.Model):
+    jti = models.CharField(max_length=255, unique=True)
+    token_type = models.CharField(max_length=20)
+    user = models.ForeignKey(CustomUser, null=True, blank=True, on_delete=models.CASCADE)
+    expires_at = models.DateTimeField(db_index=True)
+    revoked_at = models.DateTimeField(default=timezone.now, db_index=True)
+
+    def __str__(self):
+        return f"{self.token_type} {self.jti}"
+
+# Sales rollups, kept current by the order write paths (see restaurant/analytics.py) for the analytics endpoints.
+# Units and revenue sold per day (of created_at, in TIME_ZONE) and food item, counting orders that aren't cancelled
+class DailyItemSales(models.Model):
+    day = models.DateField()
+    food_item = models.ForeignKey(FoodItem, on_delete=models.CASCADE)
+    quantity = models.IntegerField(default=0)
+    revenue = models.DecimalField(max_digits=14, decimal_places=2, default=0)
+    order_count = models.IntegerField(default=0)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['day', 'food_item'], name='unique_daily_item_sales'),
+        ]
+
+    def __str__(self):
+        return f"{self.day} item {self.food_item_id}: {self.quantity} sold"
+
+# Orders and their total value per day and current status
+class DailyStatusSales(models.Model):
+    day = models.DateField()
+    status = models.CharField(max_length=20)
+    order_count = models.IntegerField(default=0)
+    revenue = models.DecimalField(max_digits=14, decimal_places=2, default=0)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['day', 'status'], name='unique_daily_status_sales'),
+        ]
 
     def __str__(self):
-        return f"Order {self.id} for {self.customer.username}"
\ No newline at end of file
+        return f"{self.day} {self.status}: {self.order_count} orders"
@@ -0,0 +1,105 @@
+from django.db import transaction
+from django.db.models import F
+
+from .analytics import record_orders, record_status_change
+from .events import publish_order_event
+from .models import FoodItem, Order, OrderItem
+from .outbox import enqueue_order_status_email
+from .recommendations import recommendation_engine
+
+
+def merge_quantities(items=(), line_items=()):
+    """ {food_item: quantity} from a flat list of items (one unit each) and (food_item, quantity) pairs """
+    quantities = {}
+    for item in items:
+        quantities[item] = quantities.get(item, 0) + 1
+    for item, quantity in line_items:
+        quantities[item] = quantities.get(item, 0) + quantity
+    return quantities
+
+
+def place_orders(customer, baskets):
+    """
+    Create one pending order per basket ({FoodItem: quantity}) with two bulk INSERTs in one transaction.
+
+    Unit prices are captured from the given FoodItem instances and each order's total is stored up front.
+    The sales rollups are updated in the same transaction.
+    """
+    with transaction.atomic():
+        orders = Order.objects.bulk_create([
+            Order(
+                customer=customer,
+                total_price=sum(item.price * quantity for item, quantity in basket.items()),
+                status='pending',  # Default status is 'pending'
+            )
+            for basket in baskets
+        ])
+        order_items = OrderItem.objects.bulk_create([
+            OrderItem(order=order, food_item=item, quantity=quantity, unit_price=item.price)
+            for order, basket in zip(orders, baskets)
+            for item, quantity in basket.items()
+        ])
+        record_orders(orders, order_items)
+        # Let this process's recommendation engine pick the orders up on its next read
+        transaction.on_commit(recommendation_engine.mark_stale)
+        for order in orders:
+            publish_order_event(order, 'order.created')
+    return orders
+
+
+def resolve_food_items(item_ids):
+    """ Look up every referenced food item with a single query """
+    return FoodItem.objects.in_bulk(set(item_ids))
+
+
+class StatusConflict(Exception):
+    """ The order is not in a state (or version) the requested change applies to; carries its current state """
+
+    def __init__(self, order, message):
+        super().__init__(message)
+        self.order = order
+
+
+def transition_order_status(order_id, status, expected_version=None):
+    """
+    Move an order to status with one conditional UPDATE, so concurrent changes can't both win.
+
+    The UPDATE only matches while the order is in a state the transition is allowed from (and at
+    expected_version, when given), and bumps the version. Returns (order, changed); asking for the status
+    the order already has is a no-op. Raises StatusConflict when the order moved on or the transition isn't
+    allowed, and Order.DoesNotExist for an unknown id. .update() sends no post_save, so the notification
+    email, the order event and the sales rollup update are done here.
+    """
+    sources = sorted(source for source, targets in Order.STATUS_TRANSITIONS.items() if status in targets)
+
+    with transaction.atomic():
+        matching = Order.objects.filter(pk=order_id)
+        if expected_version is not None:
+            matching = matching.filter(version=expected_version)
+        # One UPDATE per allowed source status (usually just one), so the rollups know which status was left
+        previous_status = None
+        for source in sources:
+            # Older rows may hold capitalised statuses
+            if matching.filter(status__iexact=source).update(status=status, version=F('version') + 1):
+                previous_status = source
+                break
+        order = Order.objects.select_related('customer').prefetch_related('items', 'order_items').get(pk=order_id)
+
+        if previous_status is None:
+            if expected_version is not None and order.version != expected_version:
+                raise StatusConflict(order, "The order was changed by someone else; reload it and try again.")
+            if order.status.lower() == status:
+                return order, False
+            raise StatusConflict(order, f"An order that is {order.status.lower()} cannot be marked {status}.")
+
+        record_status_change(order, previous_status)
+        enqueue_order_status_email(order)
+        publish_order_event(order, 'order.status')
+    return order, True
+
+
+def delete_order(order):
+    """ Delete an order and take it out of the sales rollups """
+    with transaction.atomic():
+        record_orders([order], list(order.order_items.all()), sign=-1)
+        order.delete()
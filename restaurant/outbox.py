@@ -0,0 +1,111 @@
+import logging
+from datetime import timedelta
+
+from django.conf import settings
+from django.core.mail import EmailMessage, get_connection
+from django.db import transaction
+from django.utils import timezone
+
+from .models import OutboundEmail
+
+logger = logging.getLogger(__name__)
+
+MAX_ATTEMPTS = getattr(settings, 'EMAIL_OUTBOX_MAX_ATTEMPTS', 5)
+RETRY_BASE_SECONDS = getattr(settings, 'EMAIL_OUTBOX_RETRY_BASE_SECONDS', 30)
+RETRY_MAX_SECONDS = getattr(settings, 'EMAIL_OUTBOX_RETRY_MAX_SECONDS', 3600)
+# A claimed message is invisible to other workers for this long, in case the worker dies mid-send
+CLAIM_LEASE_SECONDS = getattr(settings, 'EMAIL_OUTBOX_CLAIM_LEASE_SECONDS', 300)
+
+
+def enqueue_email(dedupe_key, recipient, subject, body):
+    """ Queue an email; a second call with the same dedupe_key is a no-op """
+    if not recipient:
+        return None
+    email, _ = OutboundEmail.objects.get_or_create(
+        dedupe_key=dedupe_key,
+        defaults={'recipient': recipient, 'subject': subject, 'body': body},
+    )
+    return email
+
+
+def enqueue_order_status_email(order):
+    """ Queue the status notification for an order; the completion email and the generic update share a key """
+    customer = order.customer
+    if order.status == 'completed':
+        subject = "Your Order is Completed!"
+        body = f"Dear {customer.username},\n\nYour order #{order.id} has been marked as Completed. Thank you for ordering with us!\n\nBest regards,\nRestaurant Team"
+    else:
+        subject = 'Your Order Status Has Been Updated'
+        body = f'Hello {customer.username},\n\nYour order status has been updated to: {order.status}.'
+    return enqueue_email(f'order:{order.id}:status:{order.status}', customer.email, subject, body)
+
+
+def retry_delay(attempts):
+    """ Exponential backoff for a message that has failed `attempts` times """
+    return timedelta(seconds=min(RETRY_BASE_SECONDS * 2 ** (attempts - 1), RETRY_MAX_SECONDS))
+
+
+def claim_batch(batch_size, now=None):
+    """ Lease up to batch_size due messages so concurrent workers never send the same one """
+    now = now or timezone.now()
+    with transaction.atomic():
+        batch = list(
+            OutboundEmail.objects.select_for_update(skip_locked=True)
+            .filter(status='pending', next_attempt_at__lte=now)
+            .order_by('next_attempt_at', 'id')[:batch_size]
+        )
+        for email in batch:
+            email.attempts += 1
+            email.next_attempt_at = now + timedelta(seconds=CLAIM_LEASE_SECONDS)
+        OutboundEmail.objects.bulk_update(batch, ['attempts', 'next_attempt_at'])
+    return batch
+
+
+def _mark_failed_attempt(email, error, now):
+    email.last_error = str(error)
+    if email.attempts >= MAX_ATTEMPTS:
+        email.status = 'failed'
+    else:
+        email.next_attempt_at = now + retry_delay(email.attempts)
+    email.save(update_fields=['status', 'last_error', 'next_attempt_at'])
+
+
+def deliver_batch(batch_size=50):
+    """ Send one batch of due messages over a single connection; returns (sent, failed) """
+    batch = claim_batch(batch_size)
+    if not batch:
+        return 0, 0
+
+    sent = failed = 0
+    connection = get_connection(fail_silently=False)
+    try:
+        connection.open()
+    except Exception as e:
+        logger.warning("Could not open email connection: %s", e)
+        now = timezone.now()
+        for email in batch:
+            _mark_failed_attempt(email, e, now)
+        return 0, len(batch)
+
+    try:
+        for email in batch:
+            message = EmailMessage(
+                email.subject, email.body, settings.DEFAULT_FROM_EMAIL, [email.recipient],
+                connection=connection,
+            )
+            try:
+                message.send()
+            except Exception as e:
+                logger.warning("Sending outbox email %s failed: %s", email.id, e)
+                _mark_failed_attempt(email, e, timezone.now())
+                failed += 1
+            else:
+                email.status = 'sent'
+                email.sent_at = timezone.now()
+                email.last_error = ''
+                email.save(update_fields=['status', 'sent_at', 'last_error'])
+                sent += 1
+    finally:
+        connection.close()
+
+    return sent, failed
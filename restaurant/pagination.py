@@ -0,0 +1,204 @@
+import base64
+import binascii
+import datetime
+import decimal
+import json
+from collections import OrderedDict
+
+from django.core.exceptions import ValidationError
+from django.db.models import Q
+from rest_framework.exceptions import NotFound
+from rest_framework.pagination import BasePagination
+from rest_framework.response import Response
+from rest_framework.utils.urls import remove_query_param, replace_query_param
+
+
+class KeysetPagination(BasePagination):
+    """
+    Cursor pagination over the queryset's ordering plus the primary key as a tie-breaker.
+
+    Each page is a WHERE on the last row's sort key followed by LIMIT, so page cost stays the same at any
+    depth. The total count is included unless the client sends ?count=false.
+    """
+    page_size = 5  # Number of items per page
+    page_size_query_param = 'page_size'  # Allow dynamic page size (e.g., ?page_size=10)
+    max_page_size = 50  # Prevent excessive results per page
+    cursor_query_param = 'cursor'
+    count_query_param = 'count'
+    invalid_cursor_message = 'Invalid cursor'
+
+    def get_page_size(self, request):
+        try:
+            size = int(request.query_params[self.page_size_query_param])
+        except (KeyError, ValueError):
+            return self.page_size
+        return min(max(size, 1), self.max_page_size)
+
+    def include_count(self, request):
+        return request.query_params.get(self.count_query_param, 'true').lower() not in ('0', 'false', 'no')
+
+    def get_ordering(self, queryset):
+        """ The queryset's ordering as field names, with the primary key appended to make it unique """
+        ordering = [str(field) for field in queryset.query.order_by] or ['pk']
+        if not any(field.lstrip('-') in ('pk', 'id') for field in ordering):
+            ordering.append('-pk' if ordering[-1].startswith('-') else 'pk')
+        return ordering
+
+    # Cursor encoding
+
+    def encode_cursor(self, values, reverse):
+        payload = {'v': [self._encode_value(value) for value in values], 'r': reverse, 'o': self.ordering}
+        return base64.urlsafe_b64encode(json.dumps(payload, separators=(',', ':')).encode()).decode()
+
+    def decode_cursor(self, request, queryset):
+        encoded = request.query_params.get(self.cursor_query_param)
+        if not encoded:
+            return None, False
+        try:
+            payload = json.loads(base64.urlsafe_b64decode(encoded.encode()))
+            values, reverse, ordering = payload['v'], bool(payload['r']), payload['o']
+        except (TypeError, ValueError, KeyError, binascii.Error):
+            raise NotFound(self.invalid_cursor_message)
+        if ordering != self.ordering or len(values) != len(self.ordering):
+            raise NotFound(self.invalid_cursor_message)
+        try:
+            # A well-formed cursor can still carry values of the wrong type; they must not reach the filter
+            values = [self.sort_field(queryset, field.lstrip('-')).to_python(value) for field, value in zip(ordering, values)]
+        except (ValidationError, ValueError, TypeError):
+            raise NotFound(self.invalid_cursor_message)
+        if any(value is None for value in values):
+            raise NotFound(self.invalid_cursor_message)
+        return values, reverse
+
+    @staticmethod
+    def sort_field(queryset, name):
+        """ The model field or annotation output field a sort key value belongs to """
+        if name in queryset.query.annotations:
+            return queryset.query.annotations[name].output_field
+        opts = queryset.model._meta
+        return opts.pk if name == 'pk' else opts.get_field(name)
+
+    @staticmethod
+    def _encode_value(value):
+        if isinstance(value, decimal.Decimal):
+            return str(value)
+        if isinstance(value, (datetime.date, datetime.datetime)):
+            return value.isoformat()
+        return value
+
+    # Keyset filtering
+
+    def position_filter(self, values, reverse):
+        """ Q selecting rows strictly after (or before, when reverse) the given sort key """
+        condition = Q()
+        for index, field in enumerate(self.ordering):
+            descending = field.startswith('-')
+            name = field.lstrip('-')
+            lookup = 'lt' if descending != reverse else 'gt'
+            equal = {f.lstrip('-'): values[i] for i, f in enumerate(self.ordering[:index])}
+            condition |= Q(**equal, **{f'{name}__{lookup}': values[index]})
+        return condition
+
+    def row_key(self, row):
+        return [getattr(row, field.lstrip('-')) for field in self.ordering]
+
+    def page_queryset(self, queryset, request):
+        """ The sliced queryset for the requested page; evaluate it and pass the rows to finish_page() """
+        self.request = request
+        self.page_size_value = self.get_page_size(request)
+        self.ordering = self.get_ordering(queryset)
+        values, self.reverse = self.decode_cursor(request, queryset)
+        self.has_cursor = values is not None
+
+        if values is not None:
+            queryset = queryset.filter(self.position_filter(values, self.reverse))
+        if self.reverse:
+            queryset = queryset.order_by(*[f[1:] if f.startswith('-') else f'-{f}' for f in self.ordering])
+        else:
+            queryset = queryset.order_by(*self.ordering)
+        return queryset[:self.page_size_value + 1]
+
+    def finish_page(self, rows):
+        """ Trim the look-ahead row and work out the next/previous cursors """
+        rows = list(rows)
+        has_more = len(rows) > self.page_size_value
+        rows = rows[:self.page_size_value]
+        if self.reverse:
+            rows.reverse()
+            self.has_next, self.has_previous = True, has_more
+        else:
+            self.has_next, self.has_previous = has_more, self.has_cursor
+        self.first_key = self.row_key(rows[0]) if rows else None
+        self.last_key = self.row_key(rows[-1]) if rows else None
+        return rows
+
+    def paginate_queryset(self, queryset, request, view=None):
+        self.count = queryset.count() if self.include_count(request) else None
+        return self.finish_page(self.page_queryset(queryset, request))
+
+    # Links and response
+
+    def _link(self, key, reverse):
+        url = self.request.build_absolute_uri()
+        if key is None:
+            return None
+        return replace_query_param(url, self.cursor_query_param, self.encode_cursor(key, reverse))
+
+    def get_next_link(self):
+        if not self.has_next:
+            return None
+        if self.last_key is None:
+            # An empty page reached backwards; start again from the beginning
+            return remove_query_param(self.request.build_absolute_uri(), self.cursor_query_param)
+        return self._link(self.last_key, False)
+
+    def get_previous_link(self):
+        if not self.has_previous or self.first_key is None:
+            return None
+        return self._link(self.first_key, True)
+
+    def get_paginated_data(self, data):
+        payload = OrderedDict([('next', self.get_next_link()), ('previous', self.get_previous_link())])
+        if self.count is not None:
+            payload['count'] = self.count
+        payload['results'] = data
+        return payload
+
+    def get_paginated_response(self, data):
+        return Response(self.get_paginated_data(data))
+
+    def get_paginated_response_schema(self, schema):
+        return {
+            'type': 'object',
+            'required': ['results'],
+            'properties': {
+                'next': {'type': 'string', 'nullable': True, 'format': 'uri'},
+                'previous': {'type': 'string', 'nullable': True, 'format': 'uri'},
+                'count': {'type': 'integer', 'description': 'Omitted when ?count=false'},
+                'results': schema,
+            },
+        }
+
+    def get_schema_operation_parameters(self, view):
+        return [
+            {
+                'name': self.cursor_query_param, 'required': False, 'in': 'query',
+                'description': 'The pagination cursor value.', 'schema': {'type': 'string'},
+            },
+            {
+                'name': self.page_size_query_param, 'required': False, 'in': 'query',
+                'description': 'Number of results to return per page.', 'schema': {'type': 'integer'},
+            },
+            {
+                'name': self.count_query_param, 'required': False, 'in': 'query',
+                'description': 'Set to false to skip the total count.', 'schema': {'type': 'boolean'},
+            },
+        ]
+
+
+class MenuPagination(KeysetPagination):
+    page_size = 5
+
+
+class OrderPagination(KeysetPagination):
+    page_size = 20
@@ -1,26 +1,215 @@
-from .models import FoodItem, Order
-from django.db.models import Count
+import logging
+import threading
+import time
+from collections import Counter, defaultdict
+from itertools import groupby
 
-def get_recommendations(user):
+from django.conf import settings
+from django.core.cache import cache
+from django.db import connections
+
+from .analytics import UNSOLD_STATUSES, parse_day_range, top_items
+from .menu_cache import get_menu_version
+from .models import FoodItem, OrderItem
+
+SYNC_INTERVAL = getattr(settings, 'RECOMMENDATIONS_SYNC_INTERVAL', 10)
+# Orders can commit out of id order; re-scan this many ids below the high-water mark to catch late commits
+SYNC_LOOKBACK = 100
+GENERATION_KEY = 'recommendations:generation'
+# Best sellers considered for the fallback served while a process's counts are still loading
+FALLBACK_CANDIDATES = 50
+
+logger = logging.getLogger(__name__)
+
+
+class RecommendationEngine:
+    """
+    In-memory popularity, per-user item counts and item-item co-occurrence counts.
+
+    The counts are sparse (Counters keyed by item id) and are kept current by pulling order lines placed
+    since the last sync. A sync runs at most every SYNC_INTERVAL seconds, or on the next read after an
+    order is placed in this process. `rebuild_recommendations` makes every process recount from scratch;
+    it reaches other processes through the shared cache, so only when REDIS_URL is set.
+
+    Server workers load their counts in a background thread (start_warming(), from gunicorn's
+    post_worker_init) and recount the same way after a rebuild, swapping the new counts in when they are
+    complete; until a worker's first load is done, get_recommendations() falls back to the best sellers of
+    the sales rollups. Elsewhere (commands, runserver) the first read loads the counts itself.
+
+    The counts are append-only: an order that is cancelled or deleted after a process counted it stays in
+    that process's counts until the next rebuild, which leaves cancelled orders out. Run the rebuild
+    regularly (e.g. daily, with `rebuild_recommendations --loop`) so they don't skew recommendations for long.
+    """
+
+    def __init__(self, sync_interval=SYNC_INTERVAL):
+        self.sync_interval = sync_interval
+        self._lock = threading.RLock()
+        self.background = False  # Load and rebuild counts in a background thread (set by start_warming())
+        self._warming = False
+        self.reset()
+
+    def reset(self, generation=None):
+        with self._lock:
+            self.popularity = Counter()
+            self.user_items = defaultdict(Counter)
+            self.co_occurrence = defaultdict(Counter)
+            self.last_order_id = 0
+            self._recent_orders = set()
+            self._generation = generation
+            self._synced_at = None
+            self._menu = (None, {})
+            self.warm = False  # Counts loaded from the order history
+
+    def mark_stale(self):
+        """ Sync on the next read instead of waiting for the interval """
+        self._synced_at = None
+
+    def record_order(self, customer_id, quantities):
+        """ Add one order ({food_item_id: quantity}) to the counts """
+        with self._lock:
+            user_items = self.user_items[customer_id]
+            for item_id, quantity in quantities.items():
+                self.popularity[item_id] += quantity
+                user_items[item_id] += quantity
+            for item_id in quantities:
+                related = self.co_occurrence[item_id]
+                for other_id in quantities:
+                    if other_id != item_id:
+                        related[other_id] += 1
+
+    def _apply_lines(self, lines):
+        """ Record order lines given as (order_id, customer_id, food_item_id, quantity), grouped by order """
+        for order_id, order_lines in groupby(lines, key=lambda line: line[0]):
+            order_lines = list(order_lines)
+            if order_id in self._recent_orders:
+                continue
+            self.record_order(order_lines[0][1], {line[2]: line[3] for line in order_lines})
+            self._recent_orders.add(order_id)
+            self.last_order_id = max(self.last_order_id, order_id)
+
+    def sync(self, force=False):
+        """ Pull order lines placed since the last sync (or everything, after a rebuild request) """
+        if not force and self._synced_at is not None and time.monotonic() - self._synced_at < self.sync_interval:
+            return
+        with self._lock:
+            generation = cache.get(GENERATION_KEY)
+            if generation != self._generation:
+                if self.background and self.warm:
+                    # Keep answering from the current counts while the new ones load
+                    self._synced_at = time.monotonic()
+                    self.start_warming()
+                    return
+                self.reset(generation)
+            lines = OrderItem.objects.filter(order_id__gt=self.last_order_id - SYNC_LOOKBACK)
+            for status in UNSOLD_STATUSES:
+                lines = lines.exclude(order__status__iexact=status)
+            lines = lines.order_by('order_id').values_list('order_id', 'order__customer_id', 'food_item_id', 'quantity')
+            self._apply_lines(lines.iterator(chunk_size=2000))
+            floor = self.last_order_id - SYNC_LOOKBACK
+            self._recent_orders = {order_id for order_id in self._recent_orders if order_id > floor}
+            self._synced_at = time.monotonic()
+            self.warm = True
+
+    def start_warming(self):
+        """ (Re)load the counts from the order history in a background thread, and do so from now on """
+        with self._lock:
+            self.background = True
+            if self._warming:
+                return
+            self._warming = True
+        threading.Thread(target=self._warm, name='recommendations-warmup', daemon=True).start()
+
+    def _warm(self):
+        try:
+            fresh = RecommendationEngine(self.sync_interval)
+            fresh.sync(force=True)
+            with self._lock:
+                for name in ('popularity', 'user_items', 'co_occurrence', 'last_order_id', '_recent_orders', '_generation'):
+                    setattr(self, name, getattr(fresh, name))
+                self._synced_at = None  # Pick up orders placed during the load on the next read
+                self.warm = True
+        except Exception:
+            logger.exception("Loading the recommendation counts failed; retrying on the next read")
+        finally:
+            self._warming = False
+            connections.close_all()  # This thread's connections; nothing else would close them
+
+    def menu(self):
+        """ All food items by id, reloaded only when the menu version changes """
+        version = get_menu_version()
+        if self._menu[0] != version:
+            # From the primary: a lagging replica's rows would be kept for the whole version
+            self._menu = (version, FoodItem.objects.using('default').defer('search_vector').in_bulk())
+        return self._menu[1]
+
+    def popular(self):
+        return [item_id for item_id, _ in self.popularity.most_common()]
+
+    def also_ordered(self, item_id):
+        """ Items most often ordered together with item_id """
+        with self._lock:
+            return [other_id for other_id, _ in self.co_occurrence.get(item_id, Counter()).most_common()]
+
+    def for_user(self, user_id):
+        """ The user's own favourites, then items often ordered with them, then overall popularity """
+        with self._lock:
+            own = self.user_items.get(user_id, Counter())
+            related = Counter()
+            for item_id, quantity in own.items():
+                for other_id, together in self.co_occurrence.get(item_id, Counter()).items():
+                    if other_id not in own:
+                        related[other_id] += quantity * together
+            ranked = [item_id for item_id, _ in own.most_common()]
+            ranked += [item_id for item_id, _ in related.most_common()]
+            return ranked + self.popular()
+
+
+recommendation_engine = RecommendationEngine()
+
+
+def request_rebuild():
+    """ Make every process drop its counts and rebuild them from the order tables on its next sync """
+    cache.set(GENERATION_KEY, time.time_ns(), None)
+
+
+def _pick_available(ranked_ids, menu, limit):
+    picked, seen = [], set()
+    for item_id in ranked_ids:
+        item = menu.get(item_id)
+        if item is not None and item.availability and item_id not in seen:
+            picked.append(item)
+            seen.add(item_id)
+            if len(picked) == limit:
+                break
+    return picked
+
+
+def _best_sellers(menu, limit, exclude=None):
+    """ The items sold most over the last ANALYTICS_DEFAULT_DAYS days, from the sales rollups """
+    start, end = parse_day_range()
+    ranked = [row['food_item'] for row in top_items(start, end, limit=FALLBACK_CANDIDATES) if row['food_item'] != exclude]
+    return _pick_available(ranked, menu, limit)
+
+
+def get_recommendations(user, item_id=None, limit=5):
     """ Return recommended food items based on order history and popularity """
+    engine = recommendation_engine
+    if engine.background and not engine.warm:
+        engine.start_warming()  # No-op while a load is running; retries one that failed
+        menu = engine.menu()
+        return _best_sellers(menu, limit, exclude=item_id) or _pick_available(sorted(menu, reverse=True), menu, limit)
+
+    engine.sync()
+    menu = engine.menu()
+
+    if item_id is not None:
+        # Customers who ordered this item also ordered...
+        return _pick_available(engine.also_ordered(item_id), menu, limit)
+
+    recommended = _pick_available(engine.for_user(user.id), menu, limit)
+    if recommended:
+        return recommended
 
-    # Get the user's past orders
-    past_orders = Order.objects.filter(customer=user).prefetch_related('items')
-
-    if past_orders.exists():
-        # Get most frequently ordered items
-        ordered_items = past_orders.values_list('items', flat=True)
-        frequent_items = FoodItem.objects.filter(id__in=ordered_items)\
-                                         .annotate(order_count=Count('order'))\
-                                         .order_by('-order_count')[:5]
-        if frequent_items:
-            return frequent_items
-
-    # If no order history, return most popular items
-    popular_items = FoodItem.objects.annotate(order_count=Count('order'))\
-                                    .order_by('-order_count')[:5]
-    if popular_items:
-        return popular_items
-
-    # If no popular items, return latest available food items
-    return FoodItem.objects.filter(availability=True).order_by('-id')[:5]
+    # If nobody has ordered anything yet, return latest available food items
+    latest = sorted(menu, reverse=True)
+    return _pick_available(latest, menu, limit)
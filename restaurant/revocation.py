@@ -0,0 +1,152 @@
+"""
+Revocation of JWTs before they expire: access and refresh tokens on logout, refresh tokens on rotation.
+
+Revoked token ids (jti) are stored in RevokedToken until the token would have expired anyway. Each process
+keeps a Bloom filter of them, so checking a token that isn't revoked - almost every request - needs no I/O.
+Only a filter hit (a revoked token, or a rare false positive) is confirmed against the database.
+
+The filter picks up revocations made by other processes every SYNC_SECONDS with a query for the rows
+revoked since the newest one it has seen, and is rebuilt from scratch every REBUILD_SECONDS, which is also when expired
+rows are deleted (a Bloom filter can't forget entries on its own).
+"""
+import hashlib
+import math
+import threading
+import time
+from datetime import datetime, timedelta, timezone as dt_timezone
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.db.models.functions import Now
+from django.utils import timezone
+
+from .models import RevokedToken
+
+# Rows committed slightly out of order are still picked up by re-reading this much of the previous window
+SYNC_OVERLAP_SECONDS = 30
+
+
+class BloomFilter:
+    """ Set membership with no false negatives and about error_rate false positives at capacity """
+
+    def __init__(self, capacity, error_rate=0.001):
+        self.size = max(64, math.ceil(-capacity * math.log(error_rate) / math.log(2) ** 2))
+        self.hash_count = max(1, round(self.size / capacity * math.log(2)))
+        self.bits = bytearray((self.size + 7) // 8)
+        self._lock = threading.Lock()
+
+    def _positions(self, value):
+        digest = hashlib.blake2b(value.encode(), digest_size=16).digest()
+        first, second = int.from_bytes(digest[:8], 'big'), int.from_bytes(digest[8:], 'big') | 1
+        return [(first + i * second) % self.size for i in range(self.hash_count)]
+
+    def add(self, value):
+        positions = self._positions(value)
+        with self._lock:
+            for position in positions:
+                self.bits[position >> 3] |= 1 << (position & 7)
+
+    def update(self, values):
+        for value in values:
+            self.add(value)
+
+    def __contains__(self, value):
+        return all(self.bits[position >> 3] & (1 << (position & 7)) for position in self._positions(value))
+
+
+class RevocationList:
+    def __init__(self, sync_seconds=5, rebuild_seconds=3600, capacity=100_000, error_rate=0.001):
+        self.sync_seconds = sync_seconds
+        self.rebuild_seconds = rebuild_seconds
+        self.capacity = capacity
+        self.error_rate = error_rate
+        self._filter = None
+        self._last_revoked_at = None  # Newest revoked_at seen; set by the database, so no app clock is involved
+        self._next_sync = self._next_rebuild = 0.0
+        self._lock = threading.Lock()
+
+    @classmethod
+    def from_settings(cls):
+        options = getattr(settings, 'TOKEN_REVOCATION', {})
+        return cls(
+            sync_seconds=options.get('SYNC_SECONDS', 5),
+            rebuild_seconds=options.get('REBUILD_SECONDS', 3600),
+            capacity=options.get('CAPACITY', 100_000),
+            error_rate=options.get('ERROR_RATE', 0.001),
+        )
+
+    def _claim_sync(self):
+        """ True for the one caller that should sync now; others keep using the current filter """
+        with self._lock:
+            if self._filter is not None and time.monotonic() < self._next_sync:
+                return False
+            self._next_sync = time.monotonic() + self.sync_seconds
+            return True
+
+    def sync(self, rebuild=False):
+        """ Add revocations made since the last sync, or rebuild the filter when asked or when it's due """
+        self._next_sync = time.monotonic() + self.sync_seconds
+        if rebuild or self._filter is None or time.monotonic() >= self._next_rebuild:
+            # expires_at comes from the token's exp, which the app clock set too
+            now = timezone.now()
+            RevokedToken.objects.filter(expires_at__lte=now).delete()
+            rows = list(RevokedToken.objects.filter(expires_at__gt=now).values_list('jti', 'revoked_at'))
+            bloom = BloomFilter(max(self.capacity, 2 * len(rows)), self.error_rate)
+            bloom.update(jti for jti, _ in rows)
+            self._filter = bloom
+            self._last_revoked_at = None
+            self._next_rebuild = time.monotonic() + self.rebuild_seconds
+        else:
+            rows = RevokedToken.objects.all()
+            if self._last_revoked_at is not None:
+                rows = rows.filter(revoked_at__gte=self._last_revoked_at - timedelta(seconds=SYNC_OVERLAP_SECONDS))
+            rows = list(rows.values_list('jti', 'revoked_at'))
+            self._filter.update(jti for jti, _ in rows)
+        seen = [revoked_at for _, revoked_at in rows]
+        if self._last_revoked_at is not None:
+            seen.append(self._last_revoked_at)
+        self._last_revoked_at = max(seen, default=None)
+
+    def add(self, jti):
+        if self._filter is not None:
+            self._filter.add(jti)
+
+    def is_revoked(self, jti):
+        if self._claim_sync():
+            self.sync()
+        if jti not in self._filter:
+            return False
+        return RevokedToken.objects.filter(jti=jti).exists()
+
+    async def ais_revoked(self, jti):
+        """ Async counterpart of is_revoked() """
+        if self._claim_sync():
+            await sync_to_async(self.sync)()
+        if jti not in self._filter:
+            return False
+        return await RevokedToken.objects.filter(jti=jti).aexists()
+
+    def reset(self):
+        with self._lock:
+            self._filter = None
+            self._next_sync = self._next_rebuild = 0.0
+
+
+revocation_list = RevocationList.from_settings()
+
+
+def revoke_tokens(*tokens):
+    """ Revoke validated simplejwt tokens (AccessToken, RefreshToken) until they expire, with one INSERT """
+    RevokedToken.objects.bulk_create([
+        RevokedToken(
+            jti=token['jti'],
+            token_type=token.token_type,
+            user_id=token.get('user_id'),
+            expires_at=datetime.fromtimestamp(token['exp'], tz=dt_timezone.utc),
+            revoked_at=Now(),  # The database's clock, which every process's sync compares against
+        )
+        for token in tokens
+    ], ignore_conflicts=True)  # Already revoked
+    # Seen by this process at once; other processes pick them up at their next sync
+    for token in tokens:
+        revocation_list.add(token['jti'])
@@ -0,0 +1,176 @@
+import logging
+import re
+import threading
+from collections import defaultdict
+
+from django.conf import settings
+from django.contrib.postgres.search import SearchQuery, SearchRank
+from django.db import connections
+from django.db.models import BigIntegerField, Case, F, Q, Value, When
+from django.db.models.functions import Cast, Round
+from rest_framework import filters
+
+from .menu_cache import get_menu_version
+from .models import FoodItem
+
+logger = logging.getLogger(__name__)
+
+SEARCH_CONFIG = 'english'
+
+# Same relative weights PostgreSQL's ts_rank gives to A/B/C labels
+FIELD_WEIGHTS = (('name', 1.0), ('category', 0.4), ('description', 0.2))
+
+# search_rank is the score scaled to an integer: it is part of the keyset pagination cursor, and a float
+# (ts_rank's float4) doesn't survive the trip through JSON exactly, so pages would repeat or skip rows
+RANK_SCALE = 1_000_000
+
+# Matches the in-process index passes to the database, best first. Each costs three query parameters
+# (id__in and the rank's When), so this keeps a broad search well inside SQLite's 999-parameter limit
+SEARCH_FALLBACK_MAX_MATCHES = getattr(settings, 'SEARCH_FALLBACK_MAX_MATCHES', 200)
+
+POSTGRES_SEARCH_SQL = [
+    "CREATE EXTENSION IF NOT EXISTS pg_trgm",
+    """
+    CREATE OR REPLACE FUNCTION restaurant_fooditem_search_vector_update() RETURNS trigger AS $$
+    BEGIN
+        NEW.search_vector :=
+            setweight(to_tsvector('english', coalesce(NEW.name, '')), 'A') ||
+            setweight(to_tsvector('english', coalesce(NEW.category, '')), 'B') ||
+            setweight(to_tsvector('english', coalesce(NEW.description, '')), 'C');
+        RETURN NEW;
+    END
+    $$ LANGUAGE plpgsql
+    """,
+    "DROP TRIGGER IF EXISTS restaurant_fooditem_search_vector_trigger ON restaurant_fooditem",
+    """
+    CREATE TRIGGER restaurant_fooditem_search_vector_trigger
+    BEFORE INSERT OR UPDATE ON restaurant_fooditem
+    FOR EACH ROW EXECUTE FUNCTION restaurant_fooditem_search_vector_update()
+    """,
+    "CREATE INDEX IF NOT EXISTS restaurant_fooditem_search_vector_gin ON restaurant_fooditem USING gin (search_vector)",
+    # name__icontains compiles to UPPER("name"::text) LIKE UPPER(%s); the index must be on that expression
+    "DROP INDEX IF EXISTS restaurant_fooditem_name_trgm",
+    "CREATE INDEX IF NOT EXISTS restaurant_fooditem_name_upper_trgm ON restaurant_fooditem USING gin (UPPER(name) gin_trgm_ops)",
+    # Fill rows written before the trigger existed
+    "UPDATE restaurant_fooditem SET search_vector = NULL WHERE search_vector IS NULL",
+]
+
+
+def install_search_support(using='default'):
+    """ Create the search trigger and indexes on PostgreSQL, and backfill normalized categories """
+    stale = list(FoodItem.objects.using(using).filter(category_normalized='').exclude(category=''))
+    for item in stale:
+        item.category_normalized = FoodItem.normalize_category(item.category)
+    FoodItem.objects.using(using).bulk_update(stale, ['category_normalized'], batch_size=500)
+
+    connection = connections[using]
+    if connection.vendor != 'postgresql':
+        return
+    with connection.cursor() as cursor:
+        for statement in POSTGRES_SEARCH_SQL:
+            cursor.execute(statement)
+
+
+def tokenize(text):
+    return re.findall(r'\w+', (text or '').lower())
+
+
+class MenuSearchIndex:
+    """ In-process inverted index over the menu, used where PostgreSQL full-text search is unavailable """
+
+    def __init__(self, rows=()):
+        self.postings = defaultdict(dict)  # token -> {item_id: weight}
+        for row in rows:
+            for field, weight in FIELD_WEIGHTS:
+                for token in tokenize(row[field]):
+                    postings = self.postings[token]
+                    postings[row['id']] = postings.get(row['id'], 0.0) + weight
+
+    def search(self, term):
+        """ Return {item_id: score} for items matching every word of term (words match as prefixes) """
+        scores = None
+        for word in tokenize(term):
+            matches = defaultdict(float)
+            for token, postings in self.postings.items():
+                if token.startswith(word):
+                    for item_id, weight in postings.items():
+                        matches[item_id] += weight
+            if scores is None:
+                scores = dict(matches)
+            else:
+                scores = {item_id: score + matches[item_id] for item_id, score in scores.items() if item_id in matches}
+            if not scores:
+                return {}
+        return scores or {}
+
+
+_index_lock = threading.Lock()
+_index_cache = {}  # alias -> (menu version, MenuSearchIndex)
+
+
+def get_menu_index(using='default'):
+    """ The fallback index for the current menu version, rebuilt only after the menu changes """
+    version = get_menu_version()
+    cached = _index_cache.get(using)
+    if cached and cached[0] == version:
+        return cached[1]
+    with _index_lock:
+        cached = _index_cache.get(using)
+        if cached and cached[0] == version:
+            return cached[1]
+        rows = FoodItem.objects.using(using).values('id', 'name', 'category', 'description').iterator(chunk_size=2000)
+        index = MenuSearchIndex(rows)
+        _index_cache[using] = (version, index)
+        return index
+
+
+def search_menu(queryset, term):
+    """ Filter queryset to items matching term and annotate them with search_rank (an integer, see RANK_SCALE) """
+    term = ' '.join(term.split())
+    if not term:
+        return queryset
+
+    if connections[queryset.db].vendor == 'postgresql':
+        query = SearchQuery(term, search_type='websearch', config=SEARCH_CONFIG)
+        # The trigram index on UPPER(name) keeps substring matches on the name (e.g. "burg") fast as well, so
+        # both sides of the OR can be answered from an index (a BitmapOr) instead of a sequential scan
+        return queryset.filter(Q(search_vector=query) | Q(name__icontains=term)).annotate(
+            search_rank=Cast(Round(SearchRank(F('search_vector'), query) * RANK_SCALE), BigIntegerField())
+        )
+
+    scores = get_menu_index(queryset.db).search(term)
+    if len(scores) > SEARCH_FALLBACK_MAX_MATCHES:
+        best = sorted(scores.items(), key=lambda entry: (-entry[1], entry[0]))[:SEARCH_FALLBACK_MAX_MATCHES]
+        scores = dict(best)
+    return queryset.filter(id__in=list(scores)).annotate(
+        search_rank=Case(
+            *[When(id=item_id, then=Value(round(score * RANK_SCALE))) for item_id, score in scores.items()],
+            default=Value(0),
+            output_field=BigIntegerField(),
+        )
+    )
+
+
+class MenuSearchFilter(filters.BaseFilterBackend):
+    """ Ranked menu search on ?search=, backed by the search vector or the in-process index """
+    search_param = 'search'
+
+    def get_search_term(self, request):
+        return request.query_params.get(self.search_param, '').strip()
+
+    def filter_queryset(self, request, queryset, view):
+        term = self.get_search_term(request)
+        if not term:
+            return queryset
+        return search_menu(queryset, term)
+
+
+class RankedOrderingFilter(filters.OrderingFilter):
+    """ OrderingFilter that puts the best search matches first unless the client asks for an ordering """
+
+    def get_default_ordering(self, view):
+        ordering = super().get_default_ordering(view)
+        request = getattr(view, 'request', None)
+        if request is not None and request.query_params.get(MenuSearchFilter.search_param, '').strip():
+            return ['-search_rank'] + list(ordering or [])
+        return ordering
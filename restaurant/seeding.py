@@ -0,0 +1,92 @@
+import random
+from datetime import timedelta
+from decimal import Decimal
+
+from django.contrib.auth.hashers import make_password
+from django.db import transaction
+from django.utils import timezone
+
+from .analytics import rebuild_rollups
+from .menu_cache import bump_menu_version
+from .models import CustomUser, FoodItem, Order, OrderItem
+from .recommendations import request_rebuild
+
+SEED_PASSWORD = 'seedpass'
+CATEGORIES = ['Fast Food', 'Italian', 'Indian', 'Chinese', 'Mexican', 'Desserts', 'Beverages', 'Salads']
+DISHES = ['Burger', 'Pizza', 'Curry', 'Noodles', 'Tacos', 'Cake', 'Smoothie', 'Salad', 'Wrap', 'Soup', 'Pasta', 'Rice Bowl']
+ADJECTIVES = ['Spicy', 'Classic', 'Smoky', 'Garlic', 'Cheesy', 'Crispy', 'Grilled', 'Vegan', 'Double', 'Mini']
+
+
+def seed(users=100, food_items=50, orders=1000, max_lines=4, days=90, batch_size=1000, random_seed=0, stdout=None):
+    """
+    Bulk-insert synthetic customers, menu items and orders (with line items) for load tests and benchmarks.
+
+    The same arguments produce the same rows (dates are relative to now). Customers are seed_customer_<n> with SEED_PASSWORD.
+    Returns a dict of how many rows of each kind were created.
+    """
+    rng = random.Random(random_seed)
+    now = timezone.now()
+    # Hashing once keeps seeding fast; every seeded customer shares the password
+    password = make_password(SEED_PASSWORD)
+    start = CustomUser.objects.filter(username__startswith='seed_customer_').count()
+
+    with transaction.atomic():
+        customers = CustomUser.objects.bulk_create([
+            CustomUser(
+                username=f'seed_customer_{n}', email=f'seed_customer_{n}@example.com',
+                password=password, is_customer=True,
+            )
+            for n in range(start, start + users)
+        ], batch_size=batch_size)
+
+        menu = []
+        for n in range(food_items):
+            category = rng.choice(CATEGORIES)
+            menu.append(FoodItem(
+                name=f'{rng.choice(ADJECTIVES)} {rng.choice(DISHES)} {n}',
+                description=f'Seeded {category.lower()} dish',
+                price=Decimal(rng.randint(199, 2999)) / 100,
+                category=category,
+                # bulk_create skips save(), which normally fills this in
+                category_normalized=FoodItem.normalize_category(category),
+                availability=rng.random() > 0.1,
+            ))
+        menu = FoodItem.objects.bulk_create(menu, batch_size=batch_size)
+
+        created = {'users': len(customers), 'food_items': len(menu)}
+        # With no new customers or items, place the orders against the existing ones
+        customers = customers or list(CustomUser.objects.filter(is_customer=True))
+        menu = menu or list(FoodItem.objects.all())
+        created_orders = created_lines = 0
+        if customers and menu:
+            for offset in range(0, orders, batch_size):
+                baskets = [
+                    {item: rng.randint(1, 3) for item in rng.sample(menu, min(len(menu), rng.randint(1, max_lines)))}
+                    for _ in range(min(batch_size, orders - offset))
+                ]
+                batch = Order.objects.bulk_create([
+                    Order(
+                        customer=rng.choice(customers),
+                        total_price=sum(item.price * quantity for item, quantity in basket.items()),
+                        status=rng.choices(['completed', 'pending', 'cancelled'], weights=[80, 15, 5])[0],
+                        created_at=now - timedelta(seconds=rng.randint(0, days * 24 * 60 * 60)),
+                    )
+                    for basket in baskets
+                ])
+                lines = OrderItem.objects.bulk_create([
+                    OrderItem(order=order, food_item=item, quantity=quantity, unit_price=item.price)
+                    for order, basket in zip(batch, baskets)
+                    for item, quantity in basket.items()
+                ], batch_size=batch_size)
+                created_orders += len(batch)
+                created_lines += len(lines)
+                if stdout is not None:
+                    stdout.write(f"Orders: {created_orders}/{orders}")
+
+        # bulk_create sends no signals and skips place_orders(), so refresh the derived state by hand
+        if created_orders:
+            rebuild_rollups(timezone.localdate(now - timedelta(days=days)), timezone.localdate(now))
+        transaction.on_commit(bump_menu_version)
+        transaction.on_commit(request_rebuild)
+
+    return dict(created, orders=created_orders, order_items=created_lines)
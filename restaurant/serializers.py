@@ -1,53 +1,146 @@
 #serializers.py
 
+from decimal import Decimal
+
 from rest_framework import serializers
-from .models import CustomUser, FoodItem, Order
+from rest_framework_simplejwt.exceptions import InvalidToken
+from rest_framework_simplejwt.serializers import TokenRefreshSerializer
+from .models import ClaimsUser, CustomUser, FoodItem, Order, OrderItem
+from .orders import merge_quantities, place_orders
+from .authentication import set_role_claims, user_from_claims_enabled
+from .fieldsets import SparseFieldsetSerializerMixin
+from .images import variant_urls
+from .revocation import revocation_list, revoke_tokens
 
 class UserSerializer(serializers.ModelSerializer):
+    profile_image_variants = serializers.SerializerMethodField()
+
     class Meta:
         model = CustomUser
-        fields = ('username', 'email', 'password', 'is_customer', 'is_admin','profile_image')
+        fields = ('username', 'email', 'password', 'is_customer', 'is_admin','profile_image', 'profile_image_variants')
         extra_kwargs = {'password': {'write_only': True}}
 
+    def get_profile_image_variants(self, obj):
+        """Resized and WebP copies of the profile image, once the image worker has made them."""
+        return variant_urls(obj.image_variants, self.context.get('request'))
+
     def create(self, validated_data):
         user = CustomUser.objects.create_user(**validated_data)
         return user
 
-class FoodItemSerializer(serializers.ModelSerializer):
+class FoodItemSerializer(SparseFieldsetSerializerMixin, serializers.ModelSerializer):
+    # {'thumb': {'width': .., 'height': .., 'jpg': url, 'webp': url}, 'medium': {...}, ...}
+    image_variants = serializers.SerializerMethodField()
+
     class Meta:
         model = FoodItem
-        fields = '__all__'
+        exclude = ['category_normalized', 'search_vector', 'image_variants_source']  # Internal columns
+
+    def get_image_variants(self, obj):
+        """Resized and WebP copies of the image, once the image worker has made them."""
+        return variant_urls(obj.image_variants, self.context.get('request'))
+
+
+class FoodItemCompactSerializer(FoodItemSerializer):
+    """What a menu list or item picker shows (?view=compact): no description or images."""
+    image_variants = None
 
+    class Meta(FoodItemSerializer.Meta):
+        exclude = None
+        fields = ['id', 'name', 'price', 'category', 'availability']
 
-class OrderSerializer(serializers.ModelSerializer):
-    # Calculate total_price using a SerializerMethodField
-    total_price = serializers.SerializerMethodField()
+
+class OrderItemSerializer(serializers.ModelSerializer):
+    food_item = serializers.PrimaryKeyRelatedField(queryset=FoodItem.objects.all())
+    quantity = serializers.IntegerField(min_value=1, default=1)
+
+    class Meta:
+        model = OrderItem
+        fields = ['food_item', 'quantity', 'unit_price']
+        read_only_fields = ['unit_price']
+
+
+class OrderSerializer(SparseFieldsetSerializerMixin, serializers.ModelSerializer):
+    # Items can be sent as a flat list of ids (one unit each) or as line_items with quantities
+    items = serializers.PrimaryKeyRelatedField(many=True, queryset=FoodItem.objects.all(), required=False)
+    line_items = OrderItemSerializer(source='order_items', many=True, required=False)
     customer = serializers.PrimaryKeyRelatedField(read_only=True)  # Automatically set customer
 
     class Meta:
         model = Order
-        fields = ['id', 'items', 'total_price', 'status', 'customer']  # Include total_price, status, and customer
+        fields = ['id', 'items', 'line_items', 'total_price', 'status', 'customer', 'version']
+        read_only_fields = ['total_price', 'version']
 
-    def get_total_price(self, obj):
-        """Calculate total price of the order from its items."""
-        return sum(item.price for item in obj.items.all())  # Calculate total price based on items associated with the order
+    def validate(self, attrs):
+        if self.instance is None and not attrs.get('items') and not attrs.get('order_items'):
+            raise serializers.ValidationError("An order needs at least one item.")
+        return attrs
 
     def create(self, validated_data):
-        """Override the create method to automatically handle total_price, status, and customer"""
-        items = validated_data.get('items')
+        """Create the order, its line items and the stored total in a single transaction."""
+        quantities = merge_quantities(
+            validated_data.get('items', []),
+            [(line['food_item'], line['quantity']) for line in validated_data.get('order_items', [])],
+        )
+        customer = validated_data.get('customer', self.context['request'].user)
+        return place_orders(customer, [quantities])[0]
 
-        # Calculate total price based on the items
-        total_price = sum(item.price for item in items)
 
-        # Create the order instance with the validated data
-        order = Order.objects.create(
-            customer=self.context['request'].user,  # Automatically set the customer from the request
-            total_price=total_price,
-            status='pending'  # Default status is 'pending'
-        )
+class OrderCompactSerializer(OrderSerializer):
+    """Order summaries without their items (?view=compact), read with no prefetch queries."""
+    items = None
+    line_items = None
+
+    class Meta(OrderSerializer.Meta):
+        fields = ['id', 'total_price', 'status', 'customer', 'version']
+
+
+class OrderStatusSerializer(serializers.Serializer):
+    """A status change; version (or an If-Match header) makes it fail if the order changed since it was read."""
+    status = serializers.ChoiceField(choices=Order.STATUS_CHOICES)
+    version = serializers.IntegerField(min_value=0, required=False)
+
+
+class BulkOrderLineSerializer(serializers.Serializer):
+    food_item = serializers.IntegerField(min_value=1)
+    quantity = serializers.IntegerField(min_value=1, default=1)
+
+
+class BulkOrderEntrySerializer(serializers.Serializer):
+    """Shape of one order in a bulk request; item ids are resolved together by the view."""
+    items = serializers.ListField(child=serializers.IntegerField(min_value=1), required=False, default=list)
+    line_items = BulkOrderLineSerializer(many=True, required=False, default=list)
+
+    def validate(self, attrs):
+        if not attrs['items'] and not attrs['line_items']:
+            raise serializers.ValidationError("An order needs at least one item.")
+        return attrs
+
+
+class MenuImportRowSerializer(serializers.Serializer):
+    """One row of a menu import, matched to existing items by name; omitted optional fields are left as they are."""
+    name = serializers.CharField(max_length=100)
+    description = serializers.CharField(required=False, allow_blank=True, allow_null=True)
+    price = serializers.DecimalField(max_digits=10, decimal_places=2, min_value=Decimal('0'))
+    category = serializers.CharField(max_length=50)
+    availability = serializers.BooleanField(required=False)
+
 
-        # Associate the items with the order
-        order.items.set(items)
-        order.save()  # Save the order with its items and total price
+class RevokingTokenRefreshSerializer(TokenRefreshSerializer):
+    """Refuse revoked refresh tokens, revoke each one as it is rotated, and refresh role claims if they're in use."""
 
-        return order
\ No newline at end of file
+    def validate(self, attrs):
+        refresh = self.token_class(attrs['refresh'])
+        if revocation_list.is_revoked(refresh['jti']):
+            raise InvalidToken("Token has been revoked.")
+        data = super().validate(attrs)
+        if user_from_claims_enabled():
+            # Re-read the roles, so a changed role reaches the new tokens instead of being copied forward
+            token = self.token_class(data['refresh']) if 'refresh' in data else refresh
+            set_role_claims(token, CustomUser.objects.only(*ClaimsUser.CLAIM_FIELDS).get(pk=refresh['user_id']))
+            data['access'] = str(token.access_token)
+            if 'refresh' in data:
+                data['refresh'] = str(token)
+        if 'refresh' in data:
+            revoke_tokens(refresh)
+        return data
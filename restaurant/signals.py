@@ -1,17 +1,46 @@
-from django.db.models.signals import post_save
+from django.db import transaction
+from django.db.backends.signals import connection_created
+from django.db.models.signals import post_delete, post_migrate, post_save
 from django.dispatch import receiver
-from django.core.mail import send_mail
-from django.conf import settings
-from .models import Order
+from .authentication import user_cache
+from .events import publish_order_event
+from .menu_cache import bump_menu_version
+from .metrics import install_query_timer
+from .models import ClaimsUser, CustomUser, FoodItem, Order
+from .outbox import enqueue_order_status_email
+from .search import install_search_support
 
 @receiver(post_save, sender=Order)
 def send_order_update_email(sender, instance, created, **kwargs):
     if not created:  # Only send email on update
-        customer_email = instance.customer.email
-        send_mail(
-            'Your Order Status Has Been Updated',
-            f'Hello {instance.customer.username},\n\nYour order status has been updated to: {instance.status}.',
-            settings.DEFAULT_FROM_EMAIL,
-            [customer_email],
-            fail_silently=False,
-        )
+        # Queued in the caller's transaction; the outbox worker delivers it
+        enqueue_order_status_email(instance)
+
+@receiver(post_save, sender=Order)
+def publish_order_status(sender, instance, created, update_fields=None, **kwargs):
+    if not created and (update_fields is None or 'status' in update_fields):
+        publish_order_event(instance, 'order.status')
+
+@receiver(post_save, sender=CustomUser)
+@receiver(post_delete, sender=CustomUser)
+@receiver(post_save, sender=ClaimsUser)  # Signals name the proxy class when a claims user is saved
+def invalidate_cached_user(sender, instance, **kwargs):
+    # Drop it now and again after commit, so a concurrent request can't re-cache the pre-commit row
+    user_cache.invalidate(instance.pk)
+    transaction.on_commit(lambda: user_cache.invalidate(instance.pk))
+
+@receiver(post_save, sender=FoodItem)
+@receiver(post_delete, sender=FoodItem)
+def invalidate_menu_cache(sender, instance, **kwargs):
+    # Bump after commit as well, so nothing cached from the pre-commit snapshot outlives the change
+    bump_menu_version()
+    transaction.on_commit(bump_menu_version)
+
+@receiver(post_migrate)
+def install_menu_search(sender, using='default', **kwargs):
+    # Trigger and GIN indexes for full-text search on PostgreSQL; a backfill of normalized categories elsewhere
+    if sender.name == 'restaurant':
+        install_search_support(using)
+
+# Count and time every SQL query for the per-view metrics, without relying on DEBUG
+connection_created.connect(install_query_timer)
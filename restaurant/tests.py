@@ -1,7 +1,48 @@
+import asyncio
+import base64
+import csv
+import json
+import os
+import tempfile
+import time
+from datetime import timedelta
+from decimal import Decimal
+from io import BytesIO, StringIO
+from unittest import mock
+import msgpack
+from asgiref.sync import sync_to_async
 from django.contrib.auth import get_user_model
+from django.core import mail
+from django.core.cache import cache
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.core.management import call_command
+from django.db import connection
+from django.http import HttpResponse
+from django.test import AsyncRequestFactory, RequestFactory, SimpleTestCase, TransactionTestCase, override_settings
+from django.db.models.functions import Now
+from django.test.utils import CaptureQueriesContext
+from django.utils import timezone
+from PIL import Image as PILImage
+from rest_framework.renderers import JSONRenderer
 from rest_framework.test import APITestCase
 from rest_framework import status
-from .models import FoodItem, Order
+from rest_framework_simplejwt.tokens import AccessToken
+from . import analytics, async_views, urls, views
+from .benchmarks import SCENARIOS, budget_violations, regressions, run_benchmarks
+from .db_router import PrimaryReplicaRouter, reading_from_replica, replica_reads
+from .middleware import PRIMARY_PIN_COOKIE, ReplicaRoutingMiddleware
+from .authentication import UserCache, user_cache
+from .models import ClaimsUser, DailyItemSales, DailyStatusSales, FoodItem, IdempotencyKey, Order, OrderItem, OutboundEmail, RevokedToken
+from .orders import place_orders
+from .outbox import MAX_ATTEMPTS, deliver_batch, enqueue_email
+from .recommendations import RecommendationEngine, recommendation_engine, request_rebuild
+from .revocation import BloomFilter, revocation_list
+from .menu_import import import_menu
+from .metrics import TOTALS_FILENAME, MetricsRegistry, fold_process_metrics, metrics_registry
+from .renderers import ORJSONRenderer
+from .images import content_hashed_storage, process_instance, process_pending_images, serve_media
+from .search import POSTGRES_SEARCH_SQL, search_menu
+from .seeding import seed
 
 User = get_user_model()
 
@@ -9,6 +50,8 @@ class RestaurantAPITestCase(APITestCase):
 
     def setUp(self):
         """Set up test users and sample food items."""
+        cache.clear()  # Rate-limit buckets live in the cache
+
         # Create an admin user
         self.admin_user = User.objects.create_superuser(
             username="admin", email="admin@example.com", password="adminpass", is_admin=True, is_customer=False
@@ -58,6 +101,129 @@ class RestaurantAPITestCase(APITestCase):
         response = self.client.post("/api/logout/")
         self.assertEqual(response.status_code, status.HTTP_200_OK)
 
+    @override_settings(REST_FRAMEWORK={"DEFAULT_THROTTLE_RATES": {"login_ip": "100/min", "login_username": "3/min"}})
+    def test_login_is_throttled_per_username(self):
+        """Test that failed logins drain the username's bucket, then get a 429 with Retry-After."""
+        for _ in range(3):
+            response = self.client.post("/api/login/", {"username": "Customer", "password": "wrong"})
+            self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        response = self.client.post("/api/login/", {"username": "customer", "password": "customerpass"})
+        self.assertEqual(response.status_code, status.HTTP_429_TOO_MANY_REQUESTS)
+        self.assertGreaterEqual(int(response["Retry-After"]), 1)
+        # Other accounts are unaffected
+        response = self.client.post("/api/login/", {"username": "admin", "password": "adminpass"})
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+
+    def test_login_sheds_load_when_password_hashing_is_saturated(self):
+        """Test that a login that can't get a hashing slot is answered with 503 instead of queueing."""
+        with mock.patch("restaurant.throttling._hashing_slots.acquire", return_value=False):
+            response = self.client.post("/api/login/", {"username": "customer", "password": "customerpass"})
+        self.assertEqual(response.status_code, status.HTTP_503_SERVICE_UNAVAILABLE)
+        self.assertEqual(response["Retry-After"], "1")
+
+    def test_logout_revokes_tokens(self):
+        """Test that the access and refresh tokens stop working after logout, even if kept."""
+        self.authenticate(self.customer_user)
+        access, refresh = self.client.cookies["access_token"].value, self.client.cookies["refresh_token"].value
+        self.client.post("/api/logout/")
+        self.client.cookies["access_token"] = access
+        response = self.client.get("/api/users/me/")
+        self.assertEqual(response.status_code, status.HTTP_403_FORBIDDEN)
+        response = self.client.post("/api/token/refresh/", {"refresh": refresh})
+        self.assertEqual(response.status_code, status.HTTP_401_UNAUTHORIZED)
+
+    def test_rotated_refresh_token_is_single_use(self):
+        """Test that refreshing returns a new refresh token and revokes the old one."""
+        self.authenticate(self.customer_user)
+        refresh = self.client.cookies["refresh_token"].value
+        response = self.client.post("/api/token/refresh/", {"refresh": refresh})
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertNotEqual(response.data["refresh"], refresh)
+        response = self.client.post("/api/token/refresh/", {"refresh": refresh})
+        self.assertEqual(response.status_code, status.HTTP_401_UNAUTHORIZED)
+
+    def test_revocation_check_needs_no_query_for_valid_tokens(self):
+        """Test that unrevoked tokens are answered from the in-process filter, which has no false negatives."""
+        bloom = BloomFilter(1000)
+        bloom.update(f"jti-{n}" for n in range(1000))
+        self.assertTrue(all(f"jti-{n}" in bloom for n in range(1000)))
+        self.assertLess(sum(f"other-{n}" in bloom for n in range(10000)), 50)
+
+        revocation_list.sync(rebuild=True)
+        with self.assertNumQueries(0):
+            self.assertFalse(revocation_list.is_revoked("not-revoked"))
+
+    def test_revocation_sync_ignores_the_app_clock(self):
+        """Test that a process whose clock runs ahead still picks up revocations made by others."""
+        expires_at = timezone.now() + timedelta(hours=1)
+        RevokedToken.objects.create(jti="earlier", token_type="access", expires_at=expires_at, revoked_at=Now())
+        with mock.patch("django.utils.timezone.now", return_value=timezone.now() + timedelta(minutes=10)):
+            revocation_list.sync(rebuild=True)
+            # Revoked by another process, stamped with the database's time
+            RevokedToken.objects.create(jti="later", token_type="access", expires_at=expires_at, revoked_at=Now())
+            revocation_list.sync()
+        self.assertTrue(revocation_list.is_revoked("later"))
+
+    @override_settings(AUTH_USER_FROM_CLAIMS=True)
+    def test_claims_authentication_skips_user_lookup(self):
+        """Test that with role claims in the token, order reads never load the user row."""
+        self.authenticate(self.customer_user)
+        user_cache.clear()
+        revocation_list.sync(rebuild=True)
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get("/api/orders/")
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertFalse([query for query in queries if "restaurant_customuser" in query["sql"]])
+
+        response = self.client.get("/api/users/me/")  # Needs the full profile
+        self.assertEqual(response.data["email"], "customer@example.com")
+
+    def test_claims_user_loads_remaining_fields_at_once(self):
+        """Test that reading a field the claims don't carry loads the whole row in one query."""
+        token = AccessToken.for_user(self.admin_user)
+        for field in ClaimsUser.CLAIM_FIELDS:
+            token[field] = getattr(self.admin_user, field)
+        user = ClaimsUser.from_claims(token)
+        with self.assertNumQueries(0):
+            self.assertTrue(user.is_admin and user.is_staff and not user.is_customer)
+        with self.assertNumQueries(1):
+            self.assertEqual((user.email, user.username, user.password), (self.admin_user.email, "admin", self.admin_user.password))
+
+    @override_settings(AUTH_USER_FROM_CLAIMS=True)
+    def test_refresh_picks_up_role_changes(self):
+        """Test that a refreshed access token carries the user's current roles, not the login-time ones."""
+        self.authenticate(self.admin_user)
+        User.objects.filter(pk=self.admin_user.pk).update(is_admin=False, is_staff=False)
+        response = self.client.post("/api/token/refresh/", {"refresh": self.client.cookies["refresh_token"].value})
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertFalse(AccessToken(response.data["access"])["is_admin"])
+
+    def test_authentication_uses_user_cache(self):
+        """Test that repeated requests resolve the user without a database query."""
+        self.authenticate(self.customer_user)
+        self.client.get("/api/users/me/")
+        with self.assertNumQueries(0):
+            response = self.client.get("/api/users/me/")
+        self.assertEqual(response.data["username"], "customer")
+
+    def test_user_cache_invalidated_on_save(self):
+        """Test that saving a user evicts the cached copy."""
+        self.authenticate(self.customer_user)
+        self.client.get("/api/users/me/")
+        self.customer_user.email = "changed@example.com"
+        self.customer_user.save()
+        response = self.client.get("/api/users/me/")
+        self.assertEqual(response.data["email"], "changed@example.com")
+
+    def test_user_cache_invalidation_reaches_other_processes(self):
+        """Test that with a shared cache alias (REDIS_URL), a change made in one worker is seen by the others."""
+        worker, other_worker = (UserCache(cache_alias="default", local_ttl=0) for _ in range(2))
+        self.assertTrue(other_worker.get(self.customer_user.id).is_customer)
+        self.customer_user.is_customer = False
+        self.customer_user.save()
+        worker.invalidate(self.customer_user.id)
+        self.assertFalse(other_worker.get(self.customer_user.id).is_customer)
+
     # ✅ USER MANAGEMENT TESTS
     def test_get_user_profile(self):
         """Test retrieving user profile."""
@@ -109,6 +275,160 @@ class RestaurantAPITestCase(APITestCase):
         response = self.client.delete(f"/api/food-items/{self.food_item1.id}/")
         self.assertEqual(response.status_code, status.HTTP_204_NO_CONTENT)
 
+    # ✅ MENU CACHE TESTS
+    def test_menu_etag_returns_304_without_queries(self):
+        """Test that a matching If-None-Match is answered without touching the database."""
+        self.authenticate(self.customer_user)
+        response = self.client.get("/api/food-items/?category=Italian")
+        etag = response["ETag"]
+        with self.assertNumQueries(0):
+            response = self.client.get("/api/food-items/?category=italian", HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, status.HTTP_304_NOT_MODIFIED)
+
+    def test_menu_cache_invalidated_on_change(self):
+        """Test that changing a food item moves the menu to a new version and ETag."""
+        self.authenticate(self.customer_user)
+        first = self.client.get("/api/food-items/")
+        with self.assertNumQueries(0):
+            self.assertEqual(self.client.get("/api/food-items/").data, first.data)
+
+        self.food_item2.price = 16.0
+        self.food_item2.save()
+        second = self.client.get("/api/food-items/", HTTP_IF_NONE_MATCH=first["ETag"])
+        self.assertEqual(second.status_code, status.HTTP_200_OK)
+        self.assertNotEqual(second["ETag"], first["ETag"])
+
+    @override_settings(REPLICA_DATABASE="replica")
+    def test_menu_caches_are_not_filled_from_replica(self):
+        """Test that after a menu change, a lagging replica's rows are never cached under the new version."""
+        stale_reads = []
+
+        def db_for_read(router, model, **hints):
+            # Stands in for a replica that hasn't seen the change yet; it must not be read at all
+            if model is FoodItem and reading_from_replica():
+                stale_reads.append(model)
+            return "default"
+
+        self.authenticate(self.customer_user)
+        self.client.cookies.pop(PRIMARY_PIN_COOKIE, None)  # Set by the login; lets these reads go to the replica
+        with mock.patch.object(PrimaryReplicaRouter, "db_for_read", db_for_read):
+            self.client.get("/api/food-items/")
+            self.food_item2.price = 16.0
+            self.food_item2.save()
+            response = self.client.get("/api/food-items/")
+            self.client.get(f"/api/food-items/{self.food_item2.id}/")
+            self.client.get("/api/food-items/facets/")
+            self.client.get("/api/recommendations/")
+        self.assertEqual(stale_reads, [])
+        self.assertIn(Decimal("16.00"), [Decimal(str(item["price"])) for item in response.data["results"]])
+
+    # ✅ IMAGE PIPELINE TESTS
+    def make_image(self, name="dish.png", size=(800, 600)):
+        buffer = BytesIO()
+        PILImage.new("RGB", size, "orange").save(buffer, "PNG")
+        return SimpleUploadedFile(name, buffer.getvalue(), content_type="image/png")
+
+    def test_food_image_variants_generated_off_request(self):
+        """Test that uploads are stored by content hash and resized by the image worker."""
+        with tempfile.TemporaryDirectory() as media_root, self.settings(MEDIA_ROOT=media_root):
+            self.authenticate(self.admin_user)
+            data = {"name": "Tacos", "price": 9.0, "category": "Mexican", "image": self.make_image()}
+            response = self.client.post("/api/food-items/", data, format="multipart")
+            self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+            self.assertEqual(response.data["image_variants"], {})
+            item = FoodItem.objects.get(id=response.data["id"])
+            self.assertRegex(item.image.name, r"^food_images/[0-9a-f]{64}\.png$")
+
+            self.assertEqual(process_pending_images(), 1)
+            self.assertEqual(process_pending_images(), 0)
+            item.refresh_from_db()
+            self.assertEqual((item.image_variants["thumb"]["width"], item.image_variants["thumb"]["height"]), (160, 120))
+            with PILImage.open(os.path.join(media_root, item.image_variants["thumb"]["webp"])) as thumb:
+                self.assertEqual(thumb.format, "WEBP")
+
+            response = self.client.get(f"/api/food-items/{item.id}/")
+            self.assertTrue(response.data["image_variants"]["medium"]["webp"].startswith("http://testserver/media/"))
+
+            # New sizes write new files; the old path (served as immutable) keeps its bytes
+            old_thumb = item.image_variants["thumb"]["webp"]
+            with open(os.path.join(media_root, old_thumb), "rb") as f:
+                old_bytes = f.read()
+            with mock.patch("restaurant.images.IMAGE_VARIANT_SIZES", {"thumb": 80}):
+                process_instance(item, "image")
+            self.assertNotEqual(item.image_variants["thumb"]["webp"], old_thumb)
+            self.assertRegex(item.image_variants["thumb"]["webp"], r"/variants/[0-9a-f]{64}/thumb\.[0-9a-f]{16}\.webp$")
+            with open(os.path.join(media_root, old_thumb), "rb") as f:
+                self.assertEqual(f.read(), old_bytes)
+
+    def test_hashed_media_served_as_immutable(self):
+        """Test that content-hashed media gets a long-lived immutable Cache-Control header."""
+        with tempfile.TemporaryDirectory() as media_root, self.settings(MEDIA_ROOT=media_root):
+            name = content_hashed_storage.save("food_images/dish.png", self.make_image())
+            request = RequestFactory().get(f"/media/{name}")
+            response = serve_media(request, name)
+            self.assertIn("immutable", response["Cache-Control"])
+
+    def test_admin_can_import_menu(self):
+        """Test that an import creates new items, updates matched ones and reports the diff."""
+        self.authenticate(self.admin_user)
+        data = [
+            {"name": "Burger", "price": "12.00", "category": "Fast Food"},
+            {"name": "Pumpkin Soup", "price": "6.50", "category": " Seasonal  Specials", "description": "Autumn only"},
+        ]
+        revocation_list.sync()  # Not due for another sync during the request
+        # User lookup, existing items, one bulk INSERT and one bulk UPDATE, plus the savepoint pair
+        with self.assertNumQueries(6):
+            response = self.client.post("/api/food-items/import/", data, format="json")
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response.data["created"], ["Pumpkin Soup"])
+        self.assertEqual(response.data["updated"][0]["changes"], {"price": [Decimal("10.00"), Decimal("12.00")]})
+        self.assertEqual(response.data["unchanged"], 0)
+        soup = FoodItem.objects.get(name="Pumpkin Soup")
+        self.assertEqual(soup.category_normalized, "seasonal specials")
+        self.assertEqual(FoodItem.objects.get(id=self.food_item1.id).price, Decimal("12.00"))
+
+    def test_menu_import_refreshes_cached_menu(self):
+        """Test that cached menu pages are invalidated once the import commits."""
+        self.authenticate(self.customer_user)
+        self.client.get("/api/food-items/")
+        with self.captureOnCommitCallbacks(execute=True):
+            import_menu([{"name": "Pizza", "price": "16.00", "category": "Italian"}])
+        response = self.client.get("/api/food-items/")
+        prices = {item["name"]: item["price"] for item in response.data["results"]}
+        self.assertEqual(prices["Pizza"], "16.00")
+
+    def test_menu_import_rejects_invalid_rows(self):
+        """Test that one bad row stops the whole import."""
+        self.authenticate(self.admin_user)
+        upload = SimpleUploadedFile(
+            "menu.csv", b"name,price,category\nTacos,7.00,Mexican\nBroken,not-a-price,Mexican\n", content_type="text/csv"
+        )
+        response = self.client.post("/api/food-items/import/", {"file": upload}, format="multipart")
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertEqual(response.data["errors"][0]["row"], 2)
+        self.assertFalse(FoodItem.objects.filter(name="Tacos").exists())
+        response = self.client.post("/api/food-items/import/", [{"name": "Tacos", "price": "-0.01"}], format="json")
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
+    def test_customer_cannot_import_menu(self):
+        """Test that only admins can import menus."""
+        self.authenticate(self.customer_user)
+        response = self.client.post("/api/food-items/import/", [], format="json")
+        self.assertEqual(response.status_code, status.HTTP_403_FORBIDDEN)
+
+    def test_import_menu_command(self):
+        """Test the import command's dry run and deactivation of missing items."""
+        with tempfile.NamedTemporaryFile("w", suffix=".json", delete=False) as menu_file:
+            json.dump({"items": [{"name": "Burger", "price": "10.00", "category": "Fast Food"}]}, menu_file)
+        try:
+            call_command("import_menu", menu_file.name, "--dry-run", "--deactivate-missing", stdout=StringIO())
+            self.assertTrue(FoodItem.objects.get(name="Pizza").availability)
+            call_command("import_menu", menu_file.name, "--deactivate-missing", stdout=StringIO())
+        finally:
+            os.remove(menu_file.name)
+        self.assertFalse(FoodItem.objects.get(name="Pizza").availability)
+        self.assertTrue(FoodItem.objects.get(name="Burger").availability)
+
     # ✅ ORDER MANAGEMENT TESTS
     def test_customer_can_place_order(self):
         """Test that a customer can place an order."""
@@ -139,6 +459,409 @@ class RestaurantAPITestCase(APITestCase):
         self.assertEqual(response.status_code, status.HTTP_200_OK)
         self.assertEqual(response.data["status"], "completed")
 
+    def test_idempotency_key_replays_order_creation(self):
+        """Test that a retried POST with the same Idempotency-Key returns the first order instead of a new one."""
+        self.authenticate(self.customer_user)
+        data = {"items": [self.food_item1.id]}
+        first = self.client.post("/api/orders/", data, format="json", HTTP_IDEMPOTENCY_KEY="order-1")
+        self.assertEqual(first.status_code, status.HTTP_201_CREATED)
+        retry = self.client.post("/api/orders/", data, format="json", HTTP_IDEMPOTENCY_KEY="order-1")
+        self.assertEqual(retry.status_code, status.HTTP_201_CREATED)
+        self.assertEqual(retry["Idempotent-Replayed"], "true")
+        self.assertEqual(retry.json()["id"], first.data["id"])
+        self.assertEqual(Order.objects.count(), 1)
+
+        other = self.client.post("/api/orders/", {"items": [self.food_item2.id]}, format="json", HTTP_IDEMPOTENCY_KEY="order-1")
+        self.assertEqual(other.status_code, status.HTTP_422_UNPROCESSABLE_ENTITY)
+
+    def test_failed_order_does_not_consume_idempotency_key(self):
+        """Test that a rejected request leaves the key free, and that expired keys are purged."""
+        self.authenticate(self.customer_user)
+        response = self.client.post("/api/orders/", {"items": []}, format="json", HTTP_IDEMPOTENCY_KEY="order-2")
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertFalse(IdempotencyKey.objects.exists())
+        response = self.client.post("/api/orders/", {"items": [self.food_item1.id]}, format="json", HTTP_IDEMPOTENCY_KEY="order-2")
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+
+        IdempotencyKey.objects.update(expires_at=timezone.now() - timedelta(seconds=1))
+        out = StringIO()
+        call_command("purge_idempotency_keys", stdout=out)
+        self.assertIn("Deleted 1", out.getvalue())
+        self.assertFalse(IdempotencyKey.objects.exists())
+
+    @override_settings(REST_FRAMEWORK={"DEFAULT_THROTTLE_RATES": {"orders_user": "2/min"}})
+    def test_order_creation_is_throttled_per_customer(self):
+        """Test that a customer's order bucket runs dry while reads stay unthrottled."""
+        self.authenticate(self.customer_user)
+        for _ in range(2):
+            response = self.client.post("/api/orders/", {"items": [self.food_item1.id]}, format="json")
+            self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+        response = self.client.post("/api/orders/", {"items": [self.food_item1.id]}, format="json")
+        self.assertEqual(response.status_code, status.HTTP_429_TOO_MANY_REQUESTS)
+        self.assertEqual(self.client.get("/api/orders/").status_code, status.HTTP_200_OK)
+
+    def test_stale_order_version_conflicts(self):
+        """Test that of two updates made against the same version, the second gets a 409."""
+        order = Order.objects.create(customer=self.customer_user, total_price=10)
+        self.authenticate(self.admin_user)
+        first = self.client.patch(f"/api/orders/{order.id}/", {"status": "completed"}, format="json", HTTP_IF_MATCH='"0"')
+        self.assertEqual(first.status_code, status.HTTP_200_OK)
+        self.assertEqual((first.data["version"], first["ETag"]), (1, '"1"'))
+
+        second = self.client.patch(f"/api/orders/{order.id}/", {"status": "cancelled", "version": 0}, format="json")
+        self.assertEqual(second.status_code, status.HTTP_409_CONFLICT)
+        self.assertEqual((second.data["status"], second.data["version"]), ("completed", 1))
+        self.assertEqual(Order.objects.get(id=order.id).status, "completed")
+
+    def test_order_status_transitions_are_enforced(self):
+        """Test that final statuses can't change, and repeating the current status is a no-op."""
+        order = Order.objects.create(customer=self.customer_user, total_price=10, status="completed")
+        self.authenticate(self.admin_user)
+        response = self.client.put(f"/api/orders/{order.id}/", {"status": "pending"}, format="json")
+        self.assertEqual(response.status_code, status.HTTP_409_CONFLICT)
+
+        response = self.client.patch(f"/api/orders/{order.id}/", {"status": "completed"}, format="json")
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response.data["version"], 0)
+        self.assertEqual(OutboundEmail.objects.count(), 0)
+
+    def test_admin_site_changes_orders_through_orders_module(self):
+        """Test that the admin can't edit an order's status or lines directly and that its actions update the rollups."""
+        self.authenticate(self.customer_user)
+        order_id = self.client.post("/api/orders/", {"items": [self.food_item1.id]}, format="json").data["id"]
+        self.client.force_login(self.admin_user)
+        response = self.client.get(f"/admin/restaurant/order/{order_id}/change/")
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        for field in ('name="status"', 'name="total_price"', 'name="version"', 'name="order_items-0-quantity"'):
+            self.assertNotContains(response, field)
+
+        self.client.post("/admin/restaurant/order/", {"action": "mark_cancelled", "_selected_action": [order_id]})
+        order = Order.objects.get(pk=order_id)
+        self.assertEqual((order.status, order.version), ("cancelled", 1))
+        self.assertEqual(dict(DailyStatusSales.objects.values_list("status", "order_count")), {"pending": 0, "cancelled": 1})
+        self.assertEqual(DailyItemSales.objects.get().quantity, 0)
+
+        self.client.post("/admin/restaurant/order/", {"action": "delete_selected", "_selected_action": [order_id], "post": "yes"})
+        self.assertFalse(Order.objects.filter(pk=order_id).exists())
+        self.assertEqual(DailyStatusSales.objects.get(status="cancelled").order_count, 0)
+
+    def test_order_status_update_query_count(self):
+        """Test that a status change is one conditional UPDATE plus the reads for the response and the email."""
+        order = Order.objects.create(customer=self.customer_user, total_price=10)
+        self.authenticate(self.admin_user)
+        self.client.get("/api/users/me/")  # Warm the user cache
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.patch(f"/api/orders/{order.id}/", {"status": "cancelled"}, format="json")
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        updates = [query["sql"] for query in queries if query["sql"].startswith("UPDATE")]
+        self.assertEqual(len(updates), 1)
+        self.assertLessEqual(len(queries), 11)  # Including the outbox insert, sales rollup upsert and test-case savepoints
+
+    def test_orjson_renderer_matches_stdlib_json(self):
+        """Test that the orjson renderer produces the same body as DRF's JSON renderer, Decimals included."""
+        data = {"price": Decimal("10.50"), "at": timezone.now(), "name": "Burger\u2028", "ids": (1, 2), 3: None}
+        self.assertEqual(ORJSONRenderer().render(data), JSONRenderer().render(data))
+
+        self.authenticate(self.customer_user)
+        response = self.client.get("/api/food-items/")
+        self.assertEqual(response["Content-Type"], "application/json")
+        self.assertEqual(json.loads(response.content)["results"][0]["name"], "Burger")
+
+    def test_msgpack_requests_and_responses(self):
+        """Test that orders can be placed and read as MessagePack."""
+        self.authenticate(self.customer_user)
+        response = self.client.post("/api/orders/", msgpack.packb({"items": [self.food_item1.id, self.food_item1.id]}),
+                                    content_type="application/msgpack", HTTP_ACCEPT="application/msgpack")
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+        self.assertEqual(response["Content-Type"], "application/msgpack")
+        self.assertEqual(Decimal(str(msgpack.unpackb(response.content)["total_price"])), Decimal("20.00"))
+
+        response = self.client.get("/api/orders/", HTTP_ACCEPT="application/msgpack")
+        self.assertEqual(msgpack.unpackb(response.content), json.loads(self.client.get("/api/orders/").content))
+
+        response = self.client.post("/api/orders/", b"\xc1", content_type="application/msgpack")
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
+    def test_sales_rollups_follow_orders(self):
+        """Test that placing, cancelling and deleting orders keeps the sales analytics current."""
+        self.authenticate(self.customer_user)
+        first = self.client.post("/api/orders/", {"items": [self.food_item1.id, self.food_item1.id, self.food_item2.id]}, format="json")
+        second = self.client.post("/api/orders/", {"items": [self.food_item2.id]}, format="json")
+        third = self.client.post("/api/orders/", {"items": [self.food_item1.id]}, format="json")
+        self.client.delete(f"/api/orders/{third.data['id']}/")
+
+        self.authenticate(self.admin_user)
+        self.client.patch(f"/api/orders/{first.data['id']}/", {"status": "completed"}, format="json")
+        self.client.patch(f"/api/orders/{second.data['id']}/", {"status": "cancelled"}, format="json")
+
+        with self.assertNumQueries(1):  # The rollup rows only; the admin comes from the user cache
+            response = self.client.get("/api/orders/analytics/daily/")
+        [day] = response.data["days"]
+        self.assertEqual((day["orders"], day["revenue"]), (1, Decimal("35.00")))
+        self.assertEqual(day["statuses"], {
+            "completed": {"orders": 1, "revenue": Decimal("35.00")},
+            "cancelled": {"orders": 1, "revenue": Decimal("15.00")},
+        })
+
+        response = self.client.get("/api/orders/analytics/top-items/")
+        self.assertEqual([(item["name"], item["quantity"], item["revenue"]) for item in response.data["items"]],
+                         [("Burger", 2, Decimal("20.00")), ("Pizza", 1, Decimal("15.00"))])
+
+    def test_sales_analytics_are_admin_only_and_validate_dates(self):
+        """Test that customers can't read analytics and that bad date ranges are rejected."""
+        self.authenticate(self.customer_user)
+        self.assertEqual(self.client.get("/api/orders/analytics/daily/").status_code, status.HTTP_403_FORBIDDEN)
+        self.authenticate(self.admin_user)
+        for query in ("start=yesterday", "start=2025-02-01&end=2025-01-01", "start=2020-01-01&end=2025-01-01"):
+            response = self.client.get(f"/api/orders/analytics/daily/?{query}")
+            self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        response = self.client.get("/api/orders/analytics/top-items/?by=price")
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
+    def test_backfill_sales_rollups_command(self):
+        """Test that the backfill rebuilds the rollups from orders written around place_orders()."""
+        now = timezone.now()
+        for days_ago, order_status in ((0, "completed"), (3, "Pending"), (3, "cancelled")):
+            order = Order.objects.create(customer=self.customer_user, total_price=20, status=order_status,
+                                         created_at=now - timedelta(days=days_ago))
+            OrderItem.objects.create(order=order, food_item=self.food_item1, quantity=2, unit_price=10)
+        DailyStatusSales.objects.create(day=timezone.localdate(now), status="pending", order_count=5, revenue=50)
+
+        out = StringIO()
+        call_command("backfill_sales_rollups", chunk_days=2, stdout=out)
+        self.assertIn("Rolled up 3 orders", out.getvalue())
+        self.assertEqual(
+            sorted(DailyStatusSales.objects.values_list("day", "status", "order_count")),
+            [(timezone.localdate(now - timedelta(days=3)), "cancelled", 1),
+             (timezone.localdate(now - timedelta(days=3)), "pending", 1),
+             (timezone.localdate(now), "completed", 1)],
+        )
+        self.assertEqual(
+            sorted(DailyItemSales.objects.values_list("day", "quantity", "revenue")),
+            [(timezone.localdate(now - timedelta(days=3)), 2, Decimal("20.00")), (timezone.localdate(now), 2, Decimal("20.00"))],
+        )
+
+    def test_rollup_rebuild_locks_out_live_upserts(self):
+        """Test that on PostgreSQL a rebuild locks both rollup tables against upserts (but not reads) first."""
+        with mock.patch.object(connection, "vendor", "postgresql"), mock.patch.object(connection, "cursor") as cursor:
+            analytics._lock_rollups()
+        cursor.return_value.__enter__.return_value.execute.assert_called_once_with(
+            'LOCK TABLE "restaurant_dailystatussales", "restaurant_dailyitemsales" IN SHARE ROW EXCLUSIVE MODE'
+        )
+
+    def test_order_line_items_and_total(self):
+        """Test that quantities are stored as line items and the total is computed once."""
+        self.authenticate(self.customer_user)
+        data = {"items": [self.food_item1.id], "line_items": [{"food_item": self.food_item2.id, "quantity": 2}]}
+        response = self.client.post("/api/orders/", data, format="json")
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+        self.assertEqual(response.data["total_price"], "40.00")
+        order = Order.objects.get(id=response.data["id"])
+        self.assertEqual(order.order_items.get(food_item=self.food_item2).quantity, 2)
+        self.assertEqual(order.recalculate_total(), Decimal("40.00"))
+
+    def test_order_list_query_count_is_constant(self):
+        """Test that listing orders does not issue per-order queries."""
+        self.authenticate(self.admin_user)
+        for _ in range(10):
+            order = Order.objects.create(customer=self.customer_user, total_price=10)
+            OrderItem.objects.create(order=order, food_item=self.food_item1, unit_price=10)
+        revocation_list.sync()  # Not due for another sync during the request
+        # User lookup, count, orders page, item ids prefetch, line items prefetch
+        with self.assertNumQueries(5):
+            response = self.client.get("/api/orders/")
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(len(response.data["results"]), 10)
+
+    def test_bulk_order_placement(self):
+        """Test that a batch of orders is created with per-order results."""
+        self.authenticate(self.customer_user)
+        data = {"orders": [
+            {"items": [self.food_item1.id, self.food_item1.id]},
+            {"line_items": [{"food_item": self.food_item2.id, "quantity": 3}]},
+            {"items": [999999]},
+            {"items": []},
+        ]}
+        response = self.client.post("/api/orders/bulk/", data, format="json")
+        self.assertEqual(response.status_code, status.HTTP_207_MULTI_STATUS)
+        results = response.data["results"]
+        self.assertEqual([result["status"] for result in results], ["created", "created", "error", "error"])
+        self.assertEqual(results[0]["order"]["total_price"], "20.00")
+        self.assertEqual(results[1]["order"]["total_price"], "45.00")
+        self.assertEqual(Order.objects.filter(customer=self.customer_user).count(), 2)
+
+    def test_bulk_order_query_count_is_constant(self):
+        """Test that the number of queries does not grow with the batch size."""
+        self.authenticate(self.customer_user)
+        self.client.get("/api/users/me/")  # Warm the user cache
+
+        def place(count):
+            data = [{"items": [self.food_item1.id, self.food_item2.id]}] * count
+            with CaptureQueriesContext(connection) as queries:
+                response = self.client.post("/api/orders/bulk/", data, format="json")
+            self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+            return len(queries)
+
+        self.assertEqual(place(2), place(20))
+
+    def test_bulk_order_requires_customer(self):
+        """Test that admins cannot place bulk orders."""
+        self.authenticate(self.admin_user)
+        response = self.client.post("/api/orders/bulk/", [{"items": [self.food_item1.id]}], format="json")
+        self.assertEqual(response.status_code, status.HTTP_403_FORBIDDEN)
+
+    def test_admin_can_export_orders_as_csv(self):
+        """Test that the export streams one CSV row per order item, filtered by status."""
+        self.place_order(self.customer_user, self.food_item1, self.food_item2)
+        cancelled = self.place_order(self.customer_user, self.food_item1)
+        Order.objects.filter(id=cancelled.id).update(status="cancelled")
+        self.authenticate(self.admin_user)
+        response = self.client.get("/api/orders/export/?status=pending", HTTP_ACCEPT="text/csv")
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response["Content-Type"], "text/csv")
+        rows = list(csv.DictReader(StringIO(b"".join(response.streaming_content).decode())))
+        self.assertEqual([row["food_item_name"] for row in rows], ["Burger", "Pizza"])
+
+    def test_export_orders_ndjson_and_date_range(self):
+        """Test the NDJSON export and that the date range excludes older orders."""
+        old = self.place_order(self.customer_user, self.food_item1)
+        Order.objects.filter(id=old.id).update(created_at=timezone.now() - timedelta(days=30))
+        recent = self.place_order(self.customer_user, self.food_item2)
+        self.authenticate(self.admin_user)
+        start = (timezone.now() - timedelta(days=1)).date().isoformat()
+        response = self.client.get(f"/api/orders/export/?export_format=ndjson&start={start}")
+        lines = [json.loads(line) for line in b"".join(response.streaming_content).splitlines()]
+        self.assertEqual([line["id"] for line in lines], [recent.id])
+        self.assertEqual(lines[0]["items"][0]["name"], "Pizza")
+
+    def test_customer_cannot_export_orders(self):
+        """Test that the export is admin-only."""
+        self.authenticate(self.customer_user)
+        response = self.client.get("/api/orders/export/")
+        self.assertEqual(response.status_code, status.HTTP_403_FORBIDDEN)
+
+    def test_export_orders_command(self):
+        """Test the export management command."""
+        self.place_order(self.customer_user, self.food_item1)
+        out = StringIO()
+        call_command("export_orders", "--format", "ndjson", stdout=out)
+        self.assertEqual(json.loads(out.getvalue())["items"][0]["name"], "Burger")
+
+    # ✅ EMAIL OUTBOX TESTS
+    def test_completing_order_queues_one_email(self):
+        """Test that the status signal and the completion email collapse into one outbox message."""
+        order = Order.objects.create(customer=self.customer_user, total_price=10)
+        self.authenticate(self.admin_user)
+        response = self.client.patch(f"/api/orders/{order.id}/", {"status": "completed"}, format="json")
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(OutboundEmail.objects.count(), 1)
+        self.assertEqual(len(mail.outbox), 0)  # Nothing is sent inside the request
+
+        self.assertEqual(deliver_batch(), (1, 0))
+        self.assertEqual(len(mail.outbox), 1)
+        self.assertEqual(mail.outbox[0].subject, "Your Order is Completed!")
+        self.assertEqual(OutboundEmail.objects.get().status, "sent")
+
+    def test_outbox_retries_with_backoff(self):
+        """Test that a failed delivery is rescheduled and eventually marked as failed."""
+        email = enqueue_email("test:retry", "customer@example.com", "Subject", "Body")
+        with mock.patch("restaurant.outbox.EmailMessage.send", side_effect=OSError("SMTP down")):
+            self.assertEqual(deliver_batch(), (0, 1))
+        email.refresh_from_db()
+        self.assertEqual((email.status, email.attempts), ("pending", 1))
+        self.assertGreater(email.next_attempt_at, timezone.now())
+        self.assertEqual(deliver_batch(), (0, 0))  # Not due yet
+
+        OutboundEmail.objects.filter(id=email.id).update(attempts=MAX_ATTEMPTS - 1, next_attempt_at=timezone.now())
+        with mock.patch("restaurant.outbox.EmailMessage.send", side_effect=OSError("SMTP down")):
+            deliver_batch()
+        email.refresh_from_db()
+        self.assertEqual(email.status, "failed")
+
+    # ✅ SPARSE FIELDSET TESTS
+    def test_menu_fields_narrow_response_and_query(self):
+        """Test that ?fields= renders only the chosen fields and leaves other columns out of the SELECT."""
+        self.authenticate(self.customer_user)
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get("/api/food-items/?fields=id,name,price&ordering=price")
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual([list(item) for item in response.data["results"]], [["id", "name", "price"]] * 2)
+        self.assertFalse([query for query in queries if '"description"' in query["sql"]])
+
+        response = self.client.get(f"/api/food-items/{self.food_item1.id}/?exclude=description,image,image_variants")
+        self.assertEqual(set(response.data), {"id", "name", "price", "category", "availability"})
+        response = self.client.get("/api/food-items/?fields=name,secret")
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
+    def test_compact_order_list_skips_item_prefetches(self):
+        """Test that ?view=compact returns order summaries without the line-item queries."""
+        place_orders(self.customer_user, [{self.food_item1: 2}])
+        self.authenticate(self.customer_user)
+        self.client.get("/api/users/me/")  # Warm the user cache
+        with CaptureQueriesContext(connection) as full:
+            self.client.get("/api/orders/")
+        with CaptureQueriesContext(connection) as compact:
+            response = self.client.get("/api/orders/?view=compact")
+        self.assertEqual(list(response.data["results"][0]), ["id", "total_price", "status", "customer", "version"])
+        self.assertEqual(len(compact), len(full) - 2)
+
+        response = self.client.get("/api/orders/?fields=id,line_items")
+        self.assertEqual(response.data["results"][0]["line_items"][0]["quantity"], 2)
+
+    # ✅ PAGINATION TESTS
+    def test_menu_cursor_pagination_walks_both_ways(self):
+        """Test that cursors page forwards and backwards over (price, id) without gaps or repeats."""
+        for i in range(6):
+            FoodItem.objects.create(name=f"Dish {i}", price=10.0, category="Specials")
+        self.authenticate(self.customer_user)
+        url, seen, pages = "/api/food-items/?ordering=price&page_size=3", [], []
+        while url:
+            response = self.client.get(url)
+            pages.append(response)
+            seen += [item["id"] for item in response.data["results"]]
+            url = response.data["next"]
+        self.assertEqual(len(seen), 8)
+        self.assertEqual(len(set(seen)), 8)
+        prices = [Decimal(FoodItem.objects.get(id=i).price) for i in seen]
+        self.assertEqual(prices, sorted(prices))
+
+        previous = self.client.get(pages[1].data["previous"])
+        self.assertEqual(previous.data["results"], pages[0].data["results"])
+
+    def test_search_results_paginate_without_gaps(self):
+        """Test that paging through ranked search results returns every match once, best first."""
+        for i in range(7):
+            # Different and equal ranks: the word in the name, the category or the description
+            FoodItem.objects.create(name=f"Dish {i}", price=5.0, category="Burgers" if i % 2 else "Sides",
+                                    description="" if i % 2 else "Burger relish on top")
+        self.authenticate(self.customer_user)
+        url, seen = "/api/food-items/?search=burger&page_size=2", []
+        while url:
+            response = self.client.get(url)
+            self.assertEqual(response.status_code, status.HTTP_200_OK)
+            seen += [item["id"] for item in response.data["results"]]
+            url = response.data["next"]
+        self.assertEqual(len(seen), len(set(seen)))
+        self.assertEqual(set(seen), {item.id for item in FoodItem.objects.filter(name__startswith="Dish")} | {self.food_item1.id})
+        self.assertEqual(seen[0], self.food_item1.id)  # Name matches rank first
+
+    def test_pagination_count_is_optional(self):
+        """Test that clients can skip the COUNT(*) query."""
+        self.authenticate(self.admin_user)
+        self.assertIn("count", self.client.get("/api/orders/").data)
+        self.assertNotIn("count", self.client.get("/api/orders/?count=false").data)
+
+    def test_invalid_cursor_is_rejected(self):
+        """Test that a malformed cursor, or one with values of the wrong type, returns 404."""
+        self.authenticate(self.customer_user)
+        response = self.client.get("/api/food-items/?cursor=not-a-cursor")
+        self.assertEqual(response.status_code, status.HTTP_404_NOT_FOUND)
+        # Well-formed cursors whose values don't fit the sort fields
+        for values in (["abc", 1], [None, 1], ["1.00", "x"]):
+            cursor = base64.urlsafe_b64encode(json.dumps({"v": values, "r": False, "o": ["price", "pk"]}).encode()).decode()
+            response = self.client.get(f"/api/food-items/?ordering=price&cursor={cursor}")
+            self.assertEqual(response.status_code, status.HTTP_404_NOT_FOUND)
+
     # ✅ AI-POWERED RECOMMENDATION TEST
     def test_get_recommendations(self):
         """Test AI-powered food recommendations."""
@@ -146,6 +869,156 @@ class RestaurantAPITestCase(APITestCase):
         response = self.client.get("/api/recommendations/")
         self.assertEqual(response.status_code, status.HTTP_200_OK)
 
+    def place_order(self, customer, *food_items):
+        order = Order.objects.create(customer=customer, total_price=0)
+        OrderItem.objects.bulk_create([OrderItem(order=order, food_item=item, unit_price=item.price) for item in food_items])
+        return order
+
+    def test_recommendations_follow_own_history_then_co_occurrence(self):
+        """Test that a customer's own favourites come first, followed by items ordered alongside them."""
+        salad = FoodItem.objects.create(name="Salad", price=7.0, category="Sides")
+        other = User.objects.create_user(username="other", password="otherpass")
+        self.place_order(other, self.food_item1, salad)
+        self.place_order(other, self.food_item2)
+        self.place_order(other, self.food_item2)
+        self.place_order(self.customer_user, self.food_item1)
+        recommendation_engine.reset()
+        recommendation_engine.sync(force=True)
+
+        self.authenticate(self.customer_user)
+        response = self.client.get("/api/recommendations/")
+        self.assertEqual([item["name"] for item in response.data], ["Burger", "Salad", "Pizza"])
+
+        response = self.client.get(f"/api/recommendations/?item={self.food_item1.id}")
+        self.assertEqual([item["name"] for item in response.data], ["Salad"])
+
+    def test_recommendations_are_served_from_memory(self):
+        """Test that a warm engine answers without database queries."""
+        self.place_order(self.customer_user, self.food_item2)
+        recommendation_engine.reset()
+        self.authenticate(self.customer_user)
+        self.client.get("/api/recommendations/")
+        with self.assertNumQueries(0):
+            response = self.client.get("/api/recommendations/")
+        self.assertEqual(response.data[0]["name"], "Pizza")
+
+    def test_recommendations_fall_back_to_best_sellers_while_loading(self):
+        """Test that a worker answers from the sales rollups while its counts load, and rebuilds in the background."""
+        self.authenticate(self.customer_user)
+        self.client.post("/api/orders/", {"items": [self.food_item2.id]}, format="json")
+        engine = RecommendationEngine()
+        with mock.patch("restaurant.recommendations.recommendation_engine", engine), \
+                mock.patch("restaurant.recommendations.connections"), \
+                mock.patch("restaurant.recommendations.threading.Thread") as thread:
+            engine.start_warming()
+            with CaptureQueriesContext(connection) as queries:
+                response = self.client.get("/api/recommendations/")
+            self.assertEqual([item["name"] for item in response.data], ["Pizza"])
+            self.assertFalse([query for query in queries if "restaurant_orderitem" in query["sql"]])
+
+            thread.call_args.kwargs["target"]()  # The load completes
+            self.assertTrue(engine.warm)
+            self.assertEqual(engine.popularity, {self.food_item2.id: 1})
+
+            request_rebuild()
+            engine.mark_stale()
+            response = self.client.get("/api/recommendations/")
+            self.assertEqual(thread.call_count, 2)  # Reloading in the background...
+            self.assertEqual(response.data[0]["name"], "Pizza")  # ...while the current counts answer
+
+    def test_rebuild_recommendations_command(self):
+        """Test that the rebuild command recounts every order that wasn't cancelled."""
+        self.place_order(self.customer_user, self.food_item1, self.food_item2)
+        recommendation_engine.reset()
+        call_command("rebuild_recommendations", stdout=StringIO())
+        self.assertEqual(recommendation_engine.popularity[self.food_item1.id], 1)
+        self.assertEqual(recommendation_engine.co_occurrence[self.food_item1.id][self.food_item2.id], 1)
+
+        # Counts are append-only until the next rebuild, which leaves cancelled orders out
+        Order.objects.update(status="cancelled")
+        call_command("rebuild_recommendations", stdout=StringIO())
+        self.assertEqual(recommendation_engine.popularity[self.food_item1.id], 0)
+
+    # ✅ METRICS TESTS
+    def test_metrics_require_admin(self):
+        """Test that only admins can read the metrics."""
+        self.authenticate(self.customer_user)
+        response = self.client.get("/metrics")
+        self.assertEqual(response.status_code, status.HTTP_403_FORBIDDEN)
+
+    def test_metrics_record_latency_and_queries_per_view(self):
+        """Test that requests are counted per view along with their SQL queries."""
+        self.authenticate(self.admin_user)
+        revocation_list.sync(rebuild=True)  # Built by the first authenticated request otherwise
+        metrics_registry.clear()
+        self.client.get("/api/orders/")
+        self.client.get("/api/orders/")
+        response = self.client.get("/metrics")
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertTrue(response["Content-Type"].startswith("text/plain"))
+        body = response.content.decode()
+        self.assertIn('restaurant_http_requests_total{view="order-list",method="GET",status="200"} 2', body)
+        self.assertIn('restaurant_http_request_duration_seconds_count{view="order-list",method="GET"} 2', body)
+        # Count and page queries each time (no prefetches for an empty page), plus the user lookup once
+        self.assertIn('restaurant_http_request_db_queries_sum{view="order-list",method="GET"} 5', body)
+
+    def test_metrics_add_up_across_processes(self):
+        """Test that snapshots written by other worker processes are included."""
+        with tempfile.TemporaryDirectory() as directory:
+            worker = MetricsRegistry(directory=directory, flush_interval=3600)
+            worker.record_request("fooditem-list", "GET", 200, 0.02, 512, 2, 0.004)
+            worker.flush()
+            registry = MetricsRegistry(directory=directory, flush_interval=3600)
+            registry.record_request("fooditem-list", "GET", 500, 0.2, 64, 1, 0.001)
+            registry.flush()
+            self.assertNotEqual(worker.process_id, registry.process_id)
+            body = registry.render()
+        self.assertIn('restaurant_http_request_duration_seconds_count{view="fooditem-list",method="GET"} 2', body)
+        self.assertIn('restaurant_http_request_duration_seconds_bucket{view="fooditem-list",method="GET",le="0.025"} 1', body)
+        self.assertIn('restaurant_http_request_errors_total{view="fooditem-list",method="GET"} 1', body)
+
+    def test_metrics_of_exited_processes_are_folded_into_totals(self):
+        """Test that an exited worker's counts move to the totals without being lost or counted twice."""
+        count = 'restaurant_http_requests_total{view="fooditem-list",method="GET",status="200"} %d'
+        with tempfile.TemporaryDirectory() as directory:
+            for _ in range(2):  # The second worker reuses the first one's pid
+                worker = MetricsRegistry(directory=directory, flush_interval=3600)
+                worker.record_request("fooditem-list", "GET", 200, 0.02, 512, 2, 0.004)
+                worker.flush()
+            registry = MetricsRegistry(directory=directory)
+            self.assertIn(count % 2, registry.render())
+            fold_process_metrics(directory, os.getpid())
+            self.assertEqual(os.listdir(directory), [TOTALS_FILENAME])
+            self.assertIn(count % 2, registry.render())
+            fold_process_metrics(directory, os.getpid())
+            self.assertIn(count % 2, registry.render())
+
+    # ✅ SEEDING & BENCHMARK TESTS
+    def test_seed_data_command(self):
+        """Test that seeding creates the requested volumes with consistent line items."""
+        call_command("seed_data", users=3, food_items=4, orders=10, stdout=StringIO())
+        self.assertEqual(User.objects.filter(username__startswith="seed_customer_").count(), 3)
+        self.assertEqual(FoodItem.objects.filter(category_normalized="").count(), 0)
+        seeded = Order.objects.exclude(customer__in=[self.admin_user, self.customer_user])
+        self.assertEqual(seeded.count(), 10)
+        for order in seeded:
+            self.assertEqual(order.recalculate_total(), order.total_price)
+
+    def test_benchmarks_stay_within_query_budgets(self):
+        """Test that every benchmarked endpoint responds as expected within its query budget."""
+        seed(users=5, food_items=10, orders=50)
+        results = run_benchmarks(iterations=1, warmup=1)
+        self.assertEqual(set(results), {scenario.name for scenario in SCENARIOS})
+        self.assertEqual(budget_violations(results), [])
+
+    def test_benchmark_regressions_against_baseline(self):
+        """Test that slowdowns past the threshold and extra queries are reported."""
+        baseline = {"results": {"menu_list": {"p50_ms": 10.0, "p99_ms": 20.0, "queries": 2}}}
+        within = {"menu_list": {"p50_ms": 12.0, "p99_ms": 24.0, "queries": 2, "max_queries": 2}}
+        self.assertEqual(regressions(within, baseline, threshold=0.25), [])
+        slower = {"menu_list": {"p50_ms": 13.0, "p99_ms": 24.0, "queries": 3, "max_queries": 2}}
+        self.assertEqual(len(regressions(slower, baseline, threshold=0.25)), 2)
+
     # ✅ SEARCH & FILTER TESTS
     def test_search_food_items(self):
         """Test searching for food items by name."""
@@ -161,9 +1034,289 @@ class RestaurantAPITestCase(APITestCase):
         self.assertEqual(response.status_code, status.HTTP_200_OK)
         self.assertGreaterEqual(len(response.data), 1)
 
+    def test_search_ranks_name_matches_first(self):
+        """Test that search matches whole and partial words and ranks name matches above descriptions."""
+        FoodItem.objects.create(name="Garlic Bread", description="Goes well with pizza", price=4.0, category="Sides")
+        self.authenticate(self.customer_user)
+        response = self.client.get("/api/food-items/?search=pizz")
+        names = [item["name"] for item in response.data["results"]]
+        self.assertEqual(names, ["Pizza", "Garlic Bread"])
+
+    def test_fallback_search_keeps_the_best_matches_only(self):
+        """Test that a broad search on the in-process index passes a bounded number of matches to the database."""
+        FoodItem.objects.bulk_create([FoodItem(name=f"Dish {n}", price=5, description="burger") for n in range(5)])
+        with mock.patch("restaurant.search.SEARCH_FALLBACK_MAX_MATCHES", 3):
+            queryset = search_menu(FoodItem.objects.all(), "burger")
+            _, params = queryset.query.sql_with_params()
+            ranked = list(queryset.order_by("-search_rank", "id").values_list("name", flat=True))
+        self.assertEqual(ranked[0], "Burger")  # Name matches outrank description matches
+        self.assertEqual(len(ranked), 3)
+        self.assertLessEqual(len(params), 3 * 3 + 1)  # Plus the default rank
+
+    def test_postgres_search_matches_its_indexes(self):
+        """Test that the PostgreSQL search SQL filters on the expressions the search indexes are built on."""
+        from django.db.backends.postgresql.base import DatabaseWrapper
+        postgres = DatabaseWrapper({**connection.settings_dict, "ENGINE": "django.db.backends.postgresql"}, alias="postgres")
+        with mock.patch.object(connection, "vendor", "postgresql"):
+            queryset = search_menu(FoodItem.objects.all(), "burg")
+        sql, _ = queryset.query.get_compiler(connection=postgres).as_sql()
+        self.assertIn('UPPER("restaurant_fooditem"."name"::text) LIKE UPPER(', sql)
+        self.assertIn('"restaurant_fooditem"."search_vector" @@ (websearch_to_tsquery(', sql)
+        index_sql = " ".join(POSTGRES_SEARCH_SQL)
+        self.assertIn("gin (UPPER(name) gin_trgm_ops)", index_sql)
+        self.assertIn("gin (search_vector)", index_sql)
+
+    def test_category_filter_is_exact(self):
+        """Test that category filtering matches the normalized category, not substrings."""
+        FoodItem.objects.create(name="Fries", price=3.0, category="  FAST   food ")
+        FoodItem.objects.create(name="Salad", price=7.0, category="Not Fast Food")
+        self.authenticate(self.customer_user)
+        response = self.client.get("/api/food-items/?category=fast food")
+        self.assertEqual([item["name"] for item in response.data["results"]], ["Burger", "Fries"])
+
+    def test_menu_facets(self):
+        """Test that facet counts come from one query and each facet ignores its own filter."""
+        FoodItem.objects.create(name="Pasta", price=25.0, category="italian", availability=False)
+        FoodItem.objects.create(name="Fries", price=4.0, category="Fast Food")
+        self.authenticate(self.customer_user)
+        self.client.get("/api/users/me/")  # Warm the user cache
+        with self.assertNumQueries(1):
+            response = self.client.get("/api/food-items/facets/", {"category": "Italian", "max_price": "20"})
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        facets = response.data
+        # Within the price range: Burger and Fries are fast food, Pizza is Italian (Pasta is too expensive)
+        self.assertEqual([(entry["key"], entry["count"]) for entry in facets["categories"]], [("fast food", 2), ("italian", 1)])
+        self.assertEqual(facets["availability"], {"available": 1, "unavailable": 0})
+        self.assertEqual(facets["total"], 1)
+        # The price histogram covers every Italian dish regardless of the price range
+        counts = {bucket["min"]: bucket["count"] for bucket in facets["price"]["buckets"] if bucket["count"]}
+        self.assertEqual(counts, {"15.00": 1, "20.00": 1})
+        self.assertEqual((facets["price"]["min"], facets["price"]["max"]), ("15.00", "25.00"))
+
+        with self.assertNumQueries(0):  # Served from the menu cache
+            self.client.get("/api/food-items/facets/", {"category": "italian", "max_price": "20"})
+
+    def test_menu_price_filters_reject_bad_values(self):
+        """Test that a price filter that isn't a number is a 400 on the menu and its facets, not a server error."""
+        self.authenticate(self.customer_user)
+        for path in ("/api/food-items/", "/api/food-items/facets/"):
+            response = self.client.get(f"{path}?min_price=abc")
+            self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+            self.assertIn("min_price", response.data)
+            self.assertEqual(self.client.get(f"{path}?max_price=NaN").status_code, status.HTTP_400_BAD_REQUEST)
+        response = self.client.get("/api/food-items/facets/?min_price=12.5")
+        self.assertEqual(response.data["total"], 1)
+
+    def test_menu_facets_follow_search(self):
+        """Test that facets only count items matching the search."""
+        self.authenticate(self.customer_user)
+        response = self.client.get("/api/food-items/facets/", {"search": "pizza"})
+        self.assertEqual(response.data["total"], 1)
+        self.assertEqual([entry["key"] for entry in response.data["categories"]], ["italian"])
+
     def test_filter_food_items_by_price_range(self):
         """Test filtering food items by price range."""
         self.authenticate(self.customer_user)
         response = self.client.get("/api/food-items/?min_price=5&max_price=15")
         self.assertEqual(response.status_code, status.HTTP_200_OK)
         self.assertGreaterEqual(len(response.data), 1)
+
+
+class AsyncReadViewTestCase(APITestCase):
+    """The async GET handlers serve the same data as the DRF views."""
+
+    def setUp(self):
+        cache.clear()
+        self.customer_user = User.objects.create_user(
+            username="customer", email="customer@example.com", password="customerpass", is_customer=True
+        )
+        self.food_item1 = FoodItem.objects.create(name="Burger", price=10.0, category="Fast Food")
+        self.food_item2 = FoodItem.objects.create(name="Pizza", price=15.0, category="Italian")
+        response = self.client.post("/api/login/", {"username": "customer", "password": "customerpass"})
+        self.access_token = response.cookies["access_token"].value
+        self.factory = AsyncRequestFactory()
+
+    def get(self, path, **extra):
+        request = self.factory.get(path, **extra)
+        request.COOKIES["access_token"] = self.access_token
+        return request
+
+    async def test_async_menu_list_matches_sync_view(self):
+        """Test that the async menu listing returns the same body and ETag as the DRF view."""
+        sync_response = await sync_to_async(self.client.get)("/api/food-items/?ordering=-price")
+        response = await async_views.food_item_list(self.get("/api/food-items/?ordering=-price"))
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response["ETag"], sync_response["ETag"])
+        self.assertEqual([item["name"] for item in json.loads(response.content)["results"]], ["Pizza", "Burger"])
+
+        response = await async_views.food_item_list(self.get("/api/food-items/?ordering=-price", headers={"If-None-Match": response["ETag"]}))
+        self.assertEqual(response.status_code, status.HTTP_304_NOT_MODIFIED)
+
+    async def test_async_menu_honours_sparse_fieldsets(self):
+        """Test that the async list and detail handlers apply ?fields= like the DRF views."""
+        response = await async_views.food_item_list(self.get("/api/food-items/?fields=id,name"))
+        self.assertEqual([list(item) for item in json.loads(response.content)["results"]], [["id", "name"]] * 2)
+        response = await async_views.food_item_detail(self.get(f"/api/food-items/{self.food_item1.id}/?view=compact"), pk=self.food_item1.id)
+        self.assertNotIn("description", json.loads(response.content))
+
+    async def test_async_menu_negotiates_msgpack(self):
+        """Test that the async menu renders MessagePack on request, with its own ETag, and 406s unknown types."""
+        json_response = await async_views.food_item_list(self.get("/api/food-items/"))
+        response = await async_views.food_item_list(self.get("/api/food-items/", headers={"Accept": "application/msgpack"}))
+        self.assertEqual(response["Content-Type"], "application/msgpack")
+        self.assertEqual(msgpack.unpackb(response.content), json.loads(json_response.content))
+        self.assertNotEqual(response["ETag"], json_response["ETag"])
+        self.assertIn("Accept", response["Vary"])
+
+        response = await async_views.food_item_list(self.get("/api/food-items/", headers={"Accept": "text/csv"}))
+        self.assertEqual(response.status_code, status.HTTP_406_NOT_ACCEPTABLE)
+
+    async def test_async_menu_search_and_detail(self):
+        """Test async search and single-item reads, including 404."""
+        response = await async_views.food_item_list(self.get("/api/food-items/?search=pizza"))
+        self.assertEqual([item["name"] for item in json.loads(response.content)["results"]], ["Pizza"])
+
+        response = await async_views.food_item_detail(self.get(f"/api/food-items/{self.food_item1.id}/"), pk=self.food_item1.id)
+        self.assertEqual(json.loads(response.content)["name"], "Burger")
+        response = await async_views.food_item_detail(self.get("/api/food-items/999999/"), pk=999999)
+        self.assertEqual(response.status_code, status.HTTP_404_NOT_FOUND)
+
+    async def test_async_profile_and_recommendations(self):
+        """Test the async profile and recommendation endpoints."""
+        response = await async_views.user_profile(self.get("/api/users/me/"))
+        self.assertEqual(json.loads(response.content)["username"], "customer")
+        response = await async_views.recommendations(self.get("/api/recommendations/"))
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+
+    async def test_async_views_require_authentication(self):
+        """Test that requests without a token are rejected like the DRF views."""
+        response = await async_views.food_item_list(self.factory.get("/api/food-items/"))
+        self.assertEqual(response.status_code, status.HTTP_403_FORBIDDEN)
+
+    async def read_event(self, stream):
+        """Next data-carrying chunk of an SSE stream, skipping keep-alives."""
+        while True:
+            chunk = (await asyncio.wait_for(anext(stream), timeout=2)).decode()
+            if not chunk.startswith(":"):
+                return chunk
+
+    async def test_order_events_stream(self):
+        """Test that a customer is streamed their own order creation and status changes only."""
+        response = await async_views.order_events(self.get("/api/orders/events/"))
+        self.assertEqual(response["Content-Type"], "text/event-stream")
+        stream = response.streaming_content
+        self.assertTrue((await self.read_event(stream)).startswith("retry:"))  # Subscribed from here on
+
+        other = await sync_to_async(User.objects.create_user)(username="other", password="otherpass")
+
+        def place_and_complete():
+            with self.captureOnCommitCallbacks(execute=True):
+                place_orders(other, [{self.food_item2: 1}])
+            with self.captureOnCommitCallbacks(execute=True):
+                order = place_orders(self.customer_user, [{self.food_item1: 2}])[0]
+            with self.captureOnCommitCallbacks(execute=True):
+                order.status = "completed"
+                order.save(update_fields=["status"])
+            return order
+
+        order = await sync_to_async(place_and_complete)()
+        created = await self.read_event(stream)
+        self.assertTrue(created.startswith("event: order.created\n"))
+        data = json.loads(created.split("data: ", 1)[1])
+        self.assertEqual((data["order"], data["status"], data["total_price"]), (order.id, "pending", "20.00"))
+        completed = await self.read_event(stream)
+        self.assertTrue(completed.startswith("event: order.status\n"))
+        self.assertEqual(json.loads(completed.split("data: ", 1)[1])["status"], "completed")
+        await stream.aclose()
+
+    async def test_order_events_require_authentication(self):
+        """Test that the stream rejects anonymous clients."""
+        response = await async_views.order_events(self.factory.get("/api/orders/events/"))
+        self.assertEqual(response.status_code, status.HTTP_403_FORBIDDEN)
+
+
+# URLconf with the async views in place, as with ASYNC_READ_VIEWS=True
+urlpatterns = urls.async_read_urlpatterns + urls.urlpatterns
+
+
+@override_settings(ROOT_URLCONF="restaurant.tests")
+class PasswordHashingASGITestCase(TransactionTestCase):
+    """Logins run through Django's ASGI handler, where sync views share one thread per worker."""
+
+    def setUp(self):
+        cache.clear()
+        User.objects.create_user(username="customer", password="customerpass", is_customer=True)
+
+    async def test_password_hashing_is_capped_without_holding_up_sync_views(self):
+        """Test that logins hash off the shared sync thread, at most PASSWORD_HASH_CONCURRENCY at a time."""
+        finished = []
+        authenticate = views.authenticate
+
+        def slow_authenticate(**credentials):
+            time.sleep(0.3)
+            return authenticate(**credentials)
+
+        async def login():
+            response = await self.async_client.post("/api/login/", {"username": "customer", "password": "customerpass"})
+            finished.append(("login", response.status_code))
+
+        async def other_request():
+            await asyncio.sleep(0.05)  # While the logins hash
+            response = await self.async_client.get("/api/orders/")  # A sync DRF view
+            finished.append(("orders", response.status_code))
+
+        with mock.patch("restaurant.views.authenticate", slow_authenticate), \
+                mock.patch.object(async_views, "PASSWORD_HASH_WAIT_SECONDS", 0.1):
+            await asyncio.gather(login(), login(), login(), other_request())
+        self.assertEqual(sorted(finished[:2]), [("login", 503), ("orders", 403)])
+        self.assertEqual(finished[2:], [("login", 200), ("login", 200)])
+
+
+@override_settings(REPLICA_DATABASE="replica")
+class DatabaseRoutingTestCase(SimpleTestCase):
+
+    def setUp(self):
+        self.router = PrimaryReplicaRouter()
+        self.factory = RequestFactory()
+
+    def routed_read(self, request):
+        """Run the request through the middleware and report where a read inside the view would go."""
+        seen = {}
+
+        def view(request):
+            seen["db"] = self.router.db_for_read(FoodItem)
+            return HttpResponse()
+
+        response = ReplicaRoutingMiddleware(view)(request)
+        return seen["db"], response
+
+    def test_reads_default_to_primary(self):
+        """Test that reads outside a request (commands, workers) and all writes use the primary."""
+        self.assertEqual(self.router.db_for_read(FoodItem), "default")
+        with replica_reads():
+            self.assertEqual(self.router.db_for_read(FoodItem), "replica")
+            self.assertEqual(self.router.db_for_write(FoodItem), "default")
+        self.assertFalse(self.router.allow_migrate("replica", "restaurant"))
+
+    def test_safe_requests_read_from_replica(self):
+        """Test that GET requests read from the replica and writes pin the client to the primary."""
+        db, _ = self.routed_read(self.factory.get("/api/food-items/"))
+        self.assertEqual(db, "replica")
+
+        db, response = self.routed_read(self.factory.post("/api/orders/"))
+        self.assertEqual(db, "default")
+        self.assertIn(PRIMARY_PIN_COOKIE, response.cookies)
+
+        request = self.factory.get("/api/orders/")
+        request.COOKIES[PRIMARY_PIN_COOKIE] = "1"
+        db, _ = self.routed_read(request)
+        self.assertEqual(db, "default")
+
+    @override_settings(REPLICA_DATABASE=None)
+    def test_without_replica_everything_uses_primary(self):
+        """Test that routing is a no-op when no replica is configured."""
+        db, response = self.routed_read(self.factory.post("/api/orders/"))
+        self.assertEqual(db, "default")
+        self.assertNotIn(PRIMARY_PIN_COOKIE, response.cookies)
+        db, _ = self.routed_read(self.factory.get("/api/food-items/"))
+        self.assertEqual(db, "default")
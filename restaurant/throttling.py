@@ -0,0 +1,146 @@
+"""
+Rate limits for the endpoints that are expensive or attractive to abuse: login, registration and ordering.
+
+TokenBucketThrottle keeps one bucket per scope and client in Django's cache, so with a shared cache (Redis,
+see REDIS_URL) every worker process draws from the same buckets. Rates use DRF's "<requests>/<period>"
+format in REST_FRAMEWORK['DEFAULT_THROTTLE_RATES']; the request count is the burst size and the bucket
+refills evenly over the period. A scope without a rate is not throttled.
+
+Password hashing (PBKDF2 on every login attempt and sign-up) is also capped per process by
+limit_password_hashing: requests that can't get a slot within PASSWORD_HASH_WAIT_SECONDS get a 503 with
+Retry-After instead of queueing behind the hashes already running. Under ASGI the async login and sign-up
+views (async_views.password_hashing_view) apply the same cap with an asyncio semaphore.
+"""
+import threading
+import time
+from functools import wraps
+
+from django.conf import settings
+from rest_framework import status
+from rest_framework.exceptions import APIException
+from rest_framework.settings import api_settings
+from rest_framework.throttling import SimpleRateThrottle
+
+PASSWORD_HASH_CONCURRENCY = getattr(settings, 'PASSWORD_HASH_CONCURRENCY', 2)
+PASSWORD_HASH_WAIT_SECONDS = getattr(settings, 'PASSWORD_HASH_WAIT_SECONDS', 0.5)
+
+# A bucket is updated under a short cache lock (cache.add is atomic on shared backends)
+LOCK_TIMEOUT = 2
+LOCK_ATTEMPTS = 5
+LOCK_RETRY_SECONDS = 0.005
+
+
+class TokenBucketThrottle(SimpleRateThrottle):
+    cache_format = 'throttle:%(scope)s:%(ident)s'
+
+    def get_rate(self):
+        # Read at request time (not class definition), so settings overrides apply
+        return api_settings.DEFAULT_THROTTLE_RATES.get(self.scope)
+
+    def get_ident_for(self, request):
+        raise NotImplementedError
+
+    def get_cache_key(self, request, view):
+        ident = self.get_ident_for(request)
+        if not ident:
+            return None
+        return self.cache_format % {'scope': self.scope, 'ident': ident}
+
+    def _lock(self, lock_key):
+        for _ in range(LOCK_ATTEMPTS):
+            if self.cache.add(lock_key, 1, LOCK_TIMEOUT):
+                return True
+            time.sleep(LOCK_RETRY_SECONDS)
+        return False
+
+    def allow_request(self, request, view):
+        if self.rate is None:
+            return True
+        self.key = self.get_cache_key(request, view)
+        if self.key is None:
+            return True
+
+        capacity, refill_rate = self.num_requests, self.num_requests / self.duration
+        lock_key = f'{self.key}:lock'
+        if not self._lock(lock_key):
+            # Many simultaneous requests from one client: shed them rather than wait
+            self._wait = 1
+            return False
+        try:
+            now = self.timer()
+            tokens, updated_at = self.cache.get(self.key, (capacity, now))
+            tokens = min(capacity, tokens + (now - updated_at) * refill_rate)
+            if tokens < 1:
+                self._wait = (1 - tokens) / refill_rate
+                return False
+            # An untouched bucket is full again after one period, so it can simply expire then
+            self.cache.set(self.key, (tokens - 1, now), self.duration)
+            return True
+        finally:
+            self.cache.delete(lock_key)
+
+    def wait(self):
+        return self._wait
+
+
+class IPThrottle(TokenBucketThrottle):
+    """ One bucket per client address (see NUM_PROXIES for deployments behind a proxy) """
+
+    def get_ident_for(self, request):
+        return self.get_ident(request)
+
+
+class UsernameThrottle(TokenBucketThrottle):
+    """ One bucket per username being logged in to, however many addresses the attempts come from """
+
+    def get_ident_for(self, request):
+        username = request.data.get('username') if hasattr(request.data, 'get') else None
+        return username.strip().lower()[:150] if isinstance(username, str) and username.strip() else None
+
+
+class UserThrottle(TokenBucketThrottle):
+    """ One bucket per authenticated user """
+
+    def get_ident_for(self, request):
+        return request.user.pk if request.user and request.user.is_authenticated else None
+
+
+class LoginIPThrottle(IPThrottle):
+    scope = 'login_ip'
+
+
+class LoginUsernameThrottle(UsernameThrottle):
+    scope = 'login_username'
+
+
+class RegisterIPThrottle(IPThrottle):
+    scope = 'register_ip'
+
+
+class OrderUserThrottle(UserThrottle):
+    scope = 'orders_user'
+
+
+class PasswordHashingBusy(APIException):
+    status_code = status.HTTP_503_SERVICE_UNAVAILABLE
+    default_detail = "The server is busy; try again shortly."
+    default_code = 'password_hashing_busy'
+    wait = 1  # Sent as Retry-After
+
+
+_hashing_slots = threading.BoundedSemaphore(PASSWORD_HASH_CONCURRENCY)
+
+
+def limit_password_hashing(view):
+    """ Run view only with a free password-hashing slot, answering 503 if none frees up quickly """
+
+    @wraps(view)
+    def wrapper(*args, **kwargs):
+        if not _hashing_slots.acquire(timeout=PASSWORD_HASH_WAIT_SECONDS):
+            raise PasswordHashingBusy()
+        try:
+            return view(*args, **kwargs)
+        finally:
+            _hashing_slots.release()
+
+    return wrapper
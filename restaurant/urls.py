@@ -19,14 +19,29 @@
 #     path('api/token/refresh/', TokenRefreshView.as_view(), name='token_refresh'),
 # ]
 
+from django.conf import settings
 from django.urls import path, include
 from rest_framework.routers import DefaultRouter
 from rest_framework_simplejwt.views import TokenRefreshView
-from .views import register, login_view, user_profile,logout_view, FoodItemViewSet, OrderViewSet, recommendations
+from . import async_views
+from .views import register, login_view, user_profile,logout_view, FoodItemViewSet, OrderViewSet, recommendations, metrics
 router = DefaultRouter()
 router.register(r'food-items', FoodItemViewSet)
 router.register(r'orders', OrderViewSet)
 
+# Async GET handlers for the hot read endpoints (other methods fall through to the DRF views), login and
+# sign-up (password hashing off the thread the sync views share) and the order events stream
+async_read_urlpatterns = [
+    path('api/register/', async_views.register, name='register-async'),
+    path('api/login/', async_views.login_view, name='login-async'),
+    path('api/food-items/', async_views.food_item_list, name='food-items-async'),
+    path('api/food-items/<int:pk>/', async_views.food_item_detail, name='food-item-detail-async'),
+    path('api/users/me/', async_views.user_profile, name='user-profile-async'),
+    path('api/recommendations/', async_views.recommendations, name='recommendations-async'),
+    # Server-sent events hold a connection open, so they are only served under ASGI
+    path('api/orders/events/', async_views.order_events, name='order-events'),
+]
+
 urlpatterns = [
     path('api/register/', register, name='register'),
     path('api/login/', login_view, name='login'),
@@ -35,5 +50,8 @@ urlpatterns = [
     path('api/users/me/', user_profile, name='user-profile'),
     path('api/', include(router.urls)),
     path('api/recommendations/', recommendations, name='recommendations'),
+    path('metrics', metrics, name='metrics'),
 ]
 
+if settings.ASYNC_READ_VIEWS:
+    urlpatterns = async_read_urlpatterns + urlpatterns
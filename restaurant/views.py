@@ -1,28 +1,71 @@
+from functools import partial
+
 from django.contrib.auth import authenticate
-from rest_framework import viewsets
+from rest_framework import serializers, status, viewsets
 from rest_framework.permissions import IsAuthenticated, IsAdminUser,AllowAny
-from rest_framework.decorators import api_view, permission_classes, authentication_classes, parser_classes
+from rest_framework.decorators import action, api_view, permission_classes, authentication_classes, parser_classes, throttle_classes
 from rest_framework.response import Response
 from rest_framework.parsers import MultiPartParser, FormParser
-from rest_framework_simplejwt.tokens import RefreshToken
-from rest_framework import filters
+from rest_framework_simplejwt.exceptions import TokenError
+from rest_framework_simplejwt.tokens import AccessToken, RefreshToken
 from django.conf import settings
-from django.core.mail import send_mail
+from django.db.models import prefetch_related_objects
+from django.http import HttpResponse, StreamingHttpResponse
 from .models import CustomUser, FoodItem, Order
-from .serializers import UserSerializer, FoodItemSerializer, OrderSerializer
+from .serializers import UserSerializer, FoodItemSerializer, FoodItemCompactSerializer, OrderSerializer, OrderCompactSerializer, OrderStatusSerializer, BulkOrderEntrySerializer
 from .recommendations import get_recommendations
-from .authentication import CookieJWTAuthentication  # Import custom authentication class
+from .menu_cache import cached_menu_response
+from .search import MenuSearchFilter, RankedOrderingFilter
+from .pagination import MenuPagination, OrderPagination
+from .idempotency import idempotent_response
+from .orders import StatusConflict, delete_order, merge_quantities, place_orders, resolve_food_items, transition_order_status
+from .analytics import daily_sales, parse_day_range, top_items
+from .facets import menu_facets
+from .fieldsets import SparseFieldsetMixin
+from .menu_import import MenuImportError, detect_format, import_menu, menu_rows, parse_menu
+from .exports import EXPORT_FORMATS, ExportContentNegotiation, export_queryset, iter_export, parse_bound
+from .authentication import CookieJWTAuthentication, full_user, refresh_token_for  # Import custom authentication class
+from .revocation import revoke_tokens
+from .throttling import LoginIPThrottle, LoginUsernameThrottle, OrderUserThrottle, RegisterIPThrottle, limit_password_hashing
+from .metrics import PROMETHEUS_CONTENT_TYPE, HasMetricsToken, metrics_registry
+from .renderers import MessagePackParser, ORJSONParser
 from rest_framework.exceptions import NotFound, PermissionDenied, ValidationError
-from rest_framework.pagination import PageNumberPagination
 
-class CustomPagination(PageNumberPagination):
-    page_size = 5  # Number of items per page
-    page_size_query_param = 'page_size'  # Allow dynamic page size (e.g., ?page_size=10)
-    max_page_size = 50  # Prevent excessive results per page
+BULK_ORDER_LIMIT = getattr(settings, 'BULK_ORDER_LIMIT', 100)  # Orders accepted per bulk request
+PRICE_FILTER_FIELD = serializers.DecimalField(max_digits=None, decimal_places=None)
+
+
+def order_etag(order):
+    return f'"{order.version}"'
+
+
+def price_filters(query_params):
+    """ min_price and max_price from the query string as Decimals (None when not given); 400 on bad values """
+    prices = {}
+    for name in ('min_price', 'max_price'):
+        value = query_params.get(name)
+        try:
+            prices[name] = PRICE_FILTER_FIELD.to_internal_value(value) if value else None
+        except ValidationError as e:
+            raise ValidationError({name: e.detail})
+    return prices
+
+
+def if_match_version(request):
+    """ The order version from an If-Match header ("3" or W/"3"), or None without one """
+    value = request.headers.get('If-Match', '').strip()
+    if not value or value == '*':
+        return None
+    value = value.removeprefix('W/').strip('"')
+    if not value.isdigit():
+        raise ValidationError({"If-Match": "Send the order's ETag, e.g. \"3\"."})
+    return int(value)
 
 
 # ✅ Register User (Customer Only)
 @api_view(['POST'])
+@throttle_classes([RegisterIPThrottle])
+@limit_password_hashing
 def register(request):
     try:
         data = request.data.copy()
@@ -42,6 +85,8 @@ def register(request):
 
 # ✅ Login & Obtain JWT Token (Stored in HTTP-Only Cookie)
 @api_view(['POST'])
+@throttle_classes([LoginIPThrottle, LoginUsernameThrottle])
+@limit_password_hashing
 def login_view(request):
     try:
         username = request.data.get('username')
@@ -49,7 +94,7 @@ def login_view(request):
         user = authenticate(username=username, password=password)
 
         if user:
-            refresh = RefreshToken.for_user(user)
+            refresh = refresh_token_for(user)
             response = Response({
                 "message": "Login successful",
             })
@@ -85,12 +130,12 @@ def user_profile(request):
     try:
         if request.method == 'GET':
             # Return user profile with serializer
-            serializer = UserSerializer(request.user)
+            serializer = UserSerializer(full_user(request.user))
             return Response(serializer.data)
 
         if request.method == 'PATCH':
             # Handle PATCH request to update user profile (partial update)
-            serializer = UserSerializer(request.user, data=request.data, partial=True)  # Allows partial update
+            serializer = UserSerializer(full_user(request.user), data=request.data, partial=True)  # Allows partial update
             if serializer.is_valid():
                 serializer.save()  # Save the updated user data (including profile image if present)
                 return Response(serializer.data, status=200)
@@ -100,52 +145,102 @@ def user_profile(request):
         return Response({"error": f"An error occurred: {str(e)}"}, status=500)
 
 
-class FoodItemViewSet(viewsets.ModelViewSet):
+class FoodItemViewSet(SparseFieldsetMixin, viewsets.ModelViewSet):
     queryset = FoodItem.objects.all()
     serializer_class = FoodItemSerializer
+    compact_serializer_class = FoodItemCompactSerializer  # ?view=compact; ?fields=/?exclude= pick fields
     authentication_classes = [CookieJWTAuthentication]
-    pagination_class = CustomPagination
+    pagination_class = MenuPagination  # Keyset pagination over (ordering field, id)
     parser_classes = [MultiPartParser, FormParser]
-    filter_backends = [filters.SearchFilter, filters.OrderingFilter]
-    search_fields = ['name', 'description', 'category']
+    filter_backends = [MenuSearchFilter, RankedOrderingFilter]  # Ranked full-text search on ?search=
     ordering_fields = ['price', 'name']
     ordering = ['name']
+    always_loaded_fields = ordering_fields  # Read by the pagination cursor
 
     def get_permissions(self):
         """Set different permissions for different actions."""
-        if self.action in ['list', 'retrieve']:  # Customers can only view the food items
+        if self.action in ['list', 'retrieve', 'facets']:  # Customers can only view the food items
             return [IsAuthenticated()]  # Allow authenticated users to view food items
-        elif self.action in ['create', 'update', 'partial_update', 'destroy']:  # Only admins can modify food items
+        elif self.action in ['create', 'update', 'partial_update', 'destroy', 'import_menu']:  # Only admins can modify food items
             return [IsAdminUser()]  # Only admin can add, update, or delete food items
         return []
-            
+
+    def list(self, request, *args, **kwargs):
+        """Serve menu pages from the versioned menu cache."""
+        return cached_menu_response(request, lambda: super(FoodItemViewSet, self).list(request, *args, **kwargs))
+
+    def retrieve(self, request, *args, **kwargs):
+        """Serve single menu items from the versioned menu cache."""
+        return cached_menu_response(request, lambda: super(FoodItemViewSet, self).retrieve(request, *args, **kwargs))
+
     def get_queryset(self):
         queryset = super().get_queryset()
         category = self.request.query_params.get('category')
-        min_price = self.request.query_params.get('min_price')
-        max_price = self.request.query_params.get('max_price')
+        prices = price_filters(self.request.query_params)
         
         if category:
-            queryset = queryset.filter(category__icontains=category)
-        if min_price:
-            queryset = queryset.filter(price__gte=min_price)
-        if max_price:
-            queryset = queryset.filter(price__lte=max_price)
+            queryset = queryset.filter(category_normalized=FoodItem.normalize_category(category))
+        if prices['min_price'] is not None:
+            queryset = queryset.filter(price__gte=prices['min_price'])
+        if prices['max_price'] is not None:
+            queryset = queryset.filter(price__lte=prices['max_price'])
         
-        return queryset
+        return self.load_rendered_fields(queryset)
+
+    @action(detail=False, methods=['get'])
+    def facets(self, request):
+        """Category, availability and price-bucket counts for the current search and filters, cached like the menu."""
+
+        def build():
+            queryset = MenuSearchFilter().filter_queryset(request, FoodItem.objects.all(), self)
+            return Response(menu_facets(
+                queryset, category=request.query_params.get('category'), **price_filters(request.query_params),
+            ))
 
+        return cached_menu_response(request, build)
 
-class OrderViewSet(viewsets.ModelViewSet):
+    @action(detail=False, methods=['post'], url_path='import', parser_classes=[ORJSONParser, MessagePackParser, MultiPartParser, FormParser])
+    def import_menu(self, request):
+        """Create or update many items at once from an uploaded CSV/JSON file or a JSON body, matched by name."""
+        upload = request.FILES.get('file')
+        try:
+            if upload is not None:
+                import_format = request.data.get('format') or detect_format(upload.name, upload.content_type)
+                rows = parse_menu(upload.read(), import_format)
+            else:
+                rows = menu_rows(request.data)
+        except MenuImportError as e:
+            raise ValidationError({"file": str(e)})
+
+        report = import_menu(
+            rows,
+            dry_run=request.query_params.get('dry_run') in ('1', 'true'),
+            deactivate_missing=request.query_params.get('deactivate_missing') in ('1', 'true'),
+        )
+        return Response(report, status=status.HTTP_400_BAD_REQUEST if report['errors'] else status.HTTP_200_OK)
+
+
+class OrderViewSet(SparseFieldsetMixin, viewsets.ModelViewSet):
     queryset = Order.objects.all()
     serializer_class = OrderSerializer
+    compact_serializer_class = OrderCompactSerializer  # ?view=compact; ?fields=/?exclude= pick fields
     permission_classes = [IsAuthenticated]  # Require authentication for all users
+    pagination_class = OrderPagination  # Newest first, keyset on id
     authentication_classes = [CookieJWTAuthentication]
 
     def get_queryset(self):
         """Filter orders for the current user (if customer), or show all orders (if admin)."""
+        # Line items and item ids come from two prefetches, so a listing costs a fixed number of queries
+        queryset = self.load_rendered_fields(Order.objects.prefetch_related('items', 'order_items').order_by('-id'))
         if self.request.user.is_admin:
-            return Order.objects.all()  # Admin sees all orders
-        return Order.objects.filter(customer=self.request.user)  # Customer sees only their orders
+            return queryset  # Admin sees all orders
+        return queryset.filter(customer=self.request.user)  # Customer sees only their orders
+
+    def get_throttles(self):
+        """Rate-limit placing orders per customer; reads and status changes aren't throttled."""
+        if self.action in ('create', 'bulk'):
+            return [OrderUserThrottle()]
+        return super().get_throttles()
 
     def perform_create(self, serializer):
         """Ensure only customers can place orders for themselves."""
@@ -154,55 +249,137 @@ class OrderViewSet(viewsets.ModelViewSet):
         
         serializer.save(customer=self.request.user)  # Auto-assign the authenticated customer
 
-    def perform_update(self, serializer):
-        """Allow only Admin to update order status."""
-        if not self.request.user.is_admin:
-            raise PermissionDenied("Only admins can update the order status.")
-        
-        order = self.get_object()
-        previous_status = order.status  # Get the order status before updating
-        new_status = self.request.data.get("status")  # Get the new status from the request
-
-        # Admin can only update the status, not other fields like customer or items
-        serializer.save()
-
-        # Send email notification if order is marked as "Completed"
-        if previous_status != "Completed" and new_status == "Completed":
-            self.send_order_completion_email(order)
-
-
-    def send_order_completion_email(self, order):
-            """Send an email notification to the customer when the order is completed."""
-            subject = "Your Order is Completed!"
-            message = f"Dear {order.customer.username},\n\nYour order #{order.id} has been marked as Completed. Thank you for ordering with us!\n\nBest regards,\nRestaurant Team"
-            recipient_email = order.customer.email
-            
-            send_mail(
-                subject,
-                message,
-                settings.DEFAULT_FROM_EMAIL,  # Ensure you set this in settings.py
-                [recipient_email],
-                fail_silently=False,
-            )
-
-
     def create(self, request, *args, **kwargs):
         """Override the create method to ensure customers can't order for others."""
         if request.user.is_customer:
             # Ensure the request cannot contain a customer field different from the authenticated user
             if request.data.get('customer') and request.data['customer'] != str(request.user.id):
                 raise PermissionDenied("You can only order for yourself.")
-        
-        return super().create(request, *args, **kwargs)
 
-    def update(self, request, *args, **kwargs):
-        """Override the update method to ensure only Admin can update order status."""
-        instance = self.get_object()
+        # A retried POST with the same Idempotency-Key gets the original response instead of a second order
+        return idempotent_response(request, 'orders:create', partial(super().create, request, *args, **kwargs))
 
+    def update(self, request, *args, **kwargs):
+        """Change an order's status (PUT or PATCH, admins only) with one conditional UPDATE; 409 on a conflict."""
         if not request.user.is_admin:
             raise PermissionDenied("Only admins can update the order status.")
 
-        return super().update(request, *args, **kwargs)
+        serializer = OrderStatusSerializer(data=request.data)
+        serializer.is_valid(raise_exception=True)
+        expected_version = if_match_version(request)
+        if expected_version is None:
+            expected_version = serializer.validated_data.get('version')
+
+        try:
+            order, _ = transition_order_status(kwargs['pk'], serializer.validated_data['status'], expected_version)
+        except Order.DoesNotExist:
+            raise NotFound()
+        except StatusConflict as e:
+            return Response(
+                {"detail": str(e), "status": e.order.status, "version": e.order.version},
+                status=status.HTTP_409_CONFLICT, headers={'ETag': order_etag(e.order)},
+            )
+        return Response(self.get_serializer(order).data, headers={'ETag': order_etag(order)})
+
+    def perform_destroy(self, instance):
+        delete_order(instance)  # Also takes the order out of the sales rollups
+
+    @action(detail=False, methods=['post'], url_path='bulk')
+    def bulk(self, request):
+        """Place a batch of orders: one item lookup and two bulk INSERTs in a single transaction."""
+        if not request.user.is_customer:
+            raise PermissionDenied("Only customers can place orders.")
+
+        entries = request.data.get('orders') if isinstance(request.data, dict) else request.data
+        if not isinstance(entries, list) or not entries:
+            raise ValidationError({"orders": "Send a non-empty list of orders."})
+        if len(entries) > BULK_ORDER_LIMIT:
+            raise ValidationError({"orders": f"At most {BULK_ORDER_LIMIT} orders per request."})
+
+        results = [None] * len(entries)
+        valid = []
+        for index, entry in enumerate(entries):
+            entry_serializer = BulkOrderEntrySerializer(data=entry)
+            if entry_serializer.is_valid():
+                valid.append((index, entry_serializer.validated_data))
+            else:
+                results[index] = {"index": index, "status": "error", "errors": entry_serializer.errors}
+
+        food_items = resolve_food_items(
+            item_id for _, data in valid for item_id in data['items'] + [line['food_item'] for line in data['line_items']]
+        )
+
+        baskets = []
+        for index, data in valid:
+            lines = [(line['food_item'], line['quantity']) for line in data['line_items']]
+            missing = sorted({item_id for item_id in data['items'] + [item_id for item_id, _ in lines] if item_id not in food_items})
+            if missing:
+                errors = {"items": [f'Invalid pk "{item_id}" - object does not exist.' for item_id in missing]}
+                results[index] = {"index": index, "status": "error", "errors": errors}
+                continue
+            baskets.append((index, merge_quantities(
+                [food_items[item_id] for item_id in data['items']],
+                [(food_items[item_id], quantity) for item_id, quantity in lines],
+            )))
+
+        orders = place_orders(request.user, [basket for _, basket in baskets]) if baskets else []
+        prefetch_related_objects(orders, 'items', 'order_items')
+        for (index, _), order in zip(baskets, orders):
+            results[index] = {"index": index, "status": "created", "order": OrderSerializer(order).data}
+
+        if len(orders) == len(entries):
+            response_status = status.HTTP_201_CREATED
+        elif orders:
+            response_status = status.HTTP_207_MULTI_STATUS
+        else:
+            response_status = status.HTTP_400_BAD_REQUEST
+        return Response({"results": results}, status=response_status)
+
+    @action(detail=False, methods=['get'], url_path='export', content_negotiation_class=ExportContentNegotiation)
+    def export(self, request):
+        """Stream every matching order with its items as CSV or NDJSON (admin only)."""
+        if not request.user.is_admin:
+            raise PermissionDenied("Only admins can export orders.")
+
+        export_format = request.query_params.get('export_format', 'csv')
+        if export_format not in EXPORT_FORMATS:
+            raise ValidationError({"export_format": f"Choose one of: {', '.join(EXPORT_FORMATS)}."})
+        try:
+            start = parse_bound(request.query_params.get('start'))
+            end = parse_bound(request.query_params.get('end'), end=True)
+        except ValueError as e:
+            raise ValidationError({"date": str(e)})
+
+        orders = export_queryset(start=start, end=end, status=request.query_params.get('status'))
+        response = StreamingHttpResponse(iter_export(export_format, orders), content_type=EXPORT_FORMATS[export_format])
+        response['Content-Disposition'] = f'attachment; filename="orders.{export_format}"'
+        return response
+
+    def analytics_range(self, request):
+        if not request.user.is_admin:
+            raise PermissionDenied("Only admins can view sales analytics.")
+        try:
+            return parse_day_range(request.query_params.get('start'), request.query_params.get('end'))
+        except ValueError as e:
+            raise ValidationError({"date": str(e)})
+
+    @action(detail=False, methods=['get'], url_path='analytics/daily')
+    def analytics_daily(self, request):
+        """Orders and revenue per day, overall and by status, read from the sales rollups (admin only)."""
+        start, end = self.analytics_range(request)
+        return Response({"start": start, "end": end, "days": daily_sales(start, end)})
+
+    @action(detail=False, methods=['get'], url_path='analytics/top-items')
+    def analytics_top_items(self, request):
+        """Best-selling items by units (or ?by=revenue) over a date range, read from the sales rollups (admin only)."""
+        start, end = self.analytics_range(request)
+        by = request.query_params.get('by', 'quantity')
+        if by not in ('quantity', 'revenue'):
+            raise ValidationError({"by": "Choose one of: quantity, revenue."})
+        limit = request.query_params.get('limit', '10')
+        if not limit.isdigit() or not 1 <= int(limit) <= 100:
+            raise ValidationError({"limit": "Choose a number from 1 to 100."})
+        return Response({"start": start, "end": end, "items": top_items(start, end, limit=int(limit), by=by)})
 
 # ✅ AI-Powered Recommendations
 @api_view(['GET'])
@@ -210,7 +387,12 @@ class OrderViewSet(viewsets.ModelViewSet):
 @permission_classes([IsAuthenticated])
 def recommendations(request):
     try:
-        recommended_items = get_recommendations(request.user)
+        item_id = request.query_params.get('item')  # "Customers who ordered this also ordered..."
+        if item_id is not None:
+            if not item_id.isdigit():
+                return Response({"error": "item must be a food item id."}, status=400)
+            item_id = int(item_id)
+        recommended_items = get_recommendations(request.user, item_id=item_id)
         return Response(FoodItemSerializer(recommended_items, many=True).data)
     
     except Exception as e:
@@ -220,6 +402,15 @@ def recommendations(request):
 @api_view(['POST'])
 def logout_view(request):
     try:
+        # Revoke both tokens, so copies of the cookies stop working too
+        tokens = []
+        for cookie, token_class in (("access_token", AccessToken), ("refresh_token", RefreshToken)):
+            try:
+                tokens.append(token_class(request.COOKIES[cookie]))
+            except (KeyError, TokenError):
+                pass  # Missing, expired or invalid: nothing to revoke
+        revoke_tokens(*tokens)
+
         response = Response({"message": "Logged out successfully"})   
         
         # ✅ Clear JWT cookies by setting expiration to past date
@@ -231,3 +422,9 @@ def logout_view(request):
     except Exception as e:
         return Response({"error": f"An error occurred during logout: {str(e)}"}, status=500)
 
+# ✅ Prometheus Metrics (Admin or METRICS_TOKEN only)
+@api_view(['GET'])
+@authentication_classes([CookieJWTAuthentication])
+@permission_classes([IsAdminUser | HasMetricsToken])
+def metrics(request):
+    return HttpResponse(metrics_registry.render(), content_type=PROMETHEUS_CONTENT_TYPE)
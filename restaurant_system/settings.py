@@ -29,7 +29,8 @@ BASE_DIR = Path(__file__).resolve().parent.parent
 SECRET_KEY = os.getenv('SECRET_KEY')
 
 # SECURITY WARNING: Don't run with debug turned on in production!
-DEBUG = True
+# (DEBUG also keeps every executed SQL query in memory.)
+DEBUG = os.getenv('DEBUG', 'False') == 'True'
 
 # Allowed hosts
 ALLOWED_HOSTS = os.getenv('ALLOWED_HOSTS').split(',')
@@ -50,7 +51,9 @@ INSTALLED_APPS = [
 ]
 
 MIDDLEWARE = [
+    "restaurant.middleware.MetricsMiddleware",
     "django.middleware.security.SecurityMiddleware",
+    "restaurant.middleware.ReplicaRoutingMiddleware",
     "django.contrib.sessions.middleware.SessionMiddleware",
     "django.middleware.common.CommonMiddleware",
     "django.middleware.csrf.CsrfViewMiddleware",
@@ -79,19 +82,64 @@ TEMPLATES = [
 
 WSGI_APPLICATION = 'restaurant_system.wsgi.application'
 
+# Serve the hot read endpoints (menu, profile, recommendations) with async views, and enable the
+# order events stream. Only worth enabling when running under an ASGI server (see gunicorn.conf.py).
+ASYNC_READ_VIEWS = os.getenv('ASYNC_READ_VIEWS', 'False') == 'True'
+
+# Fan-out for the order events stream (/api/orders/events/, ASGI only): 'postgres' (LISTEN/NOTIFY, reaches
+# every worker process) or 'memory' (this process only). Unset picks 'postgres' on a PostgreSQL database.
+ORDER_EVENTS_BROKER = os.getenv('ORDER_EVENTS_BROKER')
+
+
+# Shared cache for rate limits and cached menu responses. Without REDIS_URL each worker process has its
+# own in-memory cache, so limits and invalidations only apply per process.
+if os.getenv('REDIS_URL'):
+    CACHES = {
+        'default': {
+            'BACKEND': 'django.core.cache.backends.redis.RedisCache',
+            'LOCATION': os.getenv('REDIS_URL'),
+        }
+    }
+
 
 # Database configuration
+# Connections are kept open for DB_CONN_MAX_AGE seconds and checked before reuse, instead of a new
+# TCP + auth handshake per request. Under ASGI, Django can't reuse connections across requests, so set
+# DB_CONN_MAX_AGE=0 there and put a pooler such as PgBouncer in front of PostgreSQL instead.
 DATABASES = {
     'default': {
-        'ENGINE': 'django.db.backends.postgresql',
+        'ENGINE': os.getenv('DB_ENGINE', 'django.db.backends.postgresql'),
         'NAME': os.getenv('DB_NAME'),
         'USER': os.getenv('DB_USER'),
         'PASSWORD': os.getenv('DB_PASSWORD'),
         'HOST': os.getenv('DB_HOST'),
         'PORT': os.getenv('DB_PORT'),
+        'CONN_MAX_AGE': int(os.getenv('DB_CONN_MAX_AGE', '60')),
+        'CONN_HEALTH_CHECKS': True,
     }
 }
 
+# Optional read replica: safe requests read from it, while writes and reads right after a write stay
+# on the primary (see restaurant/db_router.py). Unset DB_REPLICA_* values fall back to the primary's.
+if os.getenv('DB_REPLICA_HOST') or os.getenv('DB_REPLICA_NAME'):
+    DATABASES['replica'] = {
+        **DATABASES['default'],
+        'NAME': os.getenv('DB_REPLICA_NAME', DATABASES['default']['NAME']),
+        'USER': os.getenv('DB_REPLICA_USER', DATABASES['default']['USER']),
+        'PASSWORD': os.getenv('DB_REPLICA_PASSWORD', DATABASES['default']['PASSWORD']),
+        'HOST': os.getenv('DB_REPLICA_HOST', DATABASES['default']['HOST']),
+        'PORT': os.getenv('DB_REPLICA_PORT', DATABASES['default']['PORT']),
+        'TEST': {'MIRROR': 'default'},
+    }
+    REPLICA_DATABASE = 'replica'
+else:
+    REPLICA_DATABASE = None
+
+DATABASE_ROUTERS = ['restaurant.db_router.PrimaryReplicaRouter']
+
+# Seconds a client's reads stay on the primary after it writes, to cover replication lag
+REPLICA_PIN_SECONDS = int(os.getenv('REPLICA_PIN_SECONDS', '5'))
+
 # Authentication Model
 AUTH_USER_MODEL = 'restaurant.CustomUser'
 
@@ -100,14 +148,77 @@ REST_FRAMEWORK = {
     'DEFAULT_AUTHENTICATION_CLASSES': (
         'rest_framework_simplejwt.authentication.JWTAuthentication',  # Header-based JWT
     ),
+    # orjson-backed JSON by default, MessagePack for "Accept: application/msgpack" (see restaurant/renderers.py)
+    'DEFAULT_RENDERER_CLASSES': (
+        'restaurant.renderers.ORJSONRenderer',
+        'restaurant.renderers.MessagePackRenderer',
+        'rest_framework.renderers.BrowsableAPIRenderer',
+    ),
+    'DEFAULT_PARSER_CLASSES': (
+        'restaurant.renderers.ORJSONParser',
+        'restaurant.renderers.MessagePackParser',
+        'rest_framework.parsers.FormParser',
+        'rest_framework.parsers.MultiPartParser',
+    ),
+    # Token buckets for login, sign-up and ordering (see restaurant/throttling.py): burst size / refill period
+    'DEFAULT_THROTTLE_RATES': {
+        'login_ip': '30/min',
+        'login_username': '10/min',
+        'register_ip': '10/hour',
+        'orders_user': '30/min',
+    },
+    # Proxies in front of the app whose X-Forwarded-For entries are trusted for the client address
+    'NUM_PROXIES': int(os.getenv('NUM_PROXIES', '0')),
+}
+
+# Password hashes (login, sign-up) allowed to run at once per worker process, and how long a request waits
+# for a free slot before getting a 503; keeps a login burst from starving every other request of CPU
+PASSWORD_HASH_CONCURRENCY = int(os.getenv('PASSWORD_HASH_CONCURRENCY', '2'))
+PASSWORD_HASH_WAIT_SECONDS = 0.5
+
+# Cache of users resolved by CookieJWTAuthentication (TTL in seconds, 0 disables it).
+# With REDIS_URL, entries are shared between worker processes through the default cache, so a role change,
+# deactivation or password change made in one worker invalidates them for all. Several workers without a
+# shared cache each keep their own copies, so those only live a few seconds.
+AUTH_USER_CACHE = {
+    "TTL": 5 if int(os.getenv('GUNICORN_WORKERS', '1')) > 1 and not os.getenv('REDIS_URL') else 300,
+    "MAX_SIZE": 1024,
+    "CACHE_ALIAS": 'default' if os.getenv('REDIS_URL') else None,
+}
+
+# Per-view request metrics served at /metrics (admins, or "Authorization: Bearer <METRICS_TOKEN>").
+# With several worker processes, point METRICS_DIR at a directory they share so /metrics covers all of them.
+METRICS_DIR = os.getenv('METRICS_DIR')
+METRICS_FLUSH_INTERVAL = 5
+METRICS_TOKEN = os.getenv('METRICS_TOKEN')
+
+# Seconds an Idempotency-Key (and the response stored with it) is honoured for order placement
+IDEMPOTENCY_KEY_TTL = 24 * 60 * 60
+
+# Put the is_admin/is_customer/is_staff flags in issued tokens and authenticate from them without loading the
+# user; other fields load on first use. Role changes reach a client at its next token refresh.
+AUTH_USER_FROM_CLAIMS = os.getenv('AUTH_USER_FROM_CLAIMS', 'False') == 'True'
+
+# Revoked JWTs (logout, refresh rotation): each process checks a Bloom filter, synced with the
+# database every SYNC_SECONDS and rebuilt (dropping expired tokens) every REBUILD_SECONDS
+TOKEN_REVOCATION = {
+    "SYNC_SECONDS": 5,
+    "REBUILD_SECONDS": 3600,
+    "CAPACITY": 100_000,
+    "ERROR_RATE": 0.001,
 }
 
+# Seconds a cached menu response lives; entries are also dropped whenever the menu version changes
+MENU_CACHE_TIMEOUT = 300
+
 # JWT & Cookie Configuration
 SIMPLE_JWT = {
     "ACCESS_TOKEN_LIFETIME": timedelta(minutes=60),
     "REFRESH_TOKEN_LIFETIME": timedelta(days=7),
     "ROTATE_REFRESH_TOKENS": True,
     "BLACKLIST_AFTER_ROTATION": True,
+    # Rotated refresh tokens are revoked by restaurant/revocation.py (simplejwt's blacklist app isn't installed)
+    "TOKEN_REFRESH_SERIALIZER": "restaurant.serializers.RevokingTokenRefreshSerializer",
     "AUTH_HEADER_TYPES": ("Bearer",),
     "AUTH_COOKIE": "access_token",
     "AUTH_COOKIE_HTTP_ONLY": True,
@@ -135,6 +246,8 @@ STATIC_ROOT = BASE_DIR / 'staticfiles'
 
 MEDIA_URL = '/media/'
 MEDIA_ROOT = BASE_DIR / 'media'
+# Let Django serve MEDIA_ROOT itself (see restaurant_system/urls.py); defaults to DEBUG
+SERVE_MEDIA = os.getenv('SERVE_MEDIA', str(DEBUG)) == 'True'
 
 # Default primary key field type
 DEFAULT_AUTO_FIELD = 'django.db.models.BigAutoField'
@@ -16,10 +16,12 @@ Including another URLconf
 """
 #project urls.py
 
+from django.conf import settings
 from django.contrib import admin
-from django.urls import path, include
+from django.urls import path, include, re_path
 from drf_yasg import openapi
 from drf_yasg.views import get_schema_view
+from restaurant.images import serve_media
 
 schema_view = get_schema_view(
    openapi.Info(
@@ -36,3 +38,10 @@ urlpatterns = [
     path('swagger/', schema_view.with_ui('swagger', cache_timeout=0), name='schema-swagger-ui'),
     path('', include('restaurant.urls')),
 ]
+
+# Media is normally served by the web server in front of Django (with the same immutable Cache-Control
+# for content-hashed files); SERVE_MEDIA lets Django serve it itself, e.g. in development.
+if getattr(settings, 'SERVE_MEDIA', settings.DEBUG):
+    urlpatterns += [
+        re_path(r'^%s(?P<path>.*)$' % settings.MEDIA_URL.lstrip('/'), serve_media),
+    ]